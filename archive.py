@@ -0,0 +1,63 @@
+"""Persistent archive of finished downloads so repeated URLs are skipped before any network access.
+
+Videos are identified the same way as yt-dlp's --download-archive ("<extractor> <id>"),
+and recorded together with the format and output folder they were downloaded to.
+"""
+import os
+import sqlite3
+import threading
+import time
+from engine import get_app_data_dir, video_key_from_url, make_video_key
+
+class DownloadArchive:
+    """SQLite-backed set of (video, format, output folder) entries"""
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_app_data_dir(), 'archive.sqlite3')
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS archive ("
+                " video_key TEXT NOT NULL,"
+                " format TEXT NOT NULL,"
+                " output_path TEXT NOT NULL,"
+                " title TEXT,"
+                " downloaded_at REAL,"
+                " PRIMARY KEY (video_key, format, output_path))")
+
+    @staticmethod
+    def key_for_url(url):
+        return video_key_from_url(url)
+
+    @staticmethod
+    def key_for_info(info):
+        extractor_key = info.get('extractor_key') or info.get('ie_key')
+        if not extractor_key or not info.get('id'):
+            return None
+        return make_video_key(extractor_key, info['id'])
+
+    @staticmethod
+    def _normalize_path(output_path):
+        return os.path.normcase(os.path.abspath(output_path or '.'))
+
+    def contains(self, video_key, format_type, output_path):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM archive WHERE video_key = ? AND format = ? AND output_path = ?",
+                (video_key, format_type, self._normalize_path(output_path))).fetchone()
+        return row is not None
+
+    def add(self, video_key, format_type, output_path, title=None):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO archive (video_key, format, output_path, title, downloaded_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (video_key, format_type, self._normalize_path(output_path), title, time.time()))
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM archive").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,193 @@
+"""Bandwidth scheduler shared by all running downloads.
+
+Every job draws from its own token bucket. The rate of each bucket is the job's fair
+share of the aggregate limit (split evenly between the jobs that are actually
+downloading), capped by the optional per-job limit. Limits can change at any time and
+apply to the very next block downloaded. Time-of-day profiles replace the aggregate
+limit inside their window, e.g. full speed at night and 2 MB/s during office hours.
+"""
+import json
+import os
+import re
+import threading
+import time
+
+# A job that hasn't downloaded anything for this long no longer counts towards the fair share
+ACTIVE_WINDOW = 2.0
+# Longest single sleep, so cancellation and limit changes are picked up quickly
+MAX_SLEEP = 0.25
+# Seconds worth of tokens a bucket can save up
+BURST_SECONDS = 0.5
+
+TIME_WINDOW_PATTERN = re.compile(r'^(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})$')
+
+def parse_rate(value):
+    """Turn '2M', '500K', '1048576' or 0/None/'' into bytes per second (None = unlimited)"""
+    if value in (None, '', 0, '0'):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if value > 0 else None
+    from yt_dlp.utils import parse_bytes
+    rate = parse_bytes(str(value).strip())
+    if rate is None:
+        raise ValueError(f"Invalid rate: {value!r} (use e.g. 500K or 2M)")
+    return float(rate) if rate > 0 else None
+
+def format_rate(rate):
+    if not rate:
+        return 'unlimited'
+    from yt_dlp.utils import format_bytes
+    return f"{format_bytes(rate)}/s"
+
+class TimeProfile:
+    """An aggregate limit that applies between two times of day (the window may wrap midnight)"""
+    def __init__(self, start_minute, end_minute, rate):
+        self.start_minute = start_minute
+        self.end_minute = end_minute
+        self.rate = rate
+
+    @classmethod
+    def parse(cls, text):
+        """Parse 'HH:MM-HH:MM=RATE', e.g. '09:00-18:00=2M' or '22:00-06:00=0' (0 = unlimited)"""
+        window, _, rate = text.partition('=')
+        match = TIME_WINDOW_PATTERN.match(window.strip())
+        if not match or not rate.strip():
+            raise ValueError(f"Invalid schedule entry: {text!r} (use HH:MM-HH:MM=RATE)")
+        start_hour, start_min, end_hour, end_min = (int(part) for part in match.groups())
+        if start_hour > 23 or end_hour > 24 or start_min > 59 or end_min > 59:
+            raise ValueError(f"Invalid time in schedule entry: {text!r}")
+        return cls(start_hour * 60 + start_min, end_hour * 60 + end_min, parse_rate(rate.strip()))
+
+    def contains(self, minute):
+        if self.start_minute <= self.end_minute:
+            return self.start_minute <= minute < self.end_minute
+        return minute >= self.start_minute or minute < self.end_minute
+
+    def __str__(self):
+        return (f"{self.start_minute // 60:02d}:{self.start_minute % 60:02d}-"
+                f"{self.end_minute // 60:02d}:{self.end_minute % 60:02d}={format_rate(self.rate)}")
+
+class TokenBucket:
+    def __init__(self):
+        self.tokens = 0.0
+        self.updated_at = time.monotonic()
+        self.last_used = 0.0
+
+    def take(self, nbytes, rate, now):
+        """Spend nbytes and return how long to wait so the bucket stays within rate"""
+        if not rate:
+            self.tokens = 0.0
+            self.updated_at = now
+            return 0.0
+        self.tokens = min(self.tokens + (now - self.updated_at) * rate, rate * BURST_SECONDS)
+        self.updated_at = now
+        self.tokens -= nbytes
+        return -self.tokens / rate if self.tokens < 0 else 0.0
+
+class BandwidthScheduler:
+    """Token-bucket rate limiting with an aggregate cap, per-job caps and time-of-day profiles"""
+    def __init__(self, aggregate_limit=None, per_job_limit=None, schedule=None):
+        self.lock = threading.Lock()
+        self.aggregate_limit = parse_rate(aggregate_limit)
+        self.per_job_limit = parse_rate(per_job_limit)
+        self.schedule = list(schedule or [])
+        self.buckets = {}
+
+    def set_limits(self, aggregate_limit=None, per_job_limit=None, schedule=None):
+        """Replace the limits; running downloads pick them up on their next block"""
+        aggregate_limit = parse_rate(aggregate_limit)
+        per_job_limit = parse_rate(per_job_limit)
+        with self.lock:
+            self.aggregate_limit = aggregate_limit
+            self.per_job_limit = per_job_limit
+            if schedule is not None:
+                self.schedule = list(schedule)
+
+    def current_aggregate_limit(self, now=None):
+        """The aggregate limit in force right now, taking the schedule into account"""
+        local = time.localtime(now)
+        minute = local.tm_hour * 60 + local.tm_min
+        with self.lock:
+            for profile in self.schedule:
+                if profile.contains(minute):
+                    return profile.rate
+            return self.aggregate_limit
+
+    def job_rate(self, job_id, now):
+        """Fair share of the aggregate limit for one job, capped by the per-job limit"""
+        aggregate = self.current_aggregate_limit()
+        with self.lock:
+            active = sum(1 for key, bucket in self.buckets.items()
+                         if key == job_id or now - bucket.last_used < ACTIVE_WINDOW)
+            per_job = self.per_job_limit
+        share = aggregate / max(1, active) if aggregate else None
+        if share and per_job:
+            return min(share, per_job)
+        return share or per_job
+
+    def consume(self, job_id, nbytes, cancel_event=None):
+        """Account for nbytes downloaded by a job, sleeping as long as its share requires"""
+        if nbytes <= 0:
+            return
+        now = time.monotonic()
+        rate = self.job_rate(job_id, now)
+        with self.lock:
+            bucket = self.buckets.get(job_id)
+            if bucket is None:
+                bucket = self.buckets[job_id] = TokenBucket()
+            bucket.last_used = now
+            delay = bucket.take(nbytes, rate, now)
+        deadline = now + delay
+        while delay > 0:
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            time.sleep(min(delay, MAX_SLEEP))
+            delay = deadline - time.monotonic()
+
+    def release(self, job_id):
+        """Forget a finished job so it no longer counts towards the fair share"""
+        with self.lock:
+            self.buckets.pop(job_id, None)
+
+    def describe(self):
+        current = self.current_aggregate_limit()
+        with self.lock:
+            per_job = self.per_job_limit
+        return f"Limit: {format_rate(current)}" + (f", {format_rate(per_job)} per job" if per_job else "")
+
+def load_limits_file(path):
+    """Read {"aggregate": "2M", "per_job": "500K", "schedule": ["09:00-18:00=1M"]} from a JSON file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return (parse_rate(data.get('aggregate')), parse_rate(data.get('per_job')),
+            [TimeProfile.parse(entry) for entry in data.get('schedule') or []])
+
+def watch_limits_file(scheduler, path, on_change=None, interval=1.0):
+    """Apply a limits file to the scheduler now and whenever it changes, from a daemon thread"""
+    state = {'mtime': None}
+
+    def check():
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return
+        if mtime == state['mtime']:
+            return
+        state['mtime'] = mtime
+        try:
+            aggregate, per_job, schedule = load_limits_file(path)
+        except (OSError, ValueError) as e:
+            if on_change:
+                on_change(None, e)
+            return
+        scheduler.set_limits(aggregate, per_job, schedule)
+        if on_change:
+            on_change(scheduler, None)
+
+    def watch():
+        while True:
+            time.sleep(interval)
+            check()
+
+    check()
+    threading.Thread(target=watch, daemon=True).start()
@@ -0,0 +1,531 @@
+"""Benchmarks for the download pipeline, run against a local fake media server.
+
+No network access is needed: a synthetic H.264 video stream and AAC audio stream are
+encoded with FFmpeg and served from 127.0.0.1 as a DASH manifest per job, with
+configurable latency and bandwidth. Each format runs a batch of jobs through the
+same DownloadQueue the GUI and CLI use and the results are written as JSON:
+
+    python benchmark.py --jobs 8 --workers 3 --size 20M -o bench.json
+    python benchmark.py --bandwidth 5M --latency 0.05 --compare bench.json
+    python benchmark.py --profile cprofile --profile-dir profiles
+"""
+import argparse
+import cProfile
+import json
+import os
+import platform
+import queue
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import yt_dlp
+from engine import (ProgressHook, DownloadQueue, DownloadJob, fetch_media, postprocess_media, run_ffmpeg,
+                    get_default_ffmpeg_path, DEFAULT_PROGRESS_INTERVAL)
+from bandwidth import parse_rate
+from retry import RetryController, RetryPolicy, DEFAULT_POLICIES
+from presets import PRESETS
+from metrics import MetricsAggregator, percentile, POSTPROCESS_PHASES
+
+# Same interval as the GUI's log flush loop
+UI_DRAIN_INTERVAL = 0.1
+SERVER_BLOCK_SIZE = 64 * 1024
+AUDIO_BITRATE = 128 * 1000
+
+MANIFEST_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" mediaPresentationDuration="PT{duration}S"
+     profiles="urn:mpeg:dash:profile:isoff-on-demand:2011">
+  <Period>
+    <AdaptationSet mimeType="video/mp4" contentType="video">
+      <Representation id="video" codecs="avc1.64001f" width="640" height="360" bandwidth="{video_bitrate}">
+        <BaseURL>{base_url}/media/video.mp4</BaseURL>
+      </Representation>
+    </AdaptationSet>
+    <AdaptationSet mimeType="audio/mp4" contentType="audio">
+      <Representation id="audio" codecs="mp4a.40.2" audioSamplingRate="44100" bandwidth="{audio_bitrate}">
+        <BaseURL>{base_url}/media/audio.m4a</BaseURL>
+      </Representation>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+RANGE_PATTERN = re.compile(r'bytes=(\d+)-(\d*)')
+
+def generate_media(ffmpeg_path, directory, size, duration):
+    """Encode noise video + sine audio whose combined size is roughly `size` bytes"""
+    video_bitrate = max(100 * 1000, int(size * 8 / duration) - AUDIO_BITRATE)
+    # Noise doesn't compress, so the encoder actually reaches the requested bitrate
+    run_ffmpeg(ffmpeg_path, [
+        '-f', 'lavfi', '-i', f'nullsrc=s=640x360:r=25:d={duration},geq=random(1)*255:128:128',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-b:v', str(video_bitrate),
+        '-maxrate', str(video_bitrate), '-bufsize', str(video_bitrate), '-pix_fmt', 'yuv420p',
+        '-movflags', '+faststart', os.path.join(directory, 'video.mp4')])
+    run_ffmpeg(ffmpeg_path, [
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+        '-c:a', 'aac', '-b:a', str(AUDIO_BITRATE), os.path.join(directory, 'audio.m4a')])
+    return video_bitrate
+
+class FakeMediaServer:
+    """Serve DASH manifests and byte-range media from a folder with added latency and bandwidth caps"""
+    def __init__(self, directory, duration, video_bitrate, latency=0.0, bandwidth=None):
+        self.directory = directory
+        self.duration = duration
+        self.video_bitrate = video_bitrate
+        # Seconds before every response, and bytes per second per connection (None = unlimited)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self.handler_class())
+        self.httpd.daemon_threads = True
+        self.base_url = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def video_url(self, index):
+        # A distinct URL per job, so every job extracts and writes its own files
+        return f'{self.base_url}/v/{index}.mpd'
+
+    def count(self, nbytes):
+        with self.lock:
+            self.bytes_sent += nbytes
+
+    def handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with server.lock:
+                    server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                if self.path.startswith('/v/') and self.path.endswith('.mpd'):
+                    body = MANIFEST_TEMPLATE.format(duration=server.duration, base_url=server.base_url,
+                                                    video_bitrate=server.video_bitrate,
+                                                    audio_bitrate=AUDIO_BITRATE).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/dash+xml')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                name = os.path.basename(self.path.split('?')[0])
+                path = os.path.join(server.directory, name)
+                if not self.path.startswith('/media/') or not os.path.isfile(path):
+                    self.send_error(404)
+                    return
+                self.send_media(path)
+
+            def send_media(self, path):
+                size = os.path.getsize(path)
+                start, end = 0, size - 1
+                match = RANGE_PATTERN.match(self.headers.get('Range') or '')
+                if match:
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+                    if start >= size:
+                        self.send_error(416)
+                        return
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Type', 'audio/mp4' if path.endswith('.m4a') else 'video/mp4')
+                self.send_header('Content-Length', str(end - start + 1))
+                self.send_header('Accept-Ranges', 'bytes')
+                self.end_headers()
+                sent = 0
+                started = time.monotonic()
+                try:
+                    with open(path, 'rb') as f:
+                        f.seek(start)
+                        while sent < end - start + 1:
+                            block = f.read(min(SERVER_BLOCK_SIZE, end - start + 1 - sent))
+                            if not block:
+                                break
+                            self.wfile.write(block)
+                            sent += len(block)
+                            if server.bandwidth:
+                                # Pace this connection to the configured rate
+                                delay = sent / server.bandwidth - (time.monotonic() - started)
+                                if delay > 0:
+                                    time.sleep(delay)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    server.count(sent)
+
+        return Handler
+
+class TimedQueue(queue.Queue):
+    """Log queue that stamps every message with the time it was put"""
+    def _put(self, item):
+        super()._put((time.perf_counter(), item))
+
+class UIQueueMonitor:
+    """Drain a TimedQueue the way the GUI does and record how long messages waited"""
+    def __init__(self, log_queue, interval=UI_DRAIN_INTERVAL):
+        self.log_queue = log_queue
+        self.interval = interval
+        self.latencies = []
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self._drain()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self._drain()
+
+    def _drain(self):
+        now = time.perf_counter()
+        try:
+            while True:
+                put_at, _ = self.log_queue.get_nowait()
+                self.latencies.append(now - put_at)
+        except queue.Empty:
+            pass
+
+    def summary(self):
+        return {
+            'messages': len(self.latencies),
+            'latency_p50_ms': ms(percentile(self.latencies, 50)),
+            'latency_p95_ms': ms(percentile(self.latencies, 95)),
+            'latency_max_ms': ms(max(self.latencies) if self.latencies else None),
+        }
+
+def ms(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+def peak_rss():
+    """Peak resident memory of this process so far in bytes (None where it can't be read).
+
+    This is the peak over the whole run, not per batch: a batch only raises it if it
+    needs more memory than everything before it.
+    """
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def git_revision():
+    """The checked-out commit (with a '-dirty' suffix for local changes), or None outside git"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=directory,
+                                  capture_output=True, text=True, timeout=10).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=directory,
+                               capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return (revision + ('-dirty' if dirty else '')) if revision else None
+
+def bench_progress_hook(iterations, min_interval):
+    """Microsecond cost of one ProgressHook call as it is wired up in a job"""
+    metrics = MetricsAggregator()
+    metrics.job_started(1)
+    hook = ProgressHook(queue.Queue(), job_id=1, cancel_event=threading.Event(),
+                        on_progress=metrics.handle, min_interval=min_interval)
+    total = iterations * SERVER_BLOCK_SIZE
+    started = time.perf_counter()
+    for i in range(iterations):
+        hook({'status': 'downloading', 'filename': 'bench.f1.mp4', 'downloaded_bytes': i * SERVER_BLOCK_SIZE,
+              'total_bytes': total, 'speed': 1024 * 1024, 'eta': iterations - i})
+    elapsed = time.perf_counter() - started
+    return {
+        'iterations': iterations,
+        'min_interval': min_interval,
+        'us_per_call': round(elapsed / iterations * 1e6, 3),
+        'log_messages': hook.log_queue.qsize(),
+    }
+
+def run_batch(server, args, format_type, ffmpeg_path, output_path):
+    """Run args.jobs downloads through a DownloadQueue and return the measurements"""
+    log_queue = TimedQueue()
+    monitor = UIQueueMonitor(log_queue).start()
+    metrics = MetricsAggregator()
+    progress = {'events': 0}
+    progress_lock = threading.Lock()
+
+    def on_progress(event):
+        # Only counts; the cost of the hook itself is measured by bench_progress_hook
+        with progress_lock:
+            progress['events'] += 1
+
+    # A failed job counts as failed instead of adding its retry backoff to the timings
+    retry_controller = RetryController({error_class: RetryPolicy(max_attempts=1)
+                                        for error_class in DEFAULT_POLICIES})
+    download_queue = DownloadQueue(log_queue, max_workers=args.workers, on_progress=on_progress,
+                                   progress_interval=args.progress_interval, metrics=metrics,
+                                   segment_connections=args.connections, retry_controller=retry_controller)
+    requests_before, bytes_before = server.requests, server.bytes_sent
+    started = time.perf_counter()
+    for index in range(args.jobs):
+        download_queue.add(server.video_url(f'{format_type}-{index}'), output_path, ffmpeg_path, format_type)
+    download_queue.wait()
+    elapsed = time.perf_counter() - started
+    monitor.stop()
+    download_queue.session_pool.close()
+
+    counts = download_queue.counts()
+    stats = metrics.snapshot()['global']
+    postprocess_seconds = sum(stats['phase_seconds'][phase] for phase in POSTPROCESS_PHASES)
+    errors = sorted({job.error for job in download_queue.jobs.values() if job.error})
+    return {
+        'format': format_type,
+        'jobs': args.jobs,
+        'done': counts[DownloadJob.DONE],
+        'failed': counts[DownloadJob.FAILED],
+        'errors': errors[:5],
+        'elapsed_seconds': round(elapsed, 3),
+        'jobs_per_minute': round(counts[DownloadJob.DONE] / elapsed * 60, 3) if elapsed else None,
+        'bytes_downloaded': stats['bytes_downloaded'],
+        'bytes_per_second': round(stats['bytes_downloaded'] / elapsed) if elapsed else None,
+        'server_requests': server.requests - requests_before,
+        'server_bytes': server.bytes_sent - bytes_before,
+        'phase_seconds': {phase: round(seconds, 3) for phase, seconds in stats['phase_seconds'].items()},
+        'postprocess_seconds_per_job': (round(postprocess_seconds / counts[DownloadJob.DONE], 3)
+                                        if counts[DownloadJob.DONE] else None),
+        'job_duration_p50': stats['job_duration_p50'],
+        'job_duration_p95': stats['job_duration_p95'],
+        'progress_events': progress['events'],
+        'ui_queue': monitor.summary(),
+    }
+
+def make_profiler(kind):
+    if kind == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise SystemExit("Error: --profile pyinstrument needs the pyinstrument package (pip install pyinstrument)")
+        return Profiler()
+    return cProfile.Profile()
+
+def save_profile(profiler, kind, path_base):
+    if kind == 'pyinstrument':
+        path = path_base + '.html'
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(profiler.output_html())
+    else:
+        path = path_base + '.prof'
+        profiler.dump_stats(path)
+    return path
+
+def profile_phases(server, args, format_type, ffmpeg_path, output_path):
+    """Run one job on this thread with a profiler around each pipeline stage"""
+    os.makedirs(args.profile_dir, exist_ok=True)
+    url = server.video_url(f'{format_type}-profile')
+    profiles = {}
+
+    profiler = make_profiler(args.profile)
+    profiler.start() if args.profile == 'pyinstrument' else profiler.enable()
+    try:
+        fetched = fetch_media(url, output_path, ffmpeg_path, None, format_type, job_id=0,
+                              progress_interval=args.progress_interval, segment_connections=args.connections)
+    finally:
+        profiler.stop() if args.profile == 'pyinstrument' else profiler.disable()
+    profiles['fetch'] = save_profile(profiler, args.profile, os.path.join(args.profile_dir, f'{format_type}-fetch'))
+
+    profiler = make_profiler(args.profile)
+    profiler.start() if args.profile == 'pyinstrument' else profiler.enable()
+    try:
+        postprocess_media(fetched)
+    finally:
+        profiler.stop() if args.profile == 'pyinstrument' else profiler.disable()
+    profiles['postprocess'] = save_profile(profiler, args.profile,
+                                           os.path.join(args.profile_dir, f'{format_type}-postprocess'))
+    return profiles
+
+# Metrics compared by --compare, and whether a higher value is better
+COMPARED_METRICS = (
+    ('jobs_per_minute', True),
+    ('bytes_per_second', True),
+    ('postprocess_seconds_per_job', False),
+    ('job_duration_p50', False),
+    ('ui_queue.latency_p95_ms', False),
+    ('peak_rss_bytes_cumulative', False),
+)
+
+def lookup(data, dotted):
+    for key in dotted.split('.'):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+def compare_reports(baseline, report):
+    """Return lines comparing the key metrics of each format against a baseline report"""
+    lines = [f"Comparing {report.get('revision')} against {baseline.get('revision')}:"]
+    if baseline.get('config') != report['config']:
+        lines.append("  Note: the reports were made with different settings")
+    baseline_batches = {batch['format']: batch for batch in baseline.get('batches', [])}
+    for batch in report['batches']:
+        old_batch = baseline_batches.get(batch['format'])
+        if old_batch is None:
+            continue
+        for name, higher_is_better in COMPARED_METRICS:
+            old, new = lookup(old_batch, name), lookup(batch, name)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            better = (change > 0) == higher_is_better
+            verdict = 'same' if abs(change) < 2 else ('better' if better else 'worse')
+            lines.append(f"  {batch['format']:>8} {name:<30} {old:>14.3f} -> {new:>14.3f} "
+                         f"({change:+.1f}%, {verdict})")
+    micro = {entry['min_interval']: entry for entry in baseline.get('progress_hook', [])}
+    for entry in report['progress_hook']:
+        old = micro.get(entry['min_interval'])
+        if old and old['us_per_call']:
+            change = (entry['us_per_call'] - old['us_per_call']) / old['us_per_call'] * 100
+            lines.append(f"  ProgressHook (interval {entry['min_interval']}s) us/call "
+                         f"{old['us_per_call']:.3f} -> {entry['us_per_call']:.3f} ({change:+.1f}%)")
+    return lines
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the download pipeline against a local fake media server (no network needed).")
+    parser.add_argument('--jobs', type=int, default=6,
+                        help="downloads per format (default: 6)")
+    parser.add_argument('--workers', type=int, default=3,
+                        help="parallel download workers (default: 3)")
+    parser.add_argument('--formats', default='mp4,mp3',
+                        help="comma-separated presets to benchmark (default: mp4,mp3)")
+    parser.add_argument('--size', default='8M', metavar='BYTES',
+                        help="approximate size of each synthetic video, e.g. 8M (default: 8M)")
+    parser.add_argument('--duration', type=int, default=10, metavar='SECONDS',
+                        help="length of the synthetic media (default: 10)")
+    parser.add_argument('--latency', type=float, default=0.0, metavar='SECONDS',
+                        help="delay before every server response (default: 0)")
+    parser.add_argument('--bandwidth', default=None, metavar='RATE',
+                        help="server bandwidth per connection, e.g. 5M (default: unlimited)")
+    parser.add_argument('--connections', type=int, default=1, metavar='N',
+                        help="connections per file, as in the app (default: 1)")
+    parser.add_argument('--progress-interval', type=float, default=DEFAULT_PROGRESS_INTERVAL, metavar='SECONDS',
+                        help=f"minimum seconds between progress updates per file (default: {DEFAULT_PROGRESS_INTERVAL})")
+    parser.add_argument('--hook-iterations', type=int, default=100000, metavar='N',
+                        help="calls for the ProgressHook micro-benchmark (default: 100000)")
+    parser.add_argument('--ffmpeg', default=None,
+                        help="FFmpeg binary or folder, used to create the media and post-process (default: auto-detect)")
+    parser.add_argument('--profile', choices=['cprofile', 'pyinstrument'], default=None,
+                        help="also profile the fetch and post-processing stages of one extra job")
+    parser.add_argument('--profile-dir', default='profiles', metavar='DIR',
+                        help="where profiles are written (default: ./profiles)")
+    parser.add_argument('-o', '--output', default=None, metavar='FILE',
+                        help="write the JSON report here (default: stdout)")
+    parser.add_argument('--compare', default=None, metavar='FILE',
+                        help="print the change of key metrics against an earlier report")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    formats = [name.strip() for name in args.formats.split(',') if name.strip()]
+    if any(name not in PRESETS for name in formats) or args.jobs < 1 or args.workers < 1:
+        print(f"Error: --formats takes presets out of {', '.join(PRESETS)}, --jobs and --workers must be at least 1",
+              file=sys.stderr)
+        return 2
+    try:
+        size = parse_rate(args.size)
+        bandwidth = parse_rate(args.bandwidth)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    baseline = None
+    if args.compare:
+        try:
+            with open(args.compare, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error: could not read {args.compare}: {e}", file=sys.stderr)
+            return 2
+
+    ffmpeg_path = args.ffmpeg or get_default_ffmpeg_path()
+    work_dir = tempfile.mkdtemp(prefix='ytdl-bench-')
+    try:
+        media_dir = os.path.join(work_dir, 'media')
+        os.makedirs(media_dir)
+        print(f"Encoding {args.duration}s of synthetic media (~{args.size})...", file=sys.stderr)
+        try:
+            video_bitrate = generate_media(ffmpeg_path, media_dir, size or 8 * 1024 * 1024, args.duration)
+        except Exception as e:
+            print(f"Error: could not create the synthetic media with FFmpeg: {e}", file=sys.stderr)
+            return 2
+        media_bytes = sum(os.path.getsize(os.path.join(media_dir, name)) for name in os.listdir(media_dir))
+
+        server = FakeMediaServer(media_dir, args.duration, video_bitrate, args.latency, bandwidth).start()
+        report = {
+            'revision': git_revision(),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'yt_dlp': yt_dlp.version.__version__,
+            'config': {
+                'jobs': args.jobs,
+                'workers': args.workers,
+                'media_bytes': media_bytes,
+                'duration': args.duration,
+                'latency': args.latency,
+                'bandwidth': bandwidth,
+                'connections': args.connections,
+                'progress_interval': args.progress_interval,
+            },
+            'progress_hook': [bench_progress_hook(args.hook_iterations, interval)
+                              for interval in (0.0, args.progress_interval)],
+            'batches': [],
+        }
+        try:
+            for format_type in formats:
+                print(f"Running {args.jobs} {format_type} jobs on {args.workers} workers...", file=sys.stderr)
+                output_path = os.path.join(work_dir, format_type)
+                os.makedirs(output_path)
+                batch = run_batch(server, args, format_type, ffmpeg_path, output_path)
+                batch['peak_rss_bytes_cumulative'] = peak_rss()
+                if args.profile:
+                    batch['profiles'] = profile_phases(server, args, format_type, ffmpeg_path, output_path)
+                report['batches'].append(batch)
+                # Keep the disk footprint of a long benchmark down
+                shutil.rmtree(output_path, ignore_errors=True)
+        finally:
+            server.stop()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if baseline is not None:
+        print('\n'.join(compare_reports(baseline, report)), file=sys.stderr)
+    failed = sum(batch['failed'] for batch in report['batches'])
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,490 @@
+"""Command-line / batch mode for the YouTube downloader.
+
+Prints one JSON object per line on stdout so other tools can follow progress, e.g.
+
+    python cli.py --format mp3 --jobs 4 -o ./music -i urls.txt
+    cat urls.txt | python cli.py --format mp4
+    python cli.py --cheapest mp4,mp4-720,mp4-480 --min-height 720 -i urls.txt
+
+With --serve it coordinates jobs for workers on other machines started with --worker:
+
+    python cli.py --serve 0.0.0.0:8770 -o ./videos -i urls.txt
+    python cli.py --worker http://coordinator:8770 --jobs 3
+"""
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+from engine import (check_ffmpeg_installation, get_default_ffmpeg_path, read_url_list, fetch_options, probe_url,
+                    DownloadJob, DownloadQueue, DEFAULT_PROGRESS_INTERVAL, DEFAULT_MAX_CONNECTIONS)
+from playlist import is_playlist_url, expand_playlist, queue_playlist
+from presets import PRESETS, DEFAULT_PRESET, PresetChoice, get_preset, estimate_job, cheapest_preset
+from archive import DownloadArchive
+from info_cache import ExtractionCache, DEFAULT_CACHE_TTL
+from journal import JobJournal
+from bandwidth import BandwidthScheduler, TimeProfile, parse_rate, watch_limits_file
+from retry import RetryController, RetryPolicy, DEFAULT_POLICIES
+from storage import OutputManager, DEFAULT_MIN_FREE
+from metrics import MetricsAggregator, serve_metrics
+from distributed import (Coordinator, CoordinatorClient, JobBoard, Worker, parse_listen_address, serve_coordinator,
+                         CLAIM_POLL_INTERVAL, DEFAULT_LEASE_SECONDS)
+
+class JsonLinesEmitter:
+    """Write events as JSON lines, one complete line at a time across threads"""
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        record = {'event': event, 'time': round(time.time(), 3)}
+        record.update(fields)
+        line = json.dumps(record, default=str)
+        with self.lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Download YouTube videos without the GUI. Progress is printed as JSON lines.")
+    parser.add_argument('urls', nargs='*',
+                        help="URLs to download ('-' reads URLs from stdin)")
+    parser.add_argument('-i', '--input', action='append', default=[], metavar='FILE',
+                        help="file with one URL per line ('-' for stdin); may be repeated")
+    parser.add_argument('-f', '--format', choices=list(PRESETS), default=DEFAULT_PRESET,
+                        help=f"quality preset (default: {DEFAULT_PRESET}, see --list-presets)")
+    parser.add_argument('--list-presets', action='store_true',
+                        help="emit a 'preset' event for every quality preset and exit")
+    parser.add_argument('--cheapest', default=None, metavar='PRESET,...',
+                        help="per video, use the cheapest of these presets that meets --min-height/--min-abr "
+                             "(falls back to --format)")
+    parser.add_argument('--min-height', type=int, default=None, metavar='N',
+                        help="with --cheapest, skip presets below this video height")
+    parser.add_argument('--min-abr', type=float, default=None, metavar='KBPS',
+                        help="with --cheapest, skip presets below this audio bitrate")
+    parser.add_argument('--estimate', action='store_true',
+                        help="emit size, time and post-processing estimates as 'estimate' events "
+                             "instead of downloading")
+    parser.add_argument('-o', '--output', default='.',
+                        help="output directory (default: current directory)")
+    parser.add_argument('--scratch-dir', default=None, metavar='DIR',
+                        help="download and post-process here (e.g. a fast local disk), then move finished files "
+                             "to the output folder (default: a hidden folder inside the output folder)")
+    parser.add_argument('--min-free', type=float, default=DEFAULT_MIN_FREE / 1024 / 1024, metavar='MB',
+                        help=f"free space to always leave on each disk (default: {DEFAULT_MIN_FREE // 1024 // 1024})")
+    parser.add_argument('--ffmpeg', default=None,
+                        help="path to the FFmpeg executable (default: auto-detect)")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="number of parallel downloads (default: 1)")
+    parser.add_argument('--connections', type=int, default=1, metavar='N',
+                        help="connections per file; above 1, streams are downloaded in parallel segments (default: 1)")
+    parser.add_argument('--max-connections', type=int, default=DEFAULT_MAX_CONNECTIONS, metavar='N',
+                        help=f"cap on segment connections across all jobs, 0 for none (default: {DEFAULT_MAX_CONNECTIONS})")
+    parser.add_argument('--limit-rate', default=None, metavar='RATE',
+                        help="aggregate download speed limit shared by all jobs, e.g. 2M or 500K (default: none)")
+    parser.add_argument('--job-limit-rate', default=None, metavar='RATE',
+                        help="speed limit for each job on top of its fair share of --limit-rate")
+    parser.add_argument('--schedule', action='append', default=[], metavar='HH:MM-HH:MM=RATE',
+                        help="aggregate limit for a time of day, e.g. 09:00-18:00=1M (0 = unlimited); may be repeated")
+    parser.add_argument('--limits-file', default=None, metavar='FILE',
+                        help="JSON file with 'aggregate', 'per_job' and 'schedule' limits, re-read when it changes")
+    parser.add_argument('--progress-interval', type=float, default=DEFAULT_PROGRESS_INTERVAL, metavar='SECONDS',
+                        help=f"minimum time between progress events per file (default: {DEFAULT_PROGRESS_INTERVAL})")
+    parser.add_argument('--no-expand', action='store_true',
+                        help="download playlist/channel URLs in a single job instead of one job per entry")
+    parser.add_argument('--archive', default=None, metavar='FILE',
+                        help="SQLite download archive used to skip finished videos (default: per-user cache)")
+    parser.add_argument('--no-archive', action='store_true',
+                        help="download everything, ignoring and not updating the archive")
+    parser.add_argument('--journal', default=None, metavar='FILE',
+                        help="SQLite journal of unfinished jobs (default: per-user cache)")
+    parser.add_argument('--no-journal', action='store_true',
+                        help="don't record jobs, so an interrupted run can't be resumed")
+    parser.add_argument('--resume', action='store_true',
+                        help="first re-queue the jobs an interrupted earlier run left in the journal")
+    parser.add_argument('--no-retry', action='store_true',
+                        help="fail jobs on their first error instead of retrying with backoff")
+    parser.add_argument('--cache-ttl', type=float, default=DEFAULT_CACHE_TTL, metavar='SECONDS',
+                        help=f"reuse extracted video info for this long, 0 to disable (default: {DEFAULT_CACHE_TTL})")
+    parser.add_argument('--stats-interval', type=float, default=0, metavar='SECONDS',
+                        help="also emit a 'stats' event every SECONDS while downloading (default: only at the end)")
+    parser.add_argument('--metrics-port', type=int, default=None, metavar='PORT',
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics (and /metrics.json)")
+    parser.add_argument('--serve', default=None, metavar='[HOST:]PORT',
+                        help="coordinate: queue the URLs for --worker processes instead of downloading them here "
+                             "(use 0.0.0.0:PORT to accept workers on other machines)")
+    parser.add_argument('--board', default=None, metavar='FILE',
+                        help="SQLite job board of the coordinator (default: per-user cache)")
+    parser.add_argument('--lease', type=float, default=DEFAULT_LEASE_SECONDS, metavar='SECONDS',
+                        help=f"requeue a job when its worker sends no heartbeat for this long "
+                             f"(default: {DEFAULT_LEASE_SECONDS})")
+    parser.add_argument('--worker', default=None, metavar='URL',
+                        help="work for the coordinator at URL: download its jobs and upload the finished files")
+    parser.add_argument('--worker-id', default=None, metavar='NAME',
+                        help="name this worker reports to the coordinator (default: hostname-pid)")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="also emit yt-dlp log lines as 'log' events")
+    return parser
+
+def collect_urls(args, stdin=None):
+    """Gather URLs from positional arguments, input files and stdin, in that order"""
+    stdin = stdin or sys.stdin
+    urls = []
+    read_stdin = False
+    for url in args.urls:
+        if url == '-':
+            read_stdin = True
+        else:
+            urls.append(url)
+    for path in args.input:
+        if path == '-':
+            read_stdin = True
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            urls.extend(read_url_list(f.read()))
+    # With nothing else given, read a piped stdin so the tool works in shell pipelines
+    if read_stdin or (not urls and not args.input and not args.resume and not args.serve and not args.worker
+                      and not stdin.isatty()):
+        urls.extend(read_url_list(stdin.read()))
+    return urls
+
+def parse_preset_list(value):
+    """'mp4,mp4-720' -> ['mp4', 'mp4-720']; raises ValueError for unknown presets"""
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    if not names:
+        raise ValueError("--cheapest needs at least one preset")
+    return [get_preset(name).name for name in names]
+
+def emit_estimate(emitter, url, info, names, estimates, chosen=None):
+    """One 'estimate' event listing every preset in names; presets missing from estimates have no known size"""
+    emitter.emit('estimate', url=url, title=info.get('title'), duration=info.get('duration'), chosen=chosen,
+                 estimates=[estimates[name].to_dict() if estimates.get(name) else
+                            {'preset': name, 'error': 'no size information'} for name in names])
+
+def run_estimate(args, emitter, download_queue, ffmpeg_path, urls, candidates):
+    """Dry run: emit estimates for every video instead of downloading; returns the exit code"""
+    failed = 0
+    video_urls = []
+    for url in urls:
+        if args.no_expand or not is_playlist_url(url):
+            video_urls.append(url)
+            continue
+        try:
+            _, entries = expand_playlist(url, download_queue.log_queue)
+            video_urls.extend(entry['url'] for entry in entries)
+        except Exception as e:
+            failed += 1
+            emitter.emit('playlist', url=url, error=str(e))
+    throughput = download_queue.measured_throughput()
+    for url in video_urls:
+        try:
+            info = probe_url(url, ffmpeg_path, download_queue.info_cache, download_queue.session_pool,
+                             download_queue.log_queue)
+        except Exception as e:
+            failed += 1
+            emitter.emit('estimate', url=url, error=str(e))
+            continue
+        if args.cheapest:
+            chosen, estimates = cheapest_preset(info, candidates, args.min_height, args.min_abr, throughput)
+            emit_estimate(emitter, url, info, candidates, estimates, chosen or args.format)
+        else:
+            emit_estimate(emitter, url, info, candidates,
+                          {name: estimate_job(info, get_preset(name), throughput) for name in candidates})
+    return 1 if failed else 0
+
+def start_log_forwarder(log_queue, emitter):
+    """Forward engine log strings as 'log' events"""
+    def forward():
+        while True:
+            message = log_queue.get()
+            if message is None:
+                break
+            emitter.emit('log', message=str(message))
+
+    thread = threading.Thread(target=forward, daemon=True)
+    thread.start()
+    return thread
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    emitter = JsonLinesEmitter()
+
+    if args.list_presets:
+        for preset in PRESETS.values():
+            # ext None keeps the container of the downloaded audio
+            emitter.emit('preset', name=preset.name, label=preset.label, ext=preset.ext,
+                         audio_only=preset.audio_only, max_height=preset.max_height,
+                         default=preset.name == DEFAULT_PRESET)
+        return 0
+    candidates = [args.format]
+    if args.cheapest:
+        try:
+            candidates = parse_preset_list(args.cheapest)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 2
+        if args.serve or args.worker:
+            print("Error: --cheapest picks presets while queueing locally; it can't be combined with "
+                  "--serve or --worker", file=sys.stderr)
+            return 2
+    elif args.min_height is not None or args.min_abr is not None:
+        print("Error: --min-height and --min-abr only apply to --cheapest", file=sys.stderr)
+        return 2
+    if args.estimate and (args.serve or args.worker):
+        print("Error: --estimate can't be combined with --serve or --worker", file=sys.stderr)
+        return 2
+
+    try:
+        urls = collect_urls(args)
+    except OSError as e:
+        print(f"Error: could not read URL file: {e}", file=sys.stderr)
+        return 2
+    if args.serve and args.worker:
+        print("Error: --serve and --worker can't be combined", file=sys.stderr)
+        return 2
+    if args.serve:
+        return run_coordinator(args, emitter, urls)
+    if args.worker and (urls or args.resume):
+        print("Error: a worker takes its URLs from the coordinator (pass them to --serve)", file=sys.stderr)
+        return 2
+    if args.estimate and not urls:
+        print("Error: --estimate needs URLs", file=sys.stderr)
+        return 2
+    if not urls and not args.resume and not args.worker:
+        print("Error: no URLs given (pass URLs, --input FILE, or pipe them on stdin)", file=sys.stderr)
+        return 2
+    if args.resume and args.no_journal:
+        print("Error: --resume needs the job journal (drop --no-journal)", file=sys.stderr)
+        return 2
+
+    ffmpeg_path = args.ffmpeg or get_default_ffmpeg_path()
+    if not ffmpeg_path or not check_ffmpeg_installation(ffmpeg_path):
+        print("Error: FFmpeg not found. Install it or pass --ffmpeg PATH.", file=sys.stderr)
+        return 2
+
+    archive = None
+    # A worker's coordinator skips and records finished videos for all workers
+    if not args.no_archive and not args.worker:
+        try:
+            archive = DownloadArchive(args.archive)
+        except Exception as e:
+            print(f"Error: could not open download archive: {e}", file=sys.stderr)
+            return 2
+
+    try:
+        bandwidth = BandwidthScheduler(parse_rate(args.limit_rate), parse_rate(args.job_limit_rate),
+                                       [TimeProfile.parse(entry) for entry in args.schedule])
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+
+    journal = None
+    # A worker's jobs go back to the coordinator when it stops, so there's nothing to resume
+    if not args.no_journal and not args.worker:
+        try:
+            # Separate from the GUI's journal so neither resumes the other's running jobs
+            journal = JobJournal(args.journal, name='cli-journal.sqlite3')
+        except Exception as e:
+            print(f"Error: could not open job journal: {e}", file=sys.stderr)
+            return 2
+
+    retry_controller = None
+    if args.no_retry:
+        retry_controller = RetryController({error_class: RetryPolicy(max_attempts=1)
+                                            for error_class in DEFAULT_POLICIES})
+
+    log_queue = queue.Queue() if args.verbose else None
+    log_thread = start_log_forwarder(log_queue, emitter) if log_queue else None
+
+    def on_job_update(job):
+        emitter.emit('job', job_id=job.job_id, state=job.state, url=job.url,
+                     format=job.format_type, attempts=job.attempts, error=job.error,
+                     error_class=job.error_class)
+
+    def on_progress(event):
+        emitter.emit('message' if event.status == 'message' else 'progress', **event.to_dict())
+
+    metrics = MetricsAggregator()
+    metrics_server = None
+    if args.metrics_port is not None:
+        try:
+            metrics_server = serve_metrics(metrics, args.metrics_port)
+        except OSError as e:
+            print(f"Error: could not start metrics server: {e}", file=sys.stderr)
+            return 2
+
+    download_queue = DownloadQueue(log_queue, max_workers=args.jobs,
+                                   on_job_update=on_job_update, on_progress=on_progress, archive=archive,
+                                   progress_interval=args.progress_interval, metrics=metrics,
+                                   info_cache=ExtractionCache(ttl=args.cache_ttl) if args.cache_ttl > 0 else None,
+                                   segment_connections=args.connections, max_connections=args.max_connections,
+                                   journal=journal, bandwidth=bandwidth, retry_controller=retry_controller,
+                                   storage=OutputManager(args.scratch_dir, int(args.min_free * 1024 * 1024)))
+    # Build the YoutubeDL instances up front; every job then borrows a ready one
+    profile, ydl_opts = fetch_options(args.format, ffmpeg_path, args.connections, download_queue.connection_limiter)
+    download_queue.session_pool.warm(profile, ydl_opts, count=args.jobs)
+    
+    if args.limits_file:
+        # Edit the file while the batch runs to change the limits without restarting
+        def on_limits_change(scheduler, error):
+            if error is not None:
+                emitter.emit('limits', file=args.limits_file, error=str(error))
+            else:
+                emitter.emit('limits', file=args.limits_file, aggregate=scheduler.aggregate_limit,
+                             per_job=scheduler.per_job_limit, schedule=[str(p) for p in scheduler.schedule])
+        watch_limits_file(bandwidth, args.limits_file, on_limits_change)
+    
+    if args.worker:
+        return run_worker(args, emitter, download_queue, ffmpeg_path, metrics_server, log_queue, log_thread)
+
+    if args.estimate:
+        exit_code = run_estimate(args, emitter, download_queue, ffmpeg_path, urls, candidates)
+        if log_thread:
+            log_queue.put(None)
+            log_thread.join(timeout=1)
+        download_queue.session_pool.close()
+        if metrics_server:
+            metrics_server.shutdown()
+        return exit_code
+
+    # Each job picks its preset from its own extraction, with the throughput measured by then
+    preset_choice = PresetChoice(candidates, args.min_height, args.min_abr, args.format) if args.cheapest else None
+
+    if args.resume:
+        resumed = download_queue.resume_journal()
+        emitter.emit('resume', jobs=[job.job_id for job in resumed])
+    
+    expansion_failed = 0
+    for url in urls:
+        if args.no_expand or not is_playlist_url(url):
+            download_queue.add(url, args.output, ffmpeg_path, args.format, preset_choice=preset_choice)
+            continue
+        try:
+            jobs, skipped = queue_playlist(download_queue, url, args.output, ffmpeg_path, args.format,
+                                           preset_choice)
+            emitter.emit('playlist', url=url, queued=len(jobs), skipped=skipped)
+        except Exception as e:
+            expansion_failed += 1
+            emitter.emit('playlist', url=url, error=str(e))
+
+    stats_done = threading.Event()
+    if args.stats_interval > 0:
+        def report_stats():
+            while not stats_done.wait(args.stats_interval):
+                emitter.emit('stats', **metrics.snapshot()['global'])
+        threading.Thread(target=report_stats, daemon=True).start()
+
+    try:
+        download_queue.wait()
+    except KeyboardInterrupt:
+        for job_id in list(download_queue.jobs):
+            download_queue.cancel(job_id)
+        download_queue.wait()
+
+    if log_thread:
+        log_queue.put(None)
+        log_thread.join(timeout=1)
+
+    download_queue.session_pool.close()
+    stats_done.set()
+    if metrics_server:
+        metrics_server.shutdown()
+
+    counts = download_queue.counts()
+    emitter.emit('stats', **metrics.snapshot())
+    emitter.emit('summary', **counts)
+    failed = counts[DownloadJob.FAILED] + counts[DownloadJob.CANCELLED] + expansion_failed
+    return 1 if failed else 0
+
+def queue_on_coordinator(coordinator, url, args, emitter):
+    """Submit a URL to the job board, expanding playlists into one job per entry"""
+    if args.no_expand or not is_playlist_url(url):
+        coordinator.submit(url, args.format)
+        return
+    _, entries = expand_playlist(url)
+    duplicates = sum(coordinator.submit(entry['url'], args.format)[1] for entry in entries)
+    emitter.emit('playlist', url=url, queued=len(entries) - duplicates, skipped=duplicates)
+
+def run_coordinator(args, emitter, urls):
+    """Serve the job board until every job is finished (or until interrupted if started without URLs)"""
+    try:
+        host, port = parse_listen_address(args.serve)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    try:
+        archive = None if args.no_archive else DownloadArchive(args.archive)
+        board = JobBoard(args.board)
+    except Exception as e:
+        print(f"Error: could not open the download archive or job board: {e}", file=sys.stderr)
+        return 2
+
+    def on_job_update(job):
+        emitter.emit('job', job_id=job['job_id'], state=job['state'], url=job['url'], format=job['format'],
+                     attempts=job['leases'], error=job['error'], error_class=job['error_class'],
+                     worker=job['worker'], skipped=job['skipped'], files=job['files'])
+
+    def on_progress(job_id, worker, progress):
+        emitter.emit('progress', job_id=job_id, worker=worker, **progress)
+
+    coordinator = Coordinator(board, args.output, archive,
+                              OutputManager(args.scratch_dir, int(args.min_free * 1024 * 1024)),
+                              args.lease, on_job_update, on_progress)
+    try:
+        server = serve_coordinator(coordinator, port, host)
+    except OSError as e:
+        print(f"Error: could not start the coordinator: {e}", file=sys.stderr)
+        return 2
+    emitter.emit('coordinator', address=f"http://{host}:{server.server_address[1]}", board=board.path,
+                 unfinished=board.unfinished())
+
+    expansion_failed = 0
+    for url in urls:
+        try:
+            queue_on_coordinator(coordinator, url, args, emitter)
+        except Exception as e:
+            expansion_failed += 1
+            emitter.emit('playlist', url=url, error=str(e))
+
+    # Jobs left on the board by an earlier run count too; with none at all, serve until interrupted
+    serve_forever = not urls and not board.unfinished()
+    try:
+        while serve_forever or board.unfinished():
+            coordinator.expire_leases()
+            time.sleep(1.0)
+        # Stay up until idle workers have asked once more and heard that everything is done
+        time.sleep(2 * CLAIM_POLL_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+    server.shutdown()
+
+    counts = board.counts()
+    emitter.emit('summary', **counts)
+    board.close()
+    unfinished = counts[DownloadJob.QUEUED] + counts[DownloadJob.RUNNING]
+    return 1 if counts[DownloadJob.FAILED] + expansion_failed or unfinished else 0
+
+def run_worker(args, emitter, download_queue, ffmpeg_path, metrics_server, log_queue, log_thread):
+    """Download the coordinator's jobs until it has none left"""
+    worker = Worker(CoordinatorClient(args.worker), download_queue, args.output, ffmpeg_path, args.worker_id,
+                    on_event=emitter.emit)
+    emitter.emit('worker', worker=worker.worker_id, coordinator=worker.client.url)
+    try:
+        drained = worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
+        drained = False
+
+    if log_thread:
+        log_queue.put(None)
+        log_thread.join(timeout=1)
+    download_queue.session_pool.close()
+    if metrics_server:
+        metrics_server.shutdown()
+    emitter.emit('stats', **download_queue.metrics.snapshot())
+    emitter.emit('summary', **worker.reported)
+    return 0 if drained and not worker.reported[DownloadJob.FAILED] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,698 @@
+"""Coordinator/worker mode: one shared job queue drained by download workers on several machines.
+
+The coordinator keeps every job on a SQLite job board and serves it over HTTP. Workers
+claim jobs one at a time, which leases the job to that worker for a limited time, and
+run them through their own DownloadQueue. While a job runs, the worker renews its
+leases with a heartbeat that also carries the job's progress. A worker that crashes
+or loses its network stops renewing, so its jobs go back on the board for another
+worker once the lease runs out.
+
+Finished files are uploaded to the coordinator, which moves them into its output
+folder and records them in its download archive, so every file ends up in one place
+and a URL is only downloaded once however many workers there are. Retries with backoff
+happen on the worker; the board only sees a job's final result.
+"""
+import errno
+import json
+import os
+import re
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import parse_qs, quote, unquote, urlparse
+from engine import get_app_data_dir, record_in_archive, video_key_from_url, DownloadJob, JOURNAL_INFO_KEYS
+from presets import get_preset, DEFAULT_PRESET
+from retry import ERROR_CANCELLED, ERROR_DISK_FULL, ERROR_UNKNOWN
+from storage import OutputManager, InsufficientSpaceError
+
+DEFAULT_COORDINATOR_PORT = 8770
+# How long a claimed job stays with a worker without a heartbeat
+DEFAULT_LEASE_SECONDS = 60
+# A job whose lease ran out this many times fails instead of taking down yet another worker
+MAX_LEASES = 3
+# Seconds a worker waits before asking again when there is nothing to claim
+CLAIM_POLL_INTERVAL = 2.0
+# Attempts a worker makes to report a finished job before giving it up
+REPORT_ATTEMPTS = 5
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+# Uploads are written under this suffix and renamed once the lease has been checked
+UPLOAD_SUFFIX = '.upload'
+
+WORKER_ID_PATTERN = re.compile(r'[^\w.-]')
+
+def default_worker_id():
+    return WORKER_ID_PATTERN.sub('_', f"{socket.gethostname()}-{os.getpid()}")
+
+def parse_listen_address(value):
+    """Turn '[HOST:]PORT' into (host, port); the host defaults to localhost only"""
+    host, _, port = str(value).rpartition(':')
+    try:
+        return host or '127.0.0.1', int(port)
+    except ValueError:
+        raise ValueError(f"Invalid address '{value}', expected [HOST:]PORT")
+
+class LeaseLost(Exception):
+    """The coordinator gave the job to another worker, e.g. after a missed heartbeat"""
+
+class JobBoard:
+    """SQLite-backed list of distributed jobs and who holds their lease"""
+    def __init__(self, path=None, name='coordinator.sqlite3'):
+        self.path = path or os.path.join(get_app_data_dir(), name)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " url TEXT NOT NULL,"
+                " format TEXT NOT NULL,"
+                " state TEXT NOT NULL,"
+                " worker TEXT,"
+                " lease_until REAL,"
+                " leases INTEGER NOT NULL DEFAULT 0,"
+                " progress TEXT,"
+                " error TEXT,"
+                " error_class TEXT,"
+                " files TEXT NOT NULL DEFAULT '[]',"
+                " skipped INTEGER NOT NULL DEFAULT 0,"
+                " created_at REAL,"
+                " updated_at REAL)")
+
+    COLUMNS = ('job_id', 'url', 'format', 'state', 'worker', 'lease_until', 'leases', 'progress',
+               'error', 'error_class', 'files', 'skipped')
+
+    def _row(self, row):
+        job = dict(zip(self.COLUMNS, row))
+        job['progress'] = json.loads(job['progress']) if job['progress'] else None
+        job['files'] = json.loads(job['files'] or '[]')
+        job['skipped'] = bool(job['skipped'])
+        return job
+
+    def _get(self, job_id):
+        row = self.conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE job_id = ?",
+                                (job_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def get(self, job_id):
+        with self.lock:
+            return self._get(job_id)
+
+    def add(self, url, format_type, skipped=False):
+        """Put a job on the board, or record it as already done if it was skipped"""
+        now = time.time()
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO jobs (url, format, state, skipped, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (url, format_type, DownloadJob.DONE if skipped else DownloadJob.QUEUED, int(skipped), now, now))
+            return self._get(cursor.lastrowid)
+
+    def find_unfinished(self, url, format_type):
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE url = ? AND format = ? AND state IN (?, ?)",
+                (url, format_type, DownloadJob.QUEUED, DownloadJob.RUNNING)).fetchone()
+        return self._row(row) if row else None
+
+    def claim(self, worker, lease_seconds):
+        """Lease the oldest queued job to a worker and return it, or None if nothing is queued"""
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT job_id FROM jobs WHERE state = ? ORDER BY job_id LIMIT 1",
+                                    (DownloadJob.QUEUED,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE jobs SET state = ?, worker = ?, lease_until = ?, leases = leases + 1, progress = NULL,"
+                " updated_at = ? WHERE job_id = ?",
+                (DownloadJob.RUNNING, worker, now + lease_seconds, now, row[0]))
+            return self._get(row[0])
+
+    def renew(self, job_id, worker, lease_seconds, progress=None):
+        """Extend a worker's lease on a job; False if the worker no longer holds it"""
+        now = time.time()
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET lease_until = ?, progress = ?, updated_at = ?"
+                " WHERE job_id = ? AND worker = ? AND state = ?",
+                (now + lease_seconds, json.dumps(progress) if progress is not None else None, now,
+                 job_id, worker, DownloadJob.RUNNING))
+            return cursor.rowcount == 1
+
+    def holds_lease(self, job_id, worker):
+        job = self.get(job_id)
+        return job is not None and job['state'] == DownloadJob.RUNNING and job['worker'] == worker
+
+    def finish(self, job_id, worker, state, error=None, error_class=None, files=None):
+        """Record a leased job's result; False if the worker no longer holds the lease"""
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET state = ?, error = ?, error_class = ?, files = ?, lease_until = NULL, updated_at = ?"
+                " WHERE job_id = ? AND worker = ? AND state = ?",
+                (state, error, error_class, json.dumps(files or []), time.time(),
+                 job_id, worker, DownloadJob.RUNNING))
+            return cursor.rowcount == 1
+
+    def requeue(self, job_id, worker=None):
+        """Put a leased job back on the board; False if it isn't leased (to that worker)"""
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET state = ?, worker = NULL, lease_until = NULL, progress = NULL, updated_at = ?"
+                " WHERE job_id = ? AND state = ? AND (? IS NULL OR worker = ?)",
+                (DownloadJob.QUEUED, time.time(), job_id, DownloadJob.RUNNING, worker, worker))
+            return cursor.rowcount == 1
+
+    def expired(self, now=None):
+        """Return the leased jobs whose lease ran out"""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE state = ? AND lease_until < ?",
+                (DownloadJob.RUNNING, now or time.time())).fetchall()
+        return [self._row(row) for row in rows]
+
+    def leased_to(self, worker):
+        with self.lock:
+            rows = self.conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE state = ? AND worker = ?",
+                                     (DownloadJob.RUNNING, worker)).fetchall()
+        return [self._row(row) for row in rows]
+
+    def jobs(self):
+        with self.lock:
+            rows = self.conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs ORDER BY job_id").fetchall()
+        return [self._row(row) for row in rows]
+
+    def counts(self):
+        counts = dict.fromkeys((DownloadJob.QUEUED, DownloadJob.RUNNING, DownloadJob.DONE, DownloadJob.FAILED), 0)
+        with self.lock:
+            for state, count in self.conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"):
+                counts[state] = count
+        return counts
+
+    def unfinished(self):
+        counts = self.counts()
+        return counts[DownloadJob.QUEUED] + counts[DownloadJob.RUNNING]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class Coordinator:
+    """Hand out jobs from a JobBoard and collect the finished files in one output folder"""
+    def __init__(self, board, output_path='.', archive=None, storage=None, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 on_job_update=None, on_progress=None):
+        self.board = board
+        self.output_path = output_path
+        # Optional DownloadArchive; checked when a URL is submitted, updated when its files arrive
+        self.archive = archive
+        self.storage = storage if storage is not None else OutputManager()
+        self.lease_seconds = lease_seconds
+        # Called with the board's job dict when a job changes state, and with (job_id, worker, progress)
+        self.on_job_update = on_job_update
+        self.on_progress = on_progress
+        # Serialises lease changes with moving files into the output folder
+        self.lock = threading.Lock()
+
+    def submit(self, url, format_type):
+        """Queue a URL unless it is in the archive or already queued; returns (job, duplicate)
+
+        Raises ValueError for an unknown preset.
+        """
+        format_type = get_preset(format_type).name
+        existing = self.board.find_unfinished(url, format_type)
+        if existing is not None:
+            return existing, True
+        url_key = video_key_from_url(url) if self.archive else None
+        skipped = bool(url_key and self.archive.contains(url_key, format_type, self.output_path))
+        job = self.board.add(url, format_type, skipped)
+        self._notify(job)
+        return job, False
+
+    def claim(self, worker):
+        self.expire_leases()
+        with self.lock:
+            job = self.board.claim(worker, self.lease_seconds)
+        if job is not None:
+            self._notify(job)
+        return job
+
+    def heartbeat(self, worker, progress):
+        """Renew the worker's leases (job id -> progress) and return the ids it no longer holds"""
+        lost = []
+        with self.lock:
+            for job_id, job_progress in progress.items():
+                if not self.board.renew(int(job_id), worker, self.lease_seconds, job_progress):
+                    lost.append(int(job_id))
+        if self.on_progress:
+            for job_id, job_progress in progress.items():
+                if int(job_id) not in lost and job_progress:
+                    self.on_progress(int(job_id), worker, job_progress)
+        return lost
+
+    def receive_file(self, job_id, worker, name, stream, length):
+        """Store one uploaded output file in the job's staging folder until the job is reported done"""
+        name = os.path.basename(name.replace('\\', '/'))
+        if not name or name in ('.', '..'):
+            raise ValueError("Invalid file name")
+        # Checked again below; this only avoids reading an upload that can't be kept
+        if not self.board.holds_lease(job_id, worker):
+            raise LeaseLost(job_id)
+        staging_path = self._staging_path(job_id, worker)
+        os.makedirs(staging_path, exist_ok=True)
+        target = os.path.join(staging_path, name)
+        # Room for this file on top of whatever this job uploaded already
+        staged = sum(os.path.getsize(os.path.join(staging_path, other)) for other in os.listdir(staging_path)
+                     if other != name and not other.endswith(UPLOAD_SUFFIX))
+        self.storage.reserve(staging_path, self.output_path, (0, staged + length))
+        temp_target = target + UPLOAD_SUFFIX
+        try:
+            remaining = length
+            with open(temp_target, 'wb') as f:
+                while remaining > 0:
+                    block = stream.read(min(UPLOAD_BLOCK_SIZE, remaining))
+                    if not block:
+                        raise ConnectionError(f"Upload of {name} ended {remaining} bytes early")
+                    f.write(block)
+                    remaining -= len(block)
+            # The lease may have expired during the upload; complete() and expire_leases() hold the same lock
+            with self.lock:
+                if not self.board.holds_lease(job_id, worker):
+                    raise LeaseLost(job_id)
+                os.replace(temp_target, target)
+        finally:
+            if os.path.exists(temp_target):
+                os.remove(temp_target)
+        return target
+
+    def complete(self, job_id, worker, videos=None):
+        """Move a job's uploaded files into the output folder and record it in the archive"""
+        with self.lock:
+            job = self.board.get(job_id)
+            if job is None or job['state'] != DownloadJob.RUNNING or job['worker'] != worker:
+                raise LeaseLost(job_id)
+            staging_path = self._staging_path(job_id, worker)
+            files = []
+            if os.path.isdir(staging_path):
+                for name in sorted(os.listdir(staging_path)):
+                    if name.endswith(UPLOAD_SUFFIX):
+                        continue
+                    files.append(self.storage.move_to_output(os.path.join(staging_path, name), self.output_path))
+            self.storage.discard(staging_path)
+            if self.archive:
+                record_in_archive(self.archive, video_key_from_url(job['url']), videos or {}, job['format'],
+                                  self.output_path)
+            self.board.finish(job_id, worker, DownloadJob.DONE, files=files)
+        self._notify(self.board.get(job_id))
+        return files
+
+    def fail(self, job_id, worker, error, error_class=None):
+        with self.lock:
+            if not self.board.finish(job_id, worker, DownloadJob.FAILED, error, error_class or ERROR_UNKNOWN):
+                raise LeaseLost(job_id)
+            self.storage.discard(self._staging_path(job_id, worker))
+        self._notify(self.board.get(job_id))
+
+    def release(self, worker, job_ids=None):
+        """Give a stopping worker's jobs (or just job_ids) back to the board"""
+        released = []
+        with self.lock:
+            for job in self.board.leased_to(worker):
+                if job_ids is not None and job['job_id'] not in job_ids:
+                    continue
+                if self.board.requeue(job['job_id'], worker):
+                    self.storage.discard(self._staging_path(job['job_id'], worker))
+                    released.append(job['job_id'])
+        for job_id in released:
+            self._notify(self.board.get(job_id))
+        return released
+
+    def expire_leases(self):
+        """Requeue the jobs of workers that stopped sending heartbeats"""
+        changed = []
+        with self.lock:
+            for job in self.board.expired():
+                if job['leases'] >= MAX_LEASES:
+                    updated = self.board.finish(
+                        job['job_id'], job['worker'], DownloadJob.FAILED,
+                        f"Worker {job['worker']} stopped responding; lease expired {job['leases']} times",
+                        ERROR_UNKNOWN)
+                else:
+                    updated = self.board.requeue(job['job_id'], job['worker'])
+                if updated:
+                    self.storage.discard(self._staging_path(job['job_id'], job['worker']))
+                    changed.append(job['job_id'])
+        for job_id in changed:
+            self._notify(self.board.get(job_id))
+        return changed
+
+    def status(self):
+        return {'counts': self.board.counts(), 'jobs': self.board.jobs()}
+
+    def _staging_path(self, job_id, worker):
+        return self.storage.staging_path(self.output_path, f"board-{job_id}-{WORKER_ID_PATTERN.sub('_', worker)}")
+
+    def _notify(self, job):
+        if self.on_job_update and job is not None:
+            try:
+                self.on_job_update(job)
+            except Exception as e:
+                # Never on stdout, which is the CLI's JSON event stream
+                print(f"Job update callback error: {e}", file=sys.stderr)
+
+def serve_coordinator(coordinator, port=DEFAULT_COORDINATOR_PORT, host='127.0.0.1'):
+    """Serve the coordinator's HTTP/JSON API from a background thread and return the server.
+
+    GET /status, POST /jobs {urls, format}, POST /claim {worker},
+    POST /heartbeat {worker, jobs: {id: progress}}, POST /release {worker, jobs},
+    PUT /jobs/<id>/files/<name>?worker=W, POST /jobs/<id>/done {worker, videos},
+    POST /jobs/<id>/failed {worker, error, error_class}
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class CoordinatorHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if urlparse(self.path).path == '/status':
+                self.reply(200, coordinator.status())
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            parts = urlparse(self.path).path.strip('/').split('/')
+            try:
+                length = int(self.headers.get('Content-Length') or 0)
+                request = json.loads(self.rfile.read(length) or b'{}')
+                if parts == ['jobs']:
+                    submitted = [coordinator.submit(url, request.get('format') or DEFAULT_PRESET)
+                                 for url in request.get('urls') or []]
+                    self.reply(200, {'jobs': [job for job, duplicate in submitted if not duplicate],
+                                     'duplicates': [job for job, duplicate in submitted if duplicate]})
+                elif parts == ['claim']:
+                    job = coordinator.claim(request['worker'])
+                    self.reply(200, {'job': job, 'lease_seconds': coordinator.lease_seconds,
+                                     'drained': job is None and not coordinator.board.unfinished()})
+                elif parts == ['heartbeat']:
+                    self.reply(200, {'lost': coordinator.heartbeat(request['worker'], request.get('jobs') or {})})
+                elif parts == ['release']:
+                    self.reply(200, {'released': coordinator.release(request['worker'], request.get('jobs'))})
+                elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'done':
+                    self.reply(200, {'files': coordinator.complete(int(parts[1]), request['worker'],
+                                                                   request.get('videos'))})
+                elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'failed':
+                    coordinator.fail(int(parts[1]), request['worker'], request.get('error'), request.get('error_class'))
+                    self.reply(200, {})
+                else:
+                    self.send_error(404)
+            except LeaseLost:
+                self.reply(409, {'error': 'lease lost'})
+            except (KeyError, ValueError, TypeError) as e:
+                self.reply(400, {'error': str(e)})
+
+        def do_PUT(self):
+            parts = urlparse(self.path).path.strip('/').split('/')
+            if len(parts) != 4 or parts[0] != 'jobs' or parts[2] != 'files':
+                self.send_error(404)
+                return
+            worker = (parse_qs(urlparse(self.path).query).get('worker') or [''])[0]
+            try:
+                coordinator.receive_file(int(parts[1]), worker, unquote(parts[3]), self.rfile,
+                                         int(self.headers['Content-Length']))
+                self.reply(200, {})
+            except LeaseLost:
+                self.reply(409, {'error': 'lease lost'})
+            except InsufficientSpaceError as e:
+                self.reply(507, {'error': str(e)})
+            except (KeyError, ValueError, TypeError) as e:
+                self.reply(400, {'error': str(e)})
+
+        def reply(self, status, data):
+            body = json.dumps(data, default=str).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Heartbeats would flood stderr
+
+    server = ThreadingHTTPServer((host, port), CoordinatorHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class CoordinatorClient:
+    """Worker side of the coordinator's HTTP API"""
+    def __init__(self, url, timeout=30):
+        self.url = url.rstrip('/')
+        if '://' not in self.url:
+            self.url = 'http://' + self.url
+        self.timeout = timeout
+
+    def _request(self, method, path, payload=None, data=None, headers=None, timeout=None):
+        if payload is not None:
+            data = json.dumps(payload).encode('utf-8')
+            headers = {'Content-Type': 'application/json'}
+        request = urllib.request.Request(self.url + path, data=data, method=method, headers=headers or {})
+        try:
+            with urllib.request.urlopen(request, timeout=timeout or self.timeout) as response:
+                return json.loads(response.read() or b'{}')
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get('error') or str(e)
+            except ValueError:
+                message = str(e)
+            if e.code == 409:
+                raise LeaseLost(message)
+            if e.code == 507:
+                # Classified as disk_full, so the job fails instead of being retried
+                raise OSError(errno.ENOSPC, f"Coordinator: {message}")
+            raise
+
+    def submit(self, urls, format_type=DEFAULT_PRESET):
+        return self._request('POST', '/jobs', {'urls': list(urls), 'format': format_type})
+
+    def claim(self, worker):
+        return self._request('POST', '/claim', {'worker': worker})
+
+    def heartbeat(self, worker, progress):
+        return self._request('POST', '/heartbeat', {'worker': worker, 'jobs': progress}).get('lost') or []
+
+    def release(self, worker, job_ids=None):
+        return self._request('POST', '/release', {'worker': worker, 'jobs': job_ids})
+
+    def upload(self, job_id, worker, path):
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            # No timeout: the coordinator may wait for disk space before reading the body
+            return self._request('PUT', f"/jobs/{job_id}/files/{quote(os.path.basename(path))}"
+                                        f"?worker={quote(worker)}",
+                                 data=f, headers={'Content-Length': str(size)}, timeout=max(self.timeout, 600))
+
+    def done(self, job_id, worker, videos):
+        return self._request('POST', f"/jobs/{job_id}/done", {'worker': worker, 'videos': videos})
+
+    def failed(self, job_id, worker, error, error_class):
+        return self._request('POST', f"/jobs/{job_id}/failed",
+                             {'worker': worker, 'error': error, 'error_class': error_class})
+
+    def status(self):
+        return self._request('GET', '/status')
+
+class Worker:
+    """Claim jobs from a coordinator and run them through a local DownloadQueue.
+
+    Claims at most as many jobs as the queue has download workers, renews their leases
+    while they run and uploads the finished files. The queue's own retry controller
+    handles retries, so only final results are reported.
+    """
+    def __init__(self, client, download_queue, output_path='.', ffmpeg_path=None, worker_id=None, on_event=None):
+        self.client = client
+        self.download_queue = download_queue
+        self.output_path = output_path
+        self.ffmpeg_path = ffmpeg_path
+        self.worker_id = worker_id or default_worker_id()
+        # Called as on_event(event, **fields) for claims, reports and lost leases
+        self.on_event = on_event
+        self.lease_seconds = DEFAULT_LEASE_SECONDS
+        self.lock = threading.Lock()
+        # Local job id -> board job, from claim until the result is reported
+        self.active = {}
+        # Local job ids whose lease the coordinator took back
+        self.lost = set()
+        self.stopping = False
+        self.reported = {DownloadJob.DONE: 0, DownloadJob.FAILED: 0}
+        self._report_threads = []
+        previous_update = download_queue.on_job_update
+
+        def on_job_update(job):
+            if previous_update:
+                previous_update(job)
+            self._on_job_update(job)
+        download_queue.on_job_update = on_job_update
+
+    def run(self, stop_event=None):
+        """Work until the coordinator has nothing left, stop_event is set or it can't be reached"""
+        stop_event = stop_event or threading.Event()
+        last_heartbeat = 0
+        unreachable_since = None
+        while not stop_event.is_set():
+            try:
+                if time.time() - last_heartbeat >= self.lease_seconds / 3:
+                    self._heartbeat()
+                    last_heartbeat = time.time()
+                drained = False
+                while self._free_slots() > 0:
+                    reply = self.client.claim(self.worker_id)
+                    self.lease_seconds = reply.get('lease_seconds') or self.lease_seconds
+                    if not reply.get('job'):
+                        drained = reply.get('drained')
+                        break
+                    self._start(reply['job'])
+                unreachable_since = None
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                unreachable_since = unreachable_since or time.time()
+                # Past the lease the coordinator has handed our jobs to someone else anyway
+                if time.time() - unreachable_since > self.lease_seconds:
+                    self._event('worker', error=f"Coordinator unreachable: {e}")
+                    self.stop()
+                    return False
+                drained = False
+            with self.lock:
+                idle = not self.active
+            if drained and idle:
+                return True
+            stop_event.wait(CLAIM_POLL_INTERVAL if idle or self._free_slots() == 0 else 0.2)
+        self.stop()
+        return True
+
+    def stop(self):
+        """Cancel the running jobs and hand them back to the coordinator"""
+        with self.lock:
+            self.stopping = True
+            running = dict(self.active)
+        for local_id in running:
+            self.download_queue.cancel(local_id)
+        self.download_queue.wait()
+        for thread in list(self._report_threads):
+            thread.join()
+        try:
+            self.client.release(self.worker_id)
+        except Exception:
+            pass  # Their leases run out on their own
+
+    def _free_slots(self):
+        with self.lock:
+            if self.stopping:
+                return 0
+            return self.download_queue.max_workers - len(self.active)
+
+    def _start(self, board_job):
+        with self.lock:
+            job = self.download_queue.add(board_job['url'], self.output_path, self.ffmpeg_path, board_job['format'])
+            self.active[job.job_id] = board_job
+        self._event('claim', board_job_id=board_job['job_id'], job_id=job.job_id, url=board_job['url'])
+
+    def _heartbeat(self):
+        with self.lock:
+            active = dict(self.active)
+        if not active:
+            return
+        snapshot = self.download_queue.metrics.snapshot() if self.download_queue.metrics else {'jobs': []}
+        stats = {job['job_id']: job for job in snapshot['jobs']}
+        progress = {}
+        for local_id, board_job in active.items():
+            job_stats = stats.get(local_id) or {}
+            progress[board_job['job_id']] = {'state': self.download_queue.jobs[local_id].state,
+                                             'phase': job_stats.get('phase'),
+                                             'bytes': job_stats.get('bytes'),
+                                             'speed': job_stats.get('speed')}
+        lost = set(self.client.heartbeat(self.worker_id, progress))
+        for local_id, board_job in active.items():
+            if board_job['job_id'] in lost:
+                self._event('lease_lost', board_job_id=board_job['job_id'], job_id=local_id)
+                with self.lock:
+                    self.lost.add(local_id)
+                self.download_queue.cancel(local_id)
+
+    def _on_job_update(self, job):
+        if not job.is_finished():
+            return
+        with self.lock:
+            board_job = self.active.get(job.job_id)
+        if board_job is None:
+            return
+        # Uploading can take a while, so it doesn't hold up the queue's worker threads
+        thread = threading.Thread(target=self._report, args=(job, board_job), daemon=True)
+        self._report_threads = [t for t in self._report_threads if t.is_alive()] + [thread]
+        thread.start()
+
+    def _report(self, job, board_job):
+        board_id = board_job['job_id']
+        try:
+            with self.lock:
+                lost = job.job_id in self.lost
+                stopping = self.stopping
+            if lost:
+                return
+            if job.state == DownloadJob.CANCELLED or job.error_class == ERROR_CANCELLED:
+                # Stopped here, not a problem with the job; let another worker have it
+                if stopping:
+                    return  # stop() releases everything at once
+                self._retry_call(self.client.release, self.worker_id, [board_id])
+                return
+            if job.state == DownloadJob.FAILED:
+                self._retry_call(self.client.failed, board_id, self.worker_id, job.error, job.error_class)
+                self._finished(job, board_id, DownloadJob.FAILED)
+                return
+            try:
+                for path in job.output_files:
+                    self._retry_call(self.client.upload, board_id, self.worker_id, path)
+            except OSError as e:
+                if e.errno != errno.ENOSPC:
+                    raise
+                self._retry_call(self.client.failed, board_id, self.worker_id, str(e), ERROR_DISK_FULL)
+                self._finished(job, board_id, DownloadJob.FAILED, error=str(e))
+                return
+            videos = {video_id: {key: info.get(key) for key in JOURNAL_INFO_KEYS if info.get(key) is not None}
+                      for video_id, info in job.videos.items()}
+            reply = self._retry_call(self.client.done, board_id, self.worker_id, videos)
+            self._finished(job, board_id, DownloadJob.DONE, files=reply.get('files'))
+        except LeaseLost:
+            self._event('lease_lost', board_job_id=board_id, job_id=job.job_id)
+        except Exception as e:
+            # The lease runs out and another worker gets the job
+            self._event('report', board_job_id=board_id, job_id=job.job_id, error=str(e))
+        finally:
+            if job.state == DownloadJob.DONE:
+                # Uploaded or not, the coordinator holds the only copy that counts
+                for path in job.output_files:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            with self.lock:
+                self.active.pop(job.job_id, None)
+                self.lost.discard(job.job_id)
+
+    def _finished(self, job, board_id, state, **fields):
+        with self.lock:
+            self.reported[state] += 1
+        self._event('report', board_job_id=board_id, job_id=job.job_id, state=state, **fields)
+
+    def _retry_call(self, method, *args):
+        """Call the coordinator, retrying network errors with a short backoff"""
+        for attempt in range(1, REPORT_ATTEMPTS + 1):
+            try:
+                return method(*args)
+            except LeaseLost:
+                raise
+            except OSError as e:
+                if getattr(e, 'errno', None) == errno.ENOSPC or attempt == REPORT_ATTEMPTS:
+                    raise
+                time.sleep(min(30, 2 ** attempt))
+
+    def _event(self, event, **fields):
+        if self.on_event:
+            self.on_event(event, worker=self.worker_id, **fields)
@@ -1,259 +1,34 @@
+import time
+# Taken before the other imports so the startup timings in the log include them
+STARTUP_STARTED = time.perf_counter()
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 import threading
-from yt_dlp import YoutubeDL
 import os
-import subprocess
 import queue
-import time
 import sys
 import io
+from engine import (check_ffmpeg_installation, get_default_ffmpeg_path, get_downloads_folder, get_app_data_dir,
+                    read_url_list, fetch_options, preload_yt_dlp, DownloadJob, DownloadQueue, ProgressUpdate)
+from playlist import is_playlist_url, queue_playlist
+from presets import PRESETS, DEFAULT_PRESET
+from archive import DownloadArchive
+from info_cache import ExtractionCache
+from journal import JobJournal
+from bandwidth import BandwidthScheduler, watch_limits_file
+from metrics import MetricsAggregator, format_summary
 
-def check_ffmpeg_installation(ffmpeg_path):
-    """Check if FFmpeg is available at the given path"""
-    try:
-        result = subprocess.run([ffmpeg_path, '-version'], 
-                              capture_output=True, text=True, timeout=5)
-        return result.returncode == 0
-    except (subprocess.TimeoutExpired, FileNotFoundError, subprocess.SubprocessError):
-        return False
-
-def find_ffmpeg_in_path():
-    """Try to find FFmpeg using environment variables and PATH"""
-    # Method 1: Check PATH environment variable directly
-    path_env = os.environ.get('PATH', '')
-    if path_env:
-        # Split PATH by semicolon on Windows, colon on Unix
-        path_separator = ';' if os.name == 'nt' else ':'
-        path_dirs = path_env.split(path_separator)
-        
-        # Look for ffmpeg in each PATH directory
-        ffmpeg_names = ['ffmpeg.exe', 'ffmpeg'] if os.name == 'nt' else ['ffmpeg']
-        for directory in path_dirs:
-            directory = directory.strip()
-            if not directory:
-                continue
-            try:
-                for ffmpeg_name in ffmpeg_names:
-                    ffmpeg_path = os.path.join(directory, ffmpeg_name)
-                    if os.path.isfile(ffmpeg_path) and check_ffmpeg_installation(ffmpeg_path):
-                        return ffmpeg_path
-            except (OSError, IOError):
-                continue
-    
-    # Method 2: Check common environment variables
-    env_vars_to_check = [
-        'FFMPEG_PATH',
-        'FFMPEG_HOME',
-        'FFMPEG_DIR',
-    ]
-    
-    for env_var in env_vars_to_check:
-        env_path = os.environ.get(env_var)
-        if env_path:
-            # Try the path directly
-            if os.path.isfile(env_path) and check_ffmpeg_installation(env_path):
-                return env_path
-            # Try adding /bin/ffmpeg.exe
-            bin_path = os.path.join(env_path, 'bin', 'ffmpeg.exe' if os.name == 'nt' else 'ffmpeg')
-            if os.path.isfile(bin_path) and check_ffmpeg_installation(bin_path):
-                return bin_path
-            # Try adding ffmpeg.exe directly
-            direct_path = os.path.join(env_path, 'ffmpeg.exe' if os.name == 'nt' else 'ffmpeg')
-            if os.path.isfile(direct_path) and check_ffmpeg_installation(direct_path):
-                return direct_path
-    
-    # Method 3: Fallback to subprocess if environment variable method fails
-    try:
-        # First check if ffmpeg command works
-        result = subprocess.run(['ffmpeg', '-version'], 
-                              capture_output=True, text=True, timeout=5)
-        if result.returncode == 0:
-            # Try to get the full path using subprocess
-            try:
-                if os.name == 'nt':  # Windows
-                    # Try PowerShell Get-Command first (more reliable for WinGet installations)
-                    ps_result = subprocess.run(['powershell', '-Command', '(Get-Command ffmpeg).Source'], 
-                                             capture_output=True, text=True, timeout=10)
-                    if ps_result.returncode == 0 and ps_result.stdout.strip():
-                        return ps_result.stdout.strip()
-                    
-                    # Try 'where' command as backup
-                    where_result = subprocess.run(['where', 'ffmpeg'], 
-                                                capture_output=True, text=True, timeout=5)
-                    if where_result.returncode == 0 and where_result.stdout.strip():
-                        paths = where_result.stdout.strip().split('\n')
-                        if paths and paths[0].strip():
-                            return paths[0].strip()
-                        
-                else:  # Linux/Mac
-                    which_result = subprocess.run(['which', 'ffmpeg'], 
-                                                capture_output=True, text=True, timeout=5)
-                    if which_result.returncode == 0:
-                        path = which_result.stdout.strip()
-                        if path:
-                            return path
-            except:
-                pass
-            # Return 'ffmpeg' if it works but we can't get the full path
-            return 'ffmpeg'
-    except (subprocess.TimeoutExpired, FileNotFoundError, subprocess.SubprocessError):
-        pass
-    
-    return None
-
-def get_default_ffmpeg_path():
-    """Get the default FFmpeg path, checking common locations"""
-    # Common FFmpeg installation paths on Windows
-    common_paths = [
-        "C:/tools/ffmpeg/bin/ffmpeg.exe",
-        "C:/ffmpeg/bin/ffmpeg.exe",
-        "C:/Program Files/ffmpeg/bin/ffmpeg.exe",
-        "C:/Program Files (x86)/ffmpeg/bin/ffmpeg.exe",
-        "C:/ProgramData/chocolatey/bin/ffmpeg.exe"
-    ]
-    
-    # Check if FFmpeg is in PATH first (highest priority)
-    path_ffmpeg = find_ffmpeg_in_path()
-    if path_ffmpeg:
-        return path_ffmpeg
-    
-    # Check all common installation paths
-    for path in common_paths:
-        if os.path.exists(path) and check_ffmpeg_installation(path):
-            return path
-    
-    # If nothing is found, return empty string to indicate no valid path found
-    return ""
-
-def get_downloads_folder():
-    """Get the user's Downloads folder path"""
-    if os.name == 'nt':  # Windows
-        downloads_path = os.path.join(os.path.expanduser('~'), 'Downloads')
-    else:  # Linux/Mac
-        downloads_path = os.path.join(os.path.expanduser('~'), 'Downloads')
-    
-    # Create Downloads folder if it doesn't exist
-    if not os.path.exists(downloads_path):
-        os.makedirs(downloads_path)
-    
-    return downloads_path
-
-class CustomLogger:
-    def __init__(self, log_queue):
-        self.log_queue = log_queue
-        self.download_finished = False
-        
-    def debug(self, msg):
-        if '[download]' in msg:
-            if '100%' in msg or 'finished' in msg.lower():
-                self.download_finished = True
-            self.log_queue.put(f"[DEBUG] {msg}")
-        elif '[Merger]' in msg:
-            self.log_queue.put(f"[MERGE] {msg}")
-        elif '[VideoConvertor]' in msg:
-            self.log_queue.put(f"[CONVERT] {msg}")
-        elif 'Deleting' in msg:
-            self.log_queue.put(f"[CLEANUP] {msg}")
-            
-    def info(self, msg):
-        self.log_queue.put(f"[INFO] {msg}")
-        
-    def warning(self, msg):
-        self.log_queue.put(f"[WARNING] {msg}")
-        
-    def error(self, msg):
-        self.log_queue.put(f"[ERROR] {msg}")
-
-class ProgressHook:
-    def __init__(self, log_queue):
-        self.log_queue = log_queue
-        self.files_finished = 0
-        self.total_files = 0
-    
-    def __call__(self, d):
-        if d['status'] == 'downloading':
-            # Extract progress information
-            total = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
-            downloaded = d.get('downloaded_bytes', 0)
-            speed = d.get('speed', 0)
-            eta = d.get('eta', 0)
-            filename = d.get('filename', 'Unknown file')
-            
-            if total > 0:
-                percentage = (downloaded / total) * 100
-                speed_mb = speed / 1024 / 1024 if speed else 0
-                eta_str = f"{eta//60:02d}:{eta%60:02d}" if eta else "Unknown"
-                
-                # Extract just the filename without path
-                file_display = os.path.basename(filename) if filename != 'Unknown file' else filename
-                log_message = f"[DOWNLOAD] {file_display} - {percentage:.1f}% | Speed: {speed_mb:.2f} MB/s | ETA: {eta_str}"
-                self.log_queue.put(log_message)
-                
-        elif d['status'] == 'finished':
-            filename = d.get('filename', 'Unknown file')
-            file_display = os.path.basename(filename) if filename != 'Unknown file' else filename
-            self.log_queue.put(f"[FINISHED] {file_display}")
-            self.files_finished += 1
-            
-        elif d['status'] == 'error':
-            self.log_queue.put(f"[ERROR] {d.get('error', 'Unknown error')}")
-
-def download_highest_resolution(url, output_path='.', ffmpeg_path=None, log_queue=None, format_type='mp4'):
-    progress_hook = ProgressHook(log_queue) if log_queue else None
-    custom_logger = CustomLogger(log_queue) if log_queue else None
-    
-    if format_type == 'mp3':
-        # Audio-only download for MP3
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': f'{output_path}/%(title)s.%(ext)s',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '320',
-            }],
-            'progress_hooks': [progress_hook] if progress_hook else [],
-            'logger': custom_logger,
-            'verbose': True,
-        }
-    else:
-        # Video download for MP4 (existing logic)
-        ydl_opts = {
-            'format': 'bestvideo[height<=1080]+bestaudio/best[height<=1080]',
-            'outtmpl': f'{output_path}/%(title)s.%(ext)s',
-            'merge_output_format': 'mp4',  # Merge into MP4
-            'postprocessors': [{
-                'key': 'FFmpegVideoConvertor',
-                'preferedformat': 'mp4',  # Ensure MP4 output
-            }],
-            'progress_hooks': [progress_hook] if progress_hook else [],
-            'logger': custom_logger,
-            'verbose': True,
-        }
-    
-    # Add FFmpeg location if provided
-    if ffmpeg_path:
-        ydl_opts['ffmpeg_location'] = ffmpeg_path
-    
-    try:
-        with YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
-            
-        # Add final success message
-        if log_queue:
-            format_name = format_type.upper()
-            log_queue.put(f"[SUCCESS] {format_name} download and processing completed successfully!")
-            
-        return True
-        
-    except Exception as e:
-        if log_queue:
-            log_queue.put(f"[ERROR] Download failed: {str(e)}")
-        raise e
+# Log widget refresh settings: how often queued messages are flushed, how many
+# are rendered per flush, and how many lines the widget keeps
+LOG_FLUSH_INTERVAL_MS = 100
+MAX_LOG_BATCH = 500
+MAX_LOG_LINES = 2000
+# How often the throughput statistics line is refreshed
+STATS_REFRESH_INTERVAL_MS = 1000
 
 class YouTubeDownloaderApp:
     def __init__(self, root):
+        init_started = time.perf_counter()
         self.root = root
         self.root.title("YouTube Video Downloader v2.1.0")
         
@@ -264,41 +39,113 @@ class YouTubeDownloaderApp:
         except:
             pass  # Continue without icon if not available
         
-        self.ffmpeg_path = get_default_ffmpeg_path()
+        self.ffmpeg_path = ""
         self.log_queue = queue.Queue()
-        self.download_success = False
+        # Opened in the background once the window is up (see open_stores)
+        self.archive = None
+        self.journal = None
+        self.stores_ready = False
+        self.ffmpeg_valid = False
+        self.metrics = MetricsAggregator()
+        self.info_cache = ExtractionCache()
+        self.bandwidth = BandwidthScheduler()
+        self.download_queue = DownloadQueue(self.log_queue, max_workers=3,
+                                            on_job_update=self.on_job_update, archive=self.archive,
+                                            metrics=self.metrics, info_cache=self.info_cache,
+                                            journal=self.journal, bandwidth=self.bandwidth)
         self.create_widgets()
-        self.validate_ffmpeg()
+        self.start_ffmpeg_detection()
         self.start_log_consumer()
+        self.root.after(STATS_REFRESH_INTERVAL_MS, self.refresh_stats)
+        self.startup_times = {'imports': init_started - STARTUP_STARTED, 'setup': time.perf_counter() - init_started}
+        # Idle callbacks run after the ones Tk queued to draw the widgets created above
+        self.root.after_idle(self.on_first_paint)
+
+    def on_first_paint(self):
+        """Log how long startup took and start loading yt-dlp now that the window is up"""
+        shown_after = time.perf_counter() - STARTUP_STARTED
+        self.log_queue.put(f"[STARTUP] Window shown after {shown_after:.2f}s "
+                           f"(imports {self.startup_times['imports']:.2f}s, setup {self.startup_times['setup']:.2f}s)")
+        self.start_engine_warm_up()
+
+    def start_engine_warm_up(self):
+        """Open the archive and journal, then import yt-dlp, in the background"""
+        def warm_up():
+            self.open_stores()
+            try:
+                import_seconds, extractor_seconds = preload_yt_dlp()
+                self.log_queue.put(f"[STARTUP] yt-dlp loaded in the background in {import_seconds:.2f}s "
+                                   f"(URL patterns compiled in {extractor_seconds:.2f}s)")
+            except Exception as e:
+                self.log_queue.put(f"[STARTUP] Could not load yt-dlp: {e}")
+        
+        threading.Thread(target=warm_up, daemon=True).start()
+
+    def open_stores(self):
+        """Open the SQLite archive and journal and start watching the limits file (runs in the warm-up thread)"""
+        archive = journal = None
+        try:
+            archive = DownloadArchive()
+        except Exception as e:
+            self.log_queue.put(f"[ARCHIVE] Download archive unavailable: {e}")
+        try:
+            journal = JobJournal()
+        except Exception as e:
+            self.log_queue.put(f"[JOURNAL] Job journal unavailable: {e}")
+        # Time-of-day profiles live in a JSON file that is re-read whenever it changes
+        watch_limits_file(self.bandwidth, os.path.join(get_app_data_dir(), 'bandwidth.json'),
+                          on_change=lambda scheduler, error: self.root.after(0, self.on_limits_file_changed, error))
+        self.root.after(0, self.on_stores_opened, archive, journal)
+
+    def on_stores_opened(self, archive, journal):
+        self.archive = archive
+        self.journal = journal
+        self.download_queue.archive = archive
+        self.download_queue.journal = journal
+        if archive is not None:
+            self.archive_check.config(state=tk.NORMAL)
+        else:
+            self.use_archive_var.set(False)
+        self.stores_ready = True
+        self.update_download_button()
+        self.offer_resume()
+
+    def update_download_button(self):
+        """Downloads need a working FFmpeg and the archive and journal opened"""
+        ready = self.ffmpeg_valid and self.stores_ready
+        self.download_button.config(state=tk.NORMAL if ready else tk.DISABLED)
+
+    def warm_session(self, ffmpeg_path):
+        """Build a YoutubeDL for the selected format in the background, ready for the first job"""
+        profile, ydl_opts = fetch_options(self.format_var.get(), ffmpeg_path, self.download_queue.segment_connections,
+                                          self.download_queue.connection_limiter)
+        threading.Thread(target=self.download_queue.session_pool.warm, args=(profile, ydl_opts), daemon=True).start()
 
     def create_widgets(self):
         # Create main frame
         main_frame = ttk.Frame(self.root)
         main_frame.grid(row=0, column=0, padx=10, pady=10, sticky="nsew")
         
-        # URL Entry
-        url_label = ttk.Label(main_frame, text="YouTube URL:")
-        url_label.grid(row=0, column=0, padx=5, pady=5, sticky=tk.W)
-        self.url_entry = ttk.Entry(main_frame, width=50)
-        self.url_entry.grid(row=0, column=1, columnspan=2, padx=5, pady=5, sticky=tk.EW)
+        # URL Entry (one URL per line)
+        url_label = ttk.Label(main_frame, text="YouTube URLs:")
+        url_label.grid(row=0, column=0, padx=5, pady=5, sticky=tk.NW)
+        self.url_text = scrolledtext.ScrolledText(main_frame, height=4, width=50)
+        self.url_text.grid(row=0, column=1, padx=5, pady=5, sticky=tk.EW)
+        import_button = ttk.Button(main_frame, text="Import...", command=self.import_urls)
+        import_button.grid(row=0, column=2, padx=5, pady=5, sticky=tk.N)
 
         # Format Selection
         format_label = ttk.Label(main_frame, text="Download Format:")
         format_label.grid(row=1, column=0, padx=5, pady=5, sticky=tk.W)
         
-        # Create frame for radio buttons
-        format_frame = ttk.Frame(main_frame)
-        format_frame.grid(row=1, column=1, columnspan=2, padx=5, pady=5, sticky=tk.W)
-        
-        # Format selection variable
-        self.format_var = tk.StringVar(value="mp4")
-        
-        # Radio buttons for format selection
-        mp4_radio = ttk.Radiobutton(format_frame, text="MP4 (Video)", variable=self.format_var, value="mp4")
-        mp4_radio.grid(row=0, column=0, padx=(0, 10))
-        
-        mp3_radio = ttk.Radiobutton(format_frame, text="MP3 (Audio Only)", variable=self.format_var, value="mp3")
-        mp3_radio.grid(row=0, column=1)
+        # Format selection variable (a preset name); the dropdown shows the preset labels
+        self.format_var = tk.StringVar(value=DEFAULT_PRESET)
+        preset_names = {preset.label: preset.name for preset in PRESETS.values()}
+        format_combo = ttk.Combobox(main_frame, values=list(preset_names), state="readonly", width=30)
+        format_combo.set(PRESETS[DEFAULT_PRESET].label)
+        format_combo.bind("<<ComboboxSelected>>",
+                          lambda event: self.format_var.set(preset_names[format_combo.get()]))
+        format_combo.grid(row=1, column=1, columnspan=2, padx=5, pady=5, sticky=tk.W)
 
         # Directory Entry with default Downloads folder
         dir_label = ttk.Label(main_frame, text="Output Directory:")
@@ -315,16 +162,12 @@ class YouTubeDownloaderApp:
         ffmpeg_label.grid(row=3, column=0, padx=5, pady=5, sticky=tk.W)
         self.ffmpeg_entry = ttk.Entry(main_frame, width=35)
         self.ffmpeg_entry.grid(row=3, column=1, padx=5, pady=5, sticky=tk.EW)
-        # Set the FFmpeg path if found
-        if self.ffmpeg_path:
-            self.ffmpeg_entry.insert(0, self.ffmpeg_path)
-        else:
-            # Add placeholder text for better UX
-            self.ffmpeg_entry.insert(0, "Click Browse to locate ffmpeg.exe")
-            self.ffmpeg_entry.config(foreground="gray")
-            # Bind events to handle placeholder text
-            self.ffmpeg_entry.bind("<FocusIn>", self.on_ffmpeg_entry_focus)
-            self.ffmpeg_entry.bind("<FocusOut>", self.on_ffmpeg_entry_unfocus)
+        # Add placeholder text until FFmpeg detection finishes in the background
+        self.ffmpeg_entry.insert(0, "Click Browse to locate ffmpeg.exe")
+        self.ffmpeg_entry.config(foreground="gray")
+        # Bind events to handle placeholder text
+        self.ffmpeg_entry.bind("<FocusIn>", self.on_ffmpeg_entry_focus)
+        self.ffmpeg_entry.bind("<FocusOut>", self.on_ffmpeg_entry_unfocus)
         
         # Create a frame for FFmpeg buttons
         ffmpeg_buttons_frame = ttk.Frame(main_frame)
@@ -336,77 +179,253 @@ class YouTubeDownloaderApp:
         ffmpeg_detect_button = ttk.Button(ffmpeg_buttons_frame, text="Auto-Detect", command=self.auto_detect_ffmpeg)
         ffmpeg_detect_button.grid(row=0, column=1, padx=(2, 0))
 
+        # Number of parallel downloads
+        workers_label = ttk.Label(main_frame, text="Parallel Downloads:")
+        workers_label.grid(row=4, column=0, padx=5, pady=5, sticky=tk.W)
+        self.workers_var = tk.IntVar(value=self.download_queue.max_workers)
+        workers_spinbox = ttk.Spinbox(main_frame, from_=1, to=16, width=5, textvariable=self.workers_var,
+                                      command=self.update_worker_count)
+        workers_spinbox.grid(row=4, column=1, padx=5, pady=5, sticky=tk.W)
+        workers_spinbox.bind("<FocusOut>", lambda event: self.update_worker_count())
+        
+        # Connections per file; more than one turns on segmented downloading
+        connections_frame = ttk.Frame(main_frame)
+        connections_frame.grid(row=4, column=1, padx=(80, 5), pady=5, sticky=tk.W)
+        connections_label = ttk.Label(connections_frame, text="Connections per file:")
+        connections_label.grid(row=0, column=0, padx=(0, 5))
+        self.connections_var = tk.IntVar(value=self.download_queue.segment_connections)
+        connections_spinbox = ttk.Spinbox(connections_frame, from_=1, to=16, width=5,
+                                          textvariable=self.connections_var, command=self.update_connection_count)
+        connections_spinbox.grid(row=0, column=1)
+        connections_spinbox.bind("<FocusOut>", lambda event: self.update_connection_count())
+        
+        # Skip videos already downloaded in this format to this folder
+        self.use_archive_var = tk.BooleanVar(value=True)
+        self.archive_check = ttk.Checkbutton(main_frame, text="Skip already downloaded", variable=self.use_archive_var)
+        self.archive_check.grid(row=4, column=1, columnspan=2, padx=5, pady=5, sticky=tk.E)
+        # Enabled once the archive has been opened
+        self.archive_check.config(state=tk.DISABLED)
+
+        # Bandwidth limits, applied live to running downloads (0 = unlimited)
+        limit_label = ttk.Label(main_frame, text="Speed Limit (MB/s):")
+        limit_label.grid(row=5, column=0, padx=5, pady=5, sticky=tk.W)
+        limit_frame = ttk.Frame(main_frame)
+        limit_frame.grid(row=5, column=1, columnspan=2, padx=5, pady=5, sticky=tk.W)
+        self.limit_var = tk.DoubleVar(value=0)
+        limit_spinbox = ttk.Spinbox(limit_frame, from_=0, to=1000, increment=0.5, width=6,
+                                    textvariable=self.limit_var, command=self.update_bandwidth_limits)
+        limit_spinbox.grid(row=0, column=0)
+        limit_spinbox.bind("<FocusOut>", lambda event: self.update_bandwidth_limits())
+        job_limit_label = ttk.Label(limit_frame, text="Per job:")
+        job_limit_label.grid(row=0, column=1, padx=(10, 5))
+        self.job_limit_var = tk.DoubleVar(value=0)
+        job_limit_spinbox = ttk.Spinbox(limit_frame, from_=0, to=1000, increment=0.5, width=6,
+                                        textvariable=self.job_limit_var, command=self.update_bandwidth_limits)
+        job_limit_spinbox.grid(row=0, column=2)
+        job_limit_spinbox.bind("<FocusOut>", lambda event: self.update_bandwidth_limits())
+        self.limit_status_label = ttk.Label(limit_frame, text=self.bandwidth.describe())
+        self.limit_status_label.grid(row=0, column=3, padx=(10, 0))
+
+        # Jobs download and post-process here before their files are moved to the output folder
+        scratch_label = ttk.Label(main_frame, text="Scratch Folder:")
+        scratch_label.grid(row=6, column=0, padx=5, pady=5, sticky=tk.W)
+        self.scratch_entry = ttk.Entry(main_frame, width=40)
+        self.scratch_entry.grid(row=6, column=1, padx=5, pady=5, sticky=tk.EW)
+        scratch_browse_button = ttk.Button(main_frame, text="Browse", command=self.browse_scratch_directory)
+        scratch_browse_button.grid(row=6, column=2, padx=5, pady=5)
+
         # Download Button
         self.download_button = ttk.Button(main_frame, text="Download", command=self.start_download)
-        self.download_button.grid(row=4, column=0, columnspan=3, padx=5, pady=5, sticky=tk.EW)
+        self.download_button.grid(row=7, column=0, columnspan=3, padx=5, pady=5, sticky=tk.EW)
 
         # Status Label
         self.status_label = ttk.Label(main_frame, text="")
-        self.status_label.grid(row=5, column=0, columnspan=3, padx=5, pady=5)
+        self.status_label.grid(row=8, column=0, columnspan=3, padx=5, pady=5)
+
+        # Job Queue Display
+        jobs_label = ttk.Label(main_frame, text="Download Queue:")
+        jobs_label.grid(row=9, column=0, columnspan=3, padx=5, pady=(10, 5), sticky=tk.W)
+        
+        self.jobs_tree = ttk.Treeview(main_frame, columns=("id", "state", "format", "url"),
+                                      show="headings", height=6)
+        self.jobs_tree.heading("id", text="#")
+        self.jobs_tree.heading("state", text="State")
+        self.jobs_tree.heading("format", text="Format")
+        self.jobs_tree.heading("url", text="URL")
+        self.jobs_tree.column("id", width=40, stretch=False)
+        self.jobs_tree.column("state", width=80, stretch=False)
+        self.jobs_tree.column("format", width=80, stretch=False)
+        self.jobs_tree.column("url", width=400)
+        self.jobs_tree.grid(row=10, column=0, columnspan=3, padx=5, pady=5, sticky="nsew")
+        
+        # Create a frame for job buttons
+        job_buttons_frame = ttk.Frame(main_frame)
+        job_buttons_frame.grid(row=11, column=0, columnspan=3, padx=5, pady=5, sticky=tk.EW)
+        job_buttons_frame.columnconfigure(0, weight=1)
+        
+        # Throughput statistics for all jobs
+        self.stats_label = ttk.Label(job_buttons_frame, text="", foreground="gray")
+        self.stats_label.grid(row=0, column=0, sticky=tk.W)
+        
+        cancel_button = ttk.Button(job_buttons_frame, text="Cancel Selected", command=self.cancel_selected_jobs)
+        cancel_button.grid(row=0, column=1, padx=(0, 2))
+        
+        retry_button = ttk.Button(job_buttons_frame, text="Retry Selected", command=self.retry_selected_jobs)
+        retry_button.grid(row=0, column=2, padx=(2, 0))
 
         # Log Display
         log_label = ttk.Label(main_frame, text="Download Logs:")
-        log_label.grid(row=6, column=0, columnspan=3, padx=5, pady=(10, 5), sticky=tk.W)
+        log_label.grid(row=12, column=0, columnspan=3, padx=5, pady=(10, 5), sticky=tk.W)
         
         # Create scrolled text widget for logs
-        self.log_text = scrolledtext.ScrolledText(main_frame, height=15, width=80, 
+        self.log_text = scrolledtext.ScrolledText(main_frame, height=12, width=80, 
                                                  font=('Consolas', 9), bg='black', fg='white')
-        self.log_text.grid(row=7, column=0, columnspan=3, padx=5, pady=5, sticky="nsew")
+        self.log_text.grid(row=13, column=0, columnspan=3, padx=5, pady=5, sticky="nsew")
 
         # Configure grid weights to make widgets expand
         main_frame.columnconfigure(1, weight=1)
-        main_frame.rowconfigure(7, weight=1)
+        main_frame.rowconfigure(10, weight=1)
+        main_frame.rowconfigure(13, weight=1)
         self.root.columnconfigure(0, weight=1)
         self.root.rowconfigure(0, weight=1)
 
     def start_log_consumer(self):
-        """Start the log consumer thread"""
-        def consume_logs():
-            while True:
-                try:
-                    # Get log message from queue with timeout
-                    message = self.log_queue.get(timeout=0.1)
-                    timestamp = time.strftime("%H:%M:%S")
-                    formatted_message = f"[{timestamp}] {message}\n"
-                    
-                    # Check for success indicators
-                    if "[SUCCESS]" in message or "completed successfully" in message.lower():
-                        self.download_success = True
-                    
-                    # Update UI in main thread
-                    self.root.after(0, self.append_log, formatted_message)
-                except queue.Empty:
-                    continue
-                except Exception as e:
-                    print(f"Log consumer error: {e}")
-                    break
-        
-        log_thread = threading.Thread(target=consume_logs, daemon=True)
-        log_thread.start()
+        """Start flushing queued log messages into the log widget in batches"""
+        self.last_progress_key = None
+        self.root.after(LOG_FLUSH_INTERVAL_MS, self.flush_logs)
+
+    def flush_logs(self):
+        """Drain the log queue on the main thread and render it with a single widget update"""
+        messages = []
+        try:
+            while len(messages) < MAX_LOG_BATCH:
+                messages.append(self.log_queue.get_nowait())
+        except queue.Empty:
+            pass
+        
+        try:
+            if messages:
+                self.render_log_batch(messages)
+        except Exception as e:
+            print(f"Log consumer error: {e}")
+        
+        # Come back sooner if the queue still has a backlog
+        delay = 1 if len(messages) >= MAX_LOG_BATCH else LOG_FLUSH_INTERVAL_MS
+        self.root.after(delay, self.flush_logs)
+
+    def render_log_batch(self, messages):
+        # Keep only the newest progress line per file; finished/error lines are kept as-is
+        latest_progress = {}
+        for index, message in enumerate(messages):
+            if isinstance(message, ProgressUpdate):
+                latest_progress[message.key] = index
+        
+        timestamp = time.strftime("%H:%M:%S")
+        lines = []
+        first_key = None
+        last_key = None
+        for index, message in enumerate(messages):
+            key = message.key if isinstance(message, ProgressUpdate) else None
+            if key is not None and latest_progress[key] != index:
+                continue
+            text = str(message)
+            if not lines:
+                first_key = key
+            lines.append(f"[{timestamp}] {text}\n")
+            last_key = key
+        
+        # Overwrite the previous progress line when the same file is still the last thing logged
+        if first_key is not None and first_key == self.last_progress_key:
+            self.log_text.delete("end-2l", "end-1l")
+        self.log_text.insert(tk.END, "".join(lines))
+        self.last_progress_key = last_key
+        self.trim_log()
+        self.log_text.see(tk.END)
 
     def append_log(self, message):
         """Append message to log text widget"""
         self.log_text.insert(tk.END, message)
+        self.last_progress_key = None
+        self.trim_log()
         self.log_text.see(tk.END)  # Auto-scroll to bottom
-        self.root.update_idletasks()
+
+    def trim_log(self):
+        """Drop the oldest lines so the widget never holds more than MAX_LOG_LINES"""
+        line_count = int(self.log_text.index("end-1c").split(".")[0])
+        if line_count > MAX_LOG_LINES:
+            self.log_text.delete("1.0", f"{line_count - MAX_LOG_LINES + 1}.0")
 
     def clear_logs(self):
         """Clear the log display"""
         self.log_text.delete(1.0, tk.END)
-        self.download_success = False
+        self.last_progress_key = None
+
+    def start_ffmpeg_detection(self, refresh=False):
+        """Look for FFmpeg in a background thread so the window appears immediately"""
+        self.status_label.config(text="Detecting FFmpeg...", foreground="black")
+        self.ffmpeg_valid = False
+        self.update_download_button()
+        
+        def detect():
+            started = time.perf_counter()
+            detected_path = get_default_ffmpeg_path(refresh)
+            self.log_queue.put(f"[FFMPEG] Detection took {time.perf_counter() - started:.2f}s")
+            self.root.after(0, self.on_ffmpeg_detected, detected_path, refresh)
+        
+        threading.Thread(target=detect, daemon=True).start()
+
+    def on_ffmpeg_detected(self, detected_path, user_requested):
+        current = self.ffmpeg_entry.get().strip()
+        # Don't overwrite a path the user typed while detection was running
+        if not user_requested and current and current != "Click Browse to locate ffmpeg.exe":
+            self.validate_ffmpeg()
+            return
+        
+        self.ffmpeg_entry.delete(0, tk.END)
+        if detected_path:
+            self.ffmpeg_path = detected_path
+            self.ffmpeg_entry.config(foreground="black")
+            self.ffmpeg_entry.insert(0, detected_path)
+            self.validate_ffmpeg()
+        elif user_requested:
+            self.ffmpeg_entry.insert(0, "FFmpeg not found - please use Browse")
+            self.ffmpeg_entry.config(foreground="red")
+            self.status_label.config(text="FFmpeg not found automatically. Please use Browse button.", foreground="red")
+        else:
+            self.ffmpeg_entry.insert(0, "Click Browse to locate ffmpeg.exe")
+            self.ffmpeg_entry.config(foreground="gray")
+            self.status_label.config(text="FFmpeg not detected. Please browse to locate FFmpeg installation.", foreground="orange")
 
     def validate_ffmpeg(self):
-        """Validate FFmpeg installation and update UI accordingly"""
+        """Validate FFmpeg installation in the background and update UI accordingly"""
         ffmpeg_path = self.ffmpeg_entry.get().strip()
-        if ffmpeg_path and check_ffmpeg_installation(ffmpeg_path):
+        if not ffmpeg_path or ffmpeg_path == "Click Browse to locate ffmpeg.exe":
+            self.apply_ffmpeg_validation("", False)
+            return
+        
+        def validate():
+            is_valid = check_ffmpeg_installation(ffmpeg_path)
+            self.root.after(0, self.apply_ffmpeg_validation, ffmpeg_path, is_valid)
+        
+        threading.Thread(target=validate, daemon=True).start()
+
+    def apply_ffmpeg_validation(self, ffmpeg_path, is_valid):
+        # Ignore stale results if the entry changed while validating
+        current = self.ffmpeg_entry.get().strip()
+        if ffmpeg_path and current != ffmpeg_path:
+            return
+        if is_valid:
             self.status_label.config(text="FFmpeg found and ready to use", foreground="green")
-            self.download_button.config(state=tk.NORMAL)
+            self.ffmpeg_valid = True
+            self.update_download_button()
+            self.warm_session(ffmpeg_path)
         else:
             if not ffmpeg_path:
                 self.status_label.config(text="FFmpeg not detected. Please browse to locate FFmpeg installation.", foreground="orange")
             else:
                 self.status_label.config(text="FFmpeg not found at specified path. Please verify the path.", foreground="red")
-            self.download_button.config(state=tk.DISABLED)
+            self.ffmpeg_valid = False
+            self.update_download_button()
 
     def browse_directory(self):
         directory = filedialog.askdirectory()
@@ -414,6 +433,13 @@ class YouTubeDownloaderApp:
             self.dir_entry.delete(0, tk.END)
             self.dir_entry.insert(0, directory)
 
+    def browse_scratch_directory(self):
+        """Pick a scratch folder, e.g. on a fast local disk; empty stages inside the output folder"""
+        directory = filedialog.askdirectory()
+        if directory:
+            self.scratch_entry.delete(0, tk.END)
+            self.scratch_entry.insert(0, directory)
+
     def on_ffmpeg_entry_focus(self, event):
         """Handle focus event on FFmpeg entry to clear placeholder text"""
         if self.ffmpeg_entry.get() == "Click Browse to locate ffmpeg.exe":
@@ -427,20 +453,8 @@ class YouTubeDownloaderApp:
             self.ffmpeg_entry.config(foreground="gray")
 
     def auto_detect_ffmpeg(self):
-        """Auto-detect FFmpeg location and update the entry field"""
-        # Clear the current entry
-        self.ffmpeg_entry.delete(0, tk.END)
-        self.ffmpeg_entry.config(foreground="black")
-        
-        # Try to detect FFmpeg
-        detected_path = get_default_ffmpeg_path()
-        if detected_path:
-            self.ffmpeg_entry.insert(0, detected_path)
-            self.validate_ffmpeg()
-        else:
-            self.ffmpeg_entry.insert(0, "FFmpeg not found - please use Browse")
-            self.ffmpeg_entry.config(foreground="red")
-            self.status_label.config(text="FFmpeg not found automatically. Please use Browse button.", foreground="red")
+        """Auto-detect FFmpeg location from scratch and update the entry field"""
+        self.start_ffmpeg_detection(refresh=True)
 
     def browse_ffmpeg(self):
         file_path = filedialog.askopenfilename(
@@ -453,14 +467,53 @@ class YouTubeDownloaderApp:
             self.ffmpeg_entry.config(foreground="black")  # Ensure text is visible
             self.validate_ffmpeg()
 
+    def import_urls(self):
+        """Load URLs from a text file into the URL box"""
+        file_path = filedialog.askopenfilename(
+            title="Select a file of URLs",
+            filetypes=[("Text files", "*.txt"), ("All files", "*.*")]
+        )
+        if not file_path:
+            return
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                urls = read_url_list(f.read())
+        except (OSError, UnicodeDecodeError) as e:
+            messagebox.showerror("Error", f"Could not read URL file: {e}")
+            return
+        existing = self.url_text.get(1.0, tk.END).strip()
+        if existing:
+            self.url_text.insert(tk.END, "\n")
+        self.url_text.insert(tk.END, "\n".join(urls))
+
+    def update_worker_count(self):
+        """Apply the Parallel Downloads setting to the download queue"""
+        try:
+            workers = int(self.workers_var.get())
+        except (tk.TclError, ValueError):
+            workers = self.download_queue.max_workers
+        workers = max(1, min(16, workers))
+        self.workers_var.set(workers)
+        self.download_queue.set_max_workers(workers)
+
+    def update_connection_count(self):
+        """Apply the Connections per file setting to jobs that start from now on"""
+        try:
+            connections = int(self.connections_var.get())
+        except (tk.TclError, ValueError):
+            connections = self.download_queue.segment_connections
+        connections = max(1, min(16, connections))
+        self.connections_var.set(connections)
+        self.download_queue.segment_connections = connections
+
     def start_download(self):
-        url = self.url_entry.get().strip()
+        urls = read_url_list(self.url_text.get(1.0, tk.END))
         directory = self.dir_entry.get().strip() or '.'  # Default to current directory if empty
         ffmpeg_path = self.ffmpeg_entry.get().strip()
         format_type = self.format_var.get()  # Get selected format
         
-        if not url:
-            messagebox.showerror("Error", "Please enter a YouTube URL.")
+        if not urls:
+            messagebox.showerror("Error", "Please enter at least one YouTube URL.")
             return
         
         if not ffmpeg_path:
@@ -471,48 +524,149 @@ class YouTubeDownloaderApp:
             messagebox.showerror("Error", "FFmpeg not found at the specified location. Please verify the path.")
             return
         
-        # Clear previous logs
-        self.clear_logs()
+        scratch_dir = self.scratch_entry.get().strip() or None
+        if scratch_dir:
+            try:
+                os.makedirs(scratch_dir, exist_ok=True)
+            except OSError as e:
+                messagebox.showerror("Error", f"Cannot use the scratch folder: {e}")
+                return
+        # Only affects jobs queued from now on
+        self.download_queue.storage.scratch_dir = scratch_dir
+        
+        # Clear previous logs unless other jobs are still being processed
+        counts = self.download_queue.counts()
+        if not counts[DownloadJob.QUEUED] and not counts[DownloadJob.RUNNING]:
+            self.clear_logs()
         
-        # Disable the download button during download
-        self.download_button.config(state=tk.DISABLED)
+        self.update_worker_count()
+        self.download_queue.archive = self.archive if self.use_archive_var.get() else None
         format_name = format_type.upper()
-        self.status_label.config(text=f"Downloading {format_name}...", foreground="black")
         
         # Add initial log message
-        self.append_log(f"Starting {format_name} download for: {url}\n")
+        self.append_log(f"Queueing {len(urls)} {format_name} download(s)\n")
         self.append_log(f"Output directory: {directory}\n")
+        if scratch_dir:
+            self.append_log(f"Scratch folder: {scratch_dir}\n")
         self.append_log(f"FFmpeg path: {ffmpeg_path}\n")
         self.append_log("-" * 50 + "\n")
         
-        # Start the download in a thread
-        thread = threading.Thread(target=self.download_thread, args=(url, directory, ffmpeg_path, format_type))
-        thread.start()
+        for url in urls:
+            if is_playlist_url(url):
+                # Playlists are expanded off the UI thread; each entry becomes its own job
+                threading.Thread(target=self.queue_playlist_thread,
+                                 args=(url, directory, ffmpeg_path, format_type), daemon=True).start()
+                continue
+            job = self.download_queue.add(url, directory, ffmpeg_path, format_type)
+            self.append_log(f"[JOB {job.job_id}] Queued: {url}\n")
+        
+        self.url_text.delete(1.0, tk.END)
 
-    def download_thread(self, url, directory, ffmpeg_path, format_type):
+    def queue_playlist_thread(self, url, directory, ffmpeg_path, format_type):
         try:
-            success = download_highest_resolution(url, directory, ffmpeg_path, self.log_queue, format_type)
-            # Give a moment for all logs to be processed
-            time.sleep(1)
-            self.root.after(0, self.on_download_complete, True, None)
+            queue_playlist(self.download_queue, url, directory, ffmpeg_path, format_type)
         except Exception as e:
-            error_msg = f"Download error: {str(e)}"
-            self.log_queue.put(error_msg)
-            self.root.after(0, self.on_download_complete, False, str(e))
-
-    def on_download_complete(self, success, error):
-        self.download_button.config(state=tk.NORMAL)
-        
-        # Check if we detected success through logs
-        if success or self.download_success:
-            self.status_label.config(text="Download completed successfully!", foreground="green")
-            self.append_log("\n" + "=" * 50 + "\n")
-            self.append_log("DOWNLOAD COMPLETED SUCCESSFULLY!\n")
-            self.append_log("Check your output directory for the downloaded file.\n")
+            self.log_queue.put(f"[ERROR] Could not expand playlist {url}: {str(e)}")
+
+    def offer_resume(self):
+        """Ask whether to resume downloads left unfinished when the app last closed or crashed"""
+        if self.journal is None:
+            return
+        try:
+            unfinished = self.journal.count()
+        except Exception as e:
+            self.log_queue.put(f"[JOURNAL] Could not read the job journal: {str(e)}")
+            return
+        if not unfinished:
+            return
+        if messagebox.askyesno("Resume Downloads",
+                               f"{unfinished} download(s) did not finish last time.\n\n"
+                               "Resume them? Partly downloaded files continue where they stopped.\n"
+                               "Choose No to discard them and delete their partial files."):
+            jobs = self.download_queue.resume_journal()
+            self.status_label.config(text=f"Resumed {len(jobs)} unfinished job(s)")
+        else:
+            discarded = self.download_queue.discard_journal()
+            self.log_queue.put(f"[JOURNAL] Discarded {discarded} unfinished job(s)")
+
+    def update_bandwidth_limits(self):
+        """Apply the Speed Limit settings to running and future downloads"""
+        limits = []
+        for var in (self.limit_var, self.job_limit_var):
+            try:
+                value = max(0.0, float(var.get()))
+            except (tk.TclError, ValueError):
+                value = 0.0
+            var.set(value)
+            limits.append(value * 1024 * 1024)
+        self.bandwidth.set_limits(*limits)
+        self.limit_status_label.config(text=self.bandwidth.describe())
+
+    def on_limits_file_changed(self, error):
+        if error is not None:
+            self.log_queue.put(f"[BANDWIDTH] Could not read bandwidth.json: {str(error)}")
+            return
+        self.limit_var.set(round((self.bandwidth.aggregate_limit or 0) / 1024 / 1024, 2))
+        self.job_limit_var.set(round((self.bandwidth.per_job_limit or 0) / 1024 / 1024, 2))
+        self.limit_status_label.config(text=self.bandwidth.describe())
+        self.log_queue.put(f"[BANDWIDTH] Loaded bandwidth.json ({self.bandwidth.describe()})")
+
+    def refresh_stats(self):
+        """Show the latest aggregate throughput and timing statistics"""
+        try:
+            if self.metrics.jobs:
+                self.stats_label.config(text=format_summary(self.metrics.snapshot()))
+            # A time-of-day profile may have started or ended
+            self.limit_status_label.config(text=self.bandwidth.describe())
+        except Exception as e:
+            print(f"Stats refresh error: {e}")
+        self.root.after(STATS_REFRESH_INTERVAL_MS, self.refresh_stats)
+
+    def selected_job_ids(self):
+        return [int(item) for item in self.jobs_tree.selection()]
+
+    def cancel_selected_jobs(self):
+        for job_id in self.selected_job_ids():
+            self.download_queue.cancel(job_id)
+
+    def retry_selected_jobs(self):
+        for job_id in self.selected_job_ids():
+            self.download_queue.retry(job_id)
+
+    def on_job_update(self, job):
+        # Called from worker threads, so snapshot the state and hand it to the main thread
+        self.root.after(0, self.refresh_job, job, job.state, job.error)
+
+    def refresh_job(self, job, state, error):
+        """Update the job's row in the queue view and the overall status"""
+        values = (job.job_id, state, job.format_type.upper(), job.url)
+        item = str(job.job_id)
+        if self.jobs_tree.exists(item):
+            self.jobs_tree.item(item, values=values)
+        else:
+            self.jobs_tree.insert("", tk.END, iid=item, values=values)
+        
+        if state == DownloadJob.DONE:
+            self.append_log(f"[JOB {job.job_id}] DOWNLOAD COMPLETED SUCCESSFULLY: {job.url}\n")
+        elif state == DownloadJob.FAILED:
+            self.append_log(f"[JOB {job.job_id}] DOWNLOAD FAILED: {error}\n")
+        elif state == DownloadJob.CANCELLED:
+            self.append_log(f"[JOB {job.job_id}] DOWNLOAD CANCELLED\n")
+        elif state == DownloadJob.QUEUED and error:
+            self.append_log(f"[JOB {job.job_id}] RETRYING: {error}\n")
+        
+        counts = self.download_queue.counts()
+        if counts[DownloadJob.QUEUED] or counts[DownloadJob.RUNNING]:
+            self.status_label.config(
+                text=f"Running: {counts[DownloadJob.RUNNING]} | Queued: {counts[DownloadJob.QUEUED]} | "
+                     f"Done: {counts[DownloadJob.DONE]} | Failed: {counts[DownloadJob.FAILED]}",
+                foreground="black")
+        elif counts[DownloadJob.FAILED]:
+            self.status_label.config(
+                text=f"Finished with errors: {counts[DownloadJob.DONE]} done, {counts[DownloadJob.FAILED]} failed",
+                foreground="red")
         else:
-            self.status_label.config(text=f"Error: {error}", foreground="red")
-            self.append_log("\n" + "=" * 50 + "\n")
-            self.append_log(f"DOWNLOAD FAILED: {error}\n")
+            self.status_label.config(text="All downloads completed successfully!", foreground="green")
 
 if __name__ == "__main__":
     root = tk.Tk()
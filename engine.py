@@ -0,0 +1,1434 @@
+"""Download engine shared by the GUI (download.py) and the command line (cli.py).
+
+This module must not import tkinter so it can run on headless machines. yt-dlp is
+imported where it is first needed, so the GUI can show its window before yt-dlp (and
+its hundreds of extractor modules) has loaded; preload_yt_dlp() does that in the background.
+"""
+import threading
+import os
+import subprocess
+import queue
+import json
+import re
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from sessions import SessionPool, YoutubeDLSession
+from storage import OutputManager, format_megabytes
+from presets import (get_preset, estimate_job, fits_mp4, MP4_VIDEO_CODECS, MP4_AUDIO_CODECS,
+                     DEFAULT_PRESET)
+from retry import RetryController, classify_error, host_of, ERROR_CANCELLED, ERROR_POSTPROCESS
+from metrics import (ProgressEvent, PHASE_DOWNLOAD, PHASE_MERGE, PHASE_CONVERT, PHASE_POSTPROCESS_QUEUE,
+                     phase_for_postprocessor)
+
+def get_app_data_dir():
+    """Get (and create) the per-user folder for caches and other app state"""
+    if os.name == 'nt':  # Windows
+        base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), 'AppData', 'Local')
+        data_dir = os.path.join(base, 'YouTubeDownloader')
+    else:  # Linux/Mac
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        data_dir = os.path.join(base, 'yt-downloader')
+    
+    os.makedirs(data_dir, exist_ok=True)
+    return data_dir
+
+def write_json_atomic(path, data):
+    """Write JSON to a temp file and rename it over path so readers never see a partial file"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+class FFmpegCache:
+    """Persistent record of FFmpeg probe results, keyed on path + mtime + size.
+    
+    Re-validating a known binary costs one os.stat instead of an `ffmpeg -version`
+    subprocess; replacing or upgrading the binary changes its stat and forces a new probe.
+    """
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        self.lock = threading.Lock()
+        self.entries = None
+        self.resolved_path = None
+    
+    def _load(self):
+        if self.entries is not None:
+            return
+        self.entries = {}
+        try:
+            if self.cache_file is None:
+                self.cache_file = os.path.join(get_app_data_dir(), 'ffmpeg_cache.json')
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.entries = data.get('entries', {})
+            self.resolved_path = data.get('resolved_path')
+        except (OSError, ValueError, AttributeError):
+            pass  # Missing or corrupt cache just means probing again
+    
+    def _save(self):
+        try:
+            write_json_atomic(self.cache_file, {'entries': self.entries, 'resolved_path': self.resolved_path})
+        except (OSError, TypeError):
+            pass  # The cache is only an optimisation
+    
+    @staticmethod
+    def _signature(ffmpeg_path):
+        # Bare command names like 'ffmpeg' are resolved through PATH so they can be stat'ed
+        real_path = ffmpeg_path if os.path.dirname(ffmpeg_path) else (shutil.which(ffmpeg_path) or ffmpeg_path)
+        try:
+            st = os.stat(real_path)
+        except OSError:
+            return None
+        return {'mtime': st.st_mtime, 'size': st.st_size}
+    
+    def lookup(self, ffmpeg_path):
+        """Return the cached probe result for ffmpeg_path, or None if it has to be probed"""
+        signature = self._signature(ffmpeg_path)
+        if signature is None:
+            return None
+        with self.lock:
+            self._load()
+            entry = self.entries.get(ffmpeg_path)
+        if entry and entry.get('mtime') == signature['mtime'] and entry.get('size') == signature['size']:
+            return entry.get('ok')
+        return None
+    
+    def store(self, ffmpeg_path, ok):
+        signature = self._signature(ffmpeg_path)
+        if signature is None:
+            return
+        with self.lock:
+            self._load()
+            self.entries[ffmpeg_path] = dict(signature, ok=ok)
+            self._save()
+    
+    def get_resolved_path(self):
+        """Return the last auto-detected path if it is still a known-good binary"""
+        with self.lock:
+            self._load()
+            resolved_path = self.resolved_path
+        if resolved_path and self.lookup(resolved_path):
+            return resolved_path
+        return None
+    
+    def set_resolved_path(self, ffmpeg_path):
+        with self.lock:
+            self._load()
+            self.resolved_path = ffmpeg_path or None
+            self._save()
+
+ffmpeg_cache = FFmpegCache()
+
+def probe_ffmpeg(ffmpeg_path):
+    """Run `ffmpeg -version` to check the binary actually works (uncached)"""
+    try:
+        result = subprocess.run([ffmpeg_path, '-version'], 
+                              capture_output=True, text=True, timeout=5)
+        return result.returncode == 0
+    except (subprocess.TimeoutExpired, FileNotFoundError, subprocess.SubprocessError, OSError):
+        return False
+
+def check_ffmpeg_installation(ffmpeg_path):
+    """Check if FFmpeg is available at the given path"""
+    if not ffmpeg_path:
+        return False
+    cached = ffmpeg_cache.lookup(ffmpeg_path)
+    if cached is not None:
+        return cached
+    ok = probe_ffmpeg(ffmpeg_path)
+    ffmpeg_cache.store(ffmpeg_path, ok)
+    return ok
+
+def find_ffmpeg_in_path():
+    """Try to find FFmpeg using environment variables and PATH"""
+    # Method 1: Check PATH environment variable directly
+    path_env = os.environ.get('PATH', '')
+    if path_env:
+        # Split PATH by semicolon on Windows, colon on Unix
+        path_separator = ';' if os.name == 'nt' else ':'
+        path_dirs = path_env.split(path_separator)
+        
+        # Look for ffmpeg in each PATH directory
+        ffmpeg_names = ['ffmpeg.exe', 'ffmpeg'] if os.name == 'nt' else ['ffmpeg']
+        for directory in path_dirs:
+            directory = directory.strip()
+            if not directory:
+                continue
+            try:
+                for ffmpeg_name in ffmpeg_names:
+                    ffmpeg_path = os.path.join(directory, ffmpeg_name)
+                    if os.path.isfile(ffmpeg_path) and check_ffmpeg_installation(ffmpeg_path):
+                        return ffmpeg_path
+            except (OSError, IOError):
+                continue
+    
+    # Method 2: Check common environment variables
+    env_vars_to_check = [
+        'FFMPEG_PATH',
+        'FFMPEG_HOME',
+        'FFMPEG_DIR',
+    ]
+    
+    for env_var in env_vars_to_check:
+        env_path = os.environ.get(env_var)
+        if env_path:
+            # Try the path directly
+            if os.path.isfile(env_path) and check_ffmpeg_installation(env_path):
+                return env_path
+            # Try adding /bin/ffmpeg.exe
+            bin_path = os.path.join(env_path, 'bin', 'ffmpeg.exe' if os.name == 'nt' else 'ffmpeg')
+            if os.path.isfile(bin_path) and check_ffmpeg_installation(bin_path):
+                return bin_path
+            # Try adding ffmpeg.exe directly
+            direct_path = os.path.join(env_path, 'ffmpeg.exe' if os.name == 'nt' else 'ffmpeg')
+            if os.path.isfile(direct_path) and check_ffmpeg_installation(direct_path):
+                return direct_path
+    
+    # Method 3: Fallback to subprocess if environment variable method fails
+    try:
+        # First check if ffmpeg command works
+        if check_ffmpeg_installation('ffmpeg'):
+            # Try to get the full path using subprocess
+            try:
+                if os.name == 'nt':  # Windows
+                    # Try PowerShell Get-Command first (more reliable for WinGet installations)
+                    ps_result = subprocess.run(['powershell', '-Command', '(Get-Command ffmpeg).Source'], 
+                                             capture_output=True, text=True, timeout=10)
+                    if ps_result.returncode == 0 and ps_result.stdout.strip():
+                        return ps_result.stdout.strip()
+                    
+                    # Try 'where' command as backup
+                    where_result = subprocess.run(['where', 'ffmpeg'], 
+                                                capture_output=True, text=True, timeout=5)
+                    if where_result.returncode == 0 and where_result.stdout.strip():
+                        paths = where_result.stdout.strip().split('\n')
+                        if paths and paths[0].strip():
+                            return paths[0].strip()
+                        
+                else:  # Linux/Mac
+                    which_result = subprocess.run(['which', 'ffmpeg'], 
+                                                capture_output=True, text=True, timeout=5)
+                    if which_result.returncode == 0:
+                        path = which_result.stdout.strip()
+                        if path:
+                            return path
+            except:
+                pass
+            # Return 'ffmpeg' if it works but we can't get the full path
+            return 'ffmpeg'
+    except (subprocess.TimeoutExpired, FileNotFoundError, subprocess.SubprocessError):
+        pass
+    
+    return None
+
+def get_default_ffmpeg_path(refresh=False):
+    """Get the default FFmpeg path, reusing the cached result while the binary is unchanged"""
+    cached_path = None if refresh else ffmpeg_cache.get_resolved_path()
+    if cached_path:
+        return cached_path
+    
+    detected_path = detect_ffmpeg_path()
+    ffmpeg_cache.set_resolved_path(detected_path)
+    return detected_path
+
+def detect_ffmpeg_path():
+    """Search for FFmpeg from scratch, checking PATH and common locations"""
+    # Common FFmpeg installation paths on Windows
+    common_paths = [
+        "C:/tools/ffmpeg/bin/ffmpeg.exe",
+        "C:/ffmpeg/bin/ffmpeg.exe",
+        "C:/Program Files/ffmpeg/bin/ffmpeg.exe",
+        "C:/Program Files (x86)/ffmpeg/bin/ffmpeg.exe",
+        "C:/ProgramData/chocolatey/bin/ffmpeg.exe"
+    ]
+    
+    # Check if FFmpeg is in PATH first (highest priority)
+    path_ffmpeg = find_ffmpeg_in_path()
+    if path_ffmpeg:
+        return path_ffmpeg
+    
+    # Check all common installation paths
+    for path in common_paths:
+        if os.path.exists(path) and check_ffmpeg_installation(path):
+            return path
+    
+    # If nothing is found, return empty string to indicate no valid path found
+    return ""
+
+def get_downloads_folder():
+    """Get the user's Downloads folder path"""
+    if os.name == 'nt':  # Windows
+        downloads_path = os.path.join(os.path.expanduser('~'), 'Downloads')
+    else:  # Linux/Mac
+        downloads_path = os.path.join(os.path.expanduser('~'), 'Downloads')
+    
+    # Not created here: startup stays free of disk writes, and the first download
+    # into a missing folder creates it
+    return downloads_path
+
+def job_log_prefix(job_id):
+    """Return the prefix used to tell apart log lines of concurrent jobs"""
+    return f"[JOB {job_id}] " if job_id is not None else ""
+
+class CustomLogger:
+    def __init__(self, log_queue, job_id=None, on_event=None):
+        self.log_queue = log_queue
+        self.job_id = job_id
+        self.prefix = job_log_prefix(job_id)
+        # Optional callable receiving a ProgressEvent for every warning and error
+        self.on_event = on_event
+        self.download_finished = False
+        
+    def debug(self, msg):
+        if '[download]' in msg:
+            # With noprogress yt-dlp only reports the end of each download
+            if 'completed' in msg.lower() or 'finished' in msg.lower():
+                self.download_finished = True
+            self._put(f"{self.prefix}[DEBUG] {msg}")
+        elif '[Merger]' in msg:
+            self._put(f"{self.prefix}[MERGE] {msg}")
+        elif '[VideoConvertor]' in msg:
+            self._put(f"{self.prefix}[CONVERT] {msg}")
+        elif 'Deleting' in msg:
+            self._put(f"{self.prefix}[CLEANUP] {msg}")
+            
+    def info(self, msg):
+        self._put(f"{self.prefix}[INFO] {msg}")
+        
+    def warning(self, msg):
+        self._emit('warning', msg)
+        self._put(f"{self.prefix}[WARNING] {msg}")
+        
+    def error(self, msg):
+        self._emit('error', msg)
+        self._put(f"{self.prefix}[ERROR] {msg}")
+
+    def _emit(self, level, msg):
+        if self.on_event:
+            self.on_event(ProgressEvent(self.job_id, None, 'message', message=msg, level=level))
+
+    def _put(self, message):
+        # Without a queue the messages are dropped rather than printed by yt-dlp
+        if self.log_queue is not None:
+            self.log_queue.put(message)
+
+# Minimum seconds between two progress reports for the same file
+DEFAULT_PROGRESS_INTERVAL = 0.5
+
+class ProgressUpdate:
+    """A download progress line; log consumers may drop all but the newest one per key"""
+    def __init__(self, job_id, filename, message):
+        self.key = (job_id, filename)
+        self.message = message
+    
+    def __str__(self):
+        return self.message
+
+class ProgressHook:
+    def __init__(self, log_queue, job_id=None, cancel_event=None, on_progress=None,
+                 min_interval=DEFAULT_PROGRESS_INTERVAL, bandwidth=None):
+        self.log_queue = log_queue
+        self.job_id = job_id
+        self.prefix = job_log_prefix(job_id)
+        self.cancel_event = cancel_event
+        # Optional callable receiving a ProgressEvent per reported update
+        self.on_progress = on_progress
+        self.min_interval = min_interval
+        self.last_report = {}
+        self.files_finished = 0
+        self.total_files = 0
+        # (filepath, info_dict) of every stream file that finished downloading
+        self.finished_files = []
+        # Optional BandwidthScheduler; downloads are slowed down from inside this hook
+        self.bandwidth = bandwidth
+        self.last_bytes = {}
+    
+    def throttle(self, nbytes):
+        """Wait until the bandwidth scheduler allows this job another nbytes"""
+        if self.bandwidth is not None:
+            self.bandwidth.consume(self.job_id, nbytes, self.cancel_event)
+    
+    def throttle_progress(self, d):
+        # yt-dlp calls the hook after every block, so sleeping here paces the download itself
+        filename = d.get('filename')
+        downloaded = d.get('downloaded_bytes') or 0
+        last = self.last_bytes.get(filename)
+        self.last_bytes[filename] = downloaded
+        # The first report of a file may include bytes resumed from disk
+        if last is not None and downloaded > last:
+            self.throttle(downloaded - last)
+    
+    def should_report(self, d):
+        """Throttle 'downloading' ticks per file; other statuses are always reported"""
+        if d['status'] != 'downloading':
+            self.last_report.pop(d.get('filename'), None)
+            return True
+        now = time.monotonic()
+        last = self.last_report.get(d.get('filename'))
+        if last is not None and now - last < self.min_interval:
+            return False
+        self.last_report[d.get('filename')] = now
+        return True
+    
+    def __call__(self, d):
+        # Raising from a progress hook is how yt-dlp lets callers abort a download
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            from yt_dlp.utils import DownloadCancelled
+            raise DownloadCancelled("Download cancelled by user")
+        
+        # Segmented downloads pace each connection themselves
+        if self.bandwidth is not None and d['status'] == 'downloading' and not d.get('rate_limited'):
+            self.throttle_progress(d)
+        
+        if not self.should_report(d):
+            return
+        
+        if self.on_progress:
+            self.on_progress(ProgressEvent(
+                self.job_id, PHASE_DOWNLOAD, d['status'],
+                filename=d.get('filename'),
+                downloaded_bytes=d.get('downloaded_bytes'),
+                total_bytes=d.get('total_bytes') or d.get('total_bytes_estimate'),
+                speed=d.get('speed'),
+                eta=d.get('eta'),
+            ))
+        
+        if d['status'] == 'downloading':
+            # Extract progress information
+            total = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
+            downloaded = d.get('downloaded_bytes', 0)
+            speed = d.get('speed', 0)
+            eta = d.get('eta', 0)
+            filename = d.get('filename', 'Unknown file')
+            
+            if total > 0:
+                percentage = (downloaded / total) * 100
+                speed_mb = speed / 1024 / 1024 if speed else 0
+                eta_str = f"{eta//60:02d}:{eta%60:02d}" if eta else "Unknown"
+                
+                # Extract just the filename without path
+                file_display = os.path.basename(filename) if filename != 'Unknown file' else filename
+                log_message = f"{self.prefix}[DOWNLOAD] {file_display} - {percentage:.1f}% | Speed: {speed_mb:.2f} MB/s | ETA: {eta_str}"
+                self._put(ProgressUpdate(self.job_id, filename, log_message))
+                
+        elif d['status'] == 'finished':
+            filename = d.get('filename', 'Unknown file')
+            file_display = os.path.basename(filename) if filename != 'Unknown file' else filename
+            self._put(f"{self.prefix}[FINISHED] {file_display}")
+            self.files_finished += 1
+            if filename != 'Unknown file':
+                self.finished_files.append((filename, d.get('info_dict') or {}))
+            
+        elif d['status'] == 'error':
+            self._put(f"{self.prefix}[ERROR] {d.get('error', 'Unknown error')}")
+
+    def postprocessor_hook(self, d):
+        """Report merge/convert phases from yt-dlp's postprocessor_hooks"""
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            from yt_dlp.utils import DownloadCancelled
+            raise DownloadCancelled("Download cancelled by user")
+        
+        phase = phase_for_postprocessor(d.get('postprocessor'))
+        if phase and self.on_progress and d.get('status') in ('started', 'finished'):
+            info = d.get('info_dict') or {}
+            self.on_progress(ProgressEvent(self.job_id, phase, d['status'], filename=info.get('filepath')))
+
+    def _put(self, message):
+        if self.log_queue is not None:
+            self.log_queue.put(message)
+
+# Info dict fields kept in the job journal for post-processing and the archive
+JOURNAL_INFO_KEYS = ('id', 'title', 'extractor_key', 'format_id', 'ext', 'vcodec', 'acodec')
+
+class FetchedMedia:
+    """Raw streams downloaded by fetch_media, waiting to be post-processed"""
+    def __init__(self, url, output_path, ffmpeg_path, format_type, job_id=None, url_key=None):
+        self.url = url
+        self.output_path = output_path
+        self.ffmpeg_path = ffmpeg_path
+        self.format_type = format_type
+        self.job_id = job_id
+        self.url_key = url_key
+        # video id -> {'info': info_dict, 'files': [(filepath, info_dict), ...]}
+        self.videos = {}
+        self.skipped = False
+        self.output_files = []
+        # Folder the streams were downloaded to when the job is staged, otherwise None
+        self.staging_path = None
+        # presets.JobEstimate made after extraction, or None if the size wasn't known
+        self.estimate = None
+    
+    def to_dict(self):
+        """Everything post-processing and the archive need, as JSON-serialisable data"""
+        def slim(info):
+            return {key: info.get(key) for key in JOURNAL_INFO_KEYS if info.get(key) is not None}
+        return {
+            'url_key': self.url_key,
+            'videos': {video_id: {'info': slim(video['info']),
+                                  'files': [[path, slim(info)] for path, info in video['files']]}
+                       for video_id, video in self.videos.items()},
+            'output_files': list(self.output_files),
+            'staging_path': self.staging_path,
+        }
+    
+    @classmethod
+    def from_dict(cls, data, url, output_path, ffmpeg_path, format_type, job_id=None):
+        fetched = cls(url, output_path, ffmpeg_path, format_type, job_id, data.get('url_key'))
+        for video_id, video in (data.get('videos') or {}).items():
+            fetched.videos[video_id] = {'info': video['info'],
+                                        'files': [(path, info) for path, info in video['files']]}
+        fetched.output_files = list(data.get('output_files') or [])
+        fetched.staging_path = data.get('staging_path')
+        return fetched
+    
+    def prune_finished(self):
+        """Drop videos whose output already exists; False if some video needs downloading again"""
+        for video_id, video in list(self.videos.items()):
+            sources = [path for path, _ in video['files']]
+            if sources and all(os.path.exists(path) for path in sources):
+                continue
+            base = output_base_name(*video['files'][0]) if video['files'] else None
+            target = f"{base}.{get_preset(self.format_type).output_ext(video['files'][-1][0])}" if base else None
+            if target and os.path.exists(target):
+                del self.videos[video_id]
+                if target not in self.output_files:
+                    self.output_files.append(target)
+                continue
+            # Already moved out of staging before the run was interrupted
+            if target and self.staging_path and os.path.exists(os.path.join(self.output_path,
+                                                                            os.path.basename(target))):
+                del self.videos[video_id]
+                continue
+            return False
+        return True
+
+def fetch_options(format_type, ffmpeg_path=None, segment_connections=1, connection_limiter=None):
+    """Return the (profile, ydl_opts) pair the fetch stage uses for a preset and FFmpeg location.
+
+    Everything that differs per job (hooks, logger, output folder) is attached to a
+    session separately, so jobs with the same profile can share a YoutubeDL.
+    """
+    preset = get_preset(format_type)
+    ydl_opts = {
+        'format': preset.format_selector(),
+        # The format id keeps the video and audio streams of one title apart
+        'outtmpl': '%(title)s.f%(format_id)s.%(ext)s',
+        'verbose': True,
+        # Progress is reported by ProgressHook, throttled per file; yt-dlp's own lines would bypass that
+        'noprogress': True,
+    }
+    # E.g. prefer H.264/AAC among the best allowed resolution, so MP4 needs no re-encode
+    if preset.format_sort():
+        ydl_opts['format_sort'] = preset.format_sort()
+    
+    # Add FFmpeg location if provided
+    if ffmpeg_path:
+        ydl_opts['ffmpeg_location'] = ffmpeg_path
+    
+    # Segmented mode: byte ranges of plain HTTP streams, fragments of DASH/HLS ones, in parallel
+    segment_connections = max(1, int(segment_connections or 1))
+    if segment_connections > 1:
+        ydl_opts['segment_connections'] = segment_connections
+        ydl_opts['connection_limiter'] = connection_limiter
+        ydl_opts['concurrent_fragment_downloads'] = segment_connections
+    return (format_type, ffmpeg_path or None, segment_connections), ydl_opts
+
+@contextmanager
+def borrow_session(session_pool, profile, ydl_opts):
+    """Lend a session from the pool, or build a one-off session when there is no pool"""
+    if session_pool is not None:
+        with session_pool.session(profile, ydl_opts) as session:
+            yield session
+        return
+    session = YoutubeDLSession(profile, ydl_opts)
+    try:
+        yield session
+    finally:
+        session.close()
+
+def extract_video_info(ydl, url, info_cache=None, log_queue=None, prefix=''):
+    """Return the unprocessed info dict for a URL, from the extraction cache when possible"""
+    info = info_cache.get(url) if info_cache else None
+    if info is not None:
+        if log_queue:
+            log_queue.put(f"{prefix}[CACHE] Reusing extracted info for {info.get('title') or url}")
+        return info, True
+    info = ydl.extract_info(url, download=False, process=False)
+    # Playlists and redirects are resolved per entry later, so only single videos are cached
+    if info_cache and info and info.get('_type', 'video') == 'video' and info.get('formats'):
+        info_cache.put(url, info)
+    return info, False
+
+def probe_url(url, ffmpeg_path=None, info_cache=None, session_pool=None, log_queue=None):
+    """Extract a URL's info without downloading, e.g. to compare presets before queueing it.
+    
+    With an ExtractionCache the job queued afterwards reuses this extraction.
+    """
+    profile, ydl_opts = fetch_options(DEFAULT_PRESET, ffmpeg_path)
+    with borrow_session(session_pool, profile, ydl_opts) as session:
+        session.attach(logger=CustomLogger(log_queue))
+        info, _ = extract_video_info(session.ydl, url, info_cache, log_queue)
+    return info
+
+def fetch_media(url, output_path='.', ffmpeg_path=None, log_queue=None, format_type=DEFAULT_PRESET,
+                job_id=None, cancel_event=None, on_progress=None, archive=None,
+                progress_interval=DEFAULT_PROGRESS_INTERVAL, info_cache=None, session_pool=None,
+                segment_connections=1, connection_limiter=None, bandwidth=None, storage=None, staging_path=None,
+                throughput=None, preset_choice=None, on_preset=None):
+    """Stage 1: download the raw streams for a URL without any FFmpeg merging or converting.
+    
+    With an OutputManager and a staging folder, the streams go to the staging folder
+    after the job's estimated size has been reserved on disk. throughput (bytes per
+    second, if known) is used to estimate the download time. With a presets.PresetChoice
+    the preset is picked from the extracted formats, replacing format_type, and
+    on_preset is called with the chosen name before anything is downloaded.
+    """
+    from yt_dlp.utils import DownloadCancelled
+    progress_hook = ProgressHook(log_queue, job_id, cancel_event, on_progress, progress_interval, bandwidth)
+    # The logger is always installed so yt-dlp never prints to stdout (the CLI's JSON stream)
+    custom_logger = CustomLogger(log_queue, job_id, on_progress)
+    prefix = job_log_prefix(job_id)
+    
+    # Skip videos already downloaded in this format to this folder, before any network access
+    url_key = archive.key_for_url(url) if archive else None
+    fetched = FetchedMedia(url, output_path, ffmpeg_path, format_type, job_id, url_key)
+    done_formats = preset_choice.candidates if preset_choice is not None else [format_type]
+    if url_key and any(archive.contains(url_key, name, output_path) for name in done_formats):
+        if log_queue:
+            log_queue.put(f"{prefix}[ARCHIVE] Already downloaded ({url_key}), skipping")
+        fetched.skipped = True
+        return fetched
+    
+    profile, ydl_opts = fetch_options(format_type, ffmpeg_path, segment_connections, connection_limiter)
+    
+    def download(session, info):
+        estimate_media(info, fetched, throughput, log_queue)
+        if storage is not None and staging_path:
+            reserve_space(storage, fetched, staging_path, log_queue, cancel_event)
+        session.ydl.process_ie_result(info, download=True)
+    
+    from_cache = False
+    try:
+        with borrow_session(session_pool, profile, ydl_opts) as session:
+            session.attach(staging_path or output_path, progress_hook, progress_hook.postprocessor_hook,
+                           custom_logger, progress_hook.throttle if bandwidth is not None else None)
+            # Extract and download as two steps so the extraction can be cached and reused
+            info, from_cache = extract_video_info(session.ydl, url, info_cache, log_queue, prefix)
+            # URLs the archive can't key (e.g. generic extractor pages) are only recognised by their info
+            info_key = archive.key_for_info(info) if archive and info.get('_type', 'video') == 'video' else None
+            if info_key and info_key != url_key and any(archive.contains(info_key, name, output_path)
+                                                        for name in done_formats):
+                if log_queue:
+                    log_queue.put(f"{prefix}[ARCHIVE] Already downloaded ({info_key}), skipping")
+                fetched.skipped = True
+                return fetched
+            if preset_choice is not None:
+                choose_preset(preset_choice, info, fetched, throughput, log_queue)
+                if on_preset:
+                    on_preset(fetched.format_type)
+            if fetched.format_type == format_type:
+                download(session, info)
+        if fetched.format_type != format_type:
+            # The chosen preset selects other streams, so download with a session set up for it
+            profile, ydl_opts = fetch_options(fetched.format_type, ffmpeg_path, segment_connections,
+                                              connection_limiter)
+            with borrow_session(session_pool, profile, ydl_opts) as session:
+                session.attach(staging_path or output_path, progress_hook, progress_hook.postprocessor_hook,
+                               custom_logger, progress_hook.throttle if bandwidth is not None else None)
+                download(session, info)
+    except DownloadCancelled as e:
+        if log_queue:
+            log_queue.put(f"{prefix}[CANCELLED] {str(e)}")
+        raise e
+    except Exception as e:
+        if log_queue:
+            log_queue.put(f"{prefix}[ERROR] Download failed: {str(e)}")
+        # Stale stream URLs are a common cause, so make a retry extract afresh
+        if info_cache:
+            info_cache.invalidate(url)
+            if from_cache and log_queue:
+                log_queue.put(f"{prefix}[CACHE] Dropped cached info for {url}")
+        raise e
+    
+    for filepath, info in progress_hook.finished_files:
+        video = fetched.videos.setdefault(info.get('id') or filepath, {'info': info, 'files': []})
+        if filepath not in [path for path, _ in video['files']]:
+            video['files'].append((filepath, info))
+    return fetched
+
+def choose_preset(preset_choice, info, fetched, throughput=None, log_queue=None):
+    """Switch a job to the cheapest of its candidate presets that meets its quality bar"""
+    chosen, estimates = preset_choice.choose(info, throughput)
+    fetched.format_type = chosen
+    if log_queue:
+        prefix = job_log_prefix(fetched.job_id)
+        if chosen in estimates and estimates[chosen].meets(preset_choice.min_height, preset_choice.min_abr):
+            log_queue.put(f"{prefix}[PRESET] Cheapest of {', '.join(preset_choice.candidates)}: {chosen}")
+        else:
+            log_queue.put(f"{prefix}[PRESET] No preset with a known size meets the quality bar, using {chosen}")
+
+def estimate_media(info, fetched, throughput=None, log_queue=None):
+    """Predict a job's download size and time and its post-processing step from its extracted formats"""
+    fetched.estimate = estimate_job(info, get_preset(fetched.format_type), throughput)
+    if log_queue and fetched.estimate:
+        log_queue.put(f"{job_log_prefix(fetched.job_id)}[ESTIMATE] {fetched.estimate.describe()}")
+
+def reserve_space(storage, fetched, staging_path, log_queue=None, cancel_event=None):
+    """Reserve disk space for a job from its estimate before anything is downloaded"""
+    prefix = job_log_prefix(fetched.job_id)
+    
+    def on_wait(reserved):
+        if log_queue:
+            log_queue.put(f"{prefix}[DISK] Waiting for other jobs to free up space "
+                          f"({format_megabytes(reserved)} reserved)")
+    
+    estimate = (fetched.estimate.download_bytes, fetched.estimate.output_bytes) if fetched.estimate else None
+    fetched.staging_path = staging_path
+    reserved = storage.reserve(staging_path, fetched.output_path, estimate, cancel_event, on_wait)
+    if log_queue:
+        if estimate:
+            log_queue.put(f"{prefix}[DISK] Reserved {format_megabytes(reserved)} for an estimated "
+                          f"{format_megabytes(estimate[0])} download")
+        else:
+            log_queue.put(f"{prefix}[DISK] Size unknown, checked the minimum free space only")
+
+def finalize_media(fetched, storage, log_queue=None):
+    """Move the finished files of a staged job into its output folder"""
+    if not fetched.staging_path:
+        return
+    prefix = job_log_prefix(fetched.job_id)
+    moved = []
+    for path in fetched.output_files:
+        if os.path.dirname(os.path.abspath(path)) != os.path.abspath(fetched.staging_path):
+            moved.append(path)
+            continue
+        target = storage.move_to_output(path, fetched.output_path)
+        if log_queue and os.path.basename(target) != os.path.basename(path):
+            log_queue.put(f"{prefix}[MOVE] {os.path.basename(path)} already exists, saved as "
+                          f"{os.path.basename(target)}")
+        moved.append(target)
+    fetched.output_files = moved
+
+def ffmpeg_executable(ffmpeg_path):
+    """Turn an FFmpeg location (binary, folder or nothing) into something runnable"""
+    if not ffmpeg_path:
+        return 'ffmpeg'
+    if os.path.isdir(ffmpeg_path):
+        return os.path.join(ffmpeg_path, 'ffmpeg.exe' if os.name == 'nt' else 'ffmpeg')
+    return ffmpeg_path
+
+def run_ffmpeg(ffmpeg_path, args):
+    """Run FFmpeg with the given arguments, raising PostProcessingError on failure"""
+    from yt_dlp.utils import PostProcessingError
+    command = [ffmpeg_executable(ffmpeg_path), '-y', '-hide_banner', '-loglevel', 'error'] + args
+    try:
+        result = subprocess.run(command, capture_output=True, text=True)
+    except OSError as e:
+        raise PostProcessingError(f"Could not run FFmpeg: {e}")
+    if result.returncode != 0:
+        message = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"
+        raise PostProcessingError(f"FFmpeg failed: {message}")
+
+def probe_codecs(ffmpeg_path, filepath):
+    """Read the first video and audio codec names of a file from FFmpeg's stream listing"""
+    try:
+        result = subprocess.run([ffmpeg_executable(ffmpeg_path), '-hide_banner', '-i', filepath],
+                                capture_output=True, text=True, timeout=30)
+    except (subprocess.TimeoutExpired, OSError):
+        return None, None
+    codecs = {}
+    for kind, codec in re.findall(r'Stream #\d+:\d+.*?: (Video|Audio): (\w+)', result.stderr):
+        codecs.setdefault(kind, codec)
+    return codecs.get('Video'), codecs.get('Audio')
+
+def media_codecs(ffmpeg_path, files):
+    """Return (video codec, audio codec) of a set of stream files, probing when yt-dlp didn't say"""
+    video_codec = audio_codec = None
+    for filepath, info in files:
+        vcodec, acodec = info.get('vcodec'), info.get('acodec')
+        if vcodec is None or acodec is None:
+            probed_video, probed_audio = probe_codecs(ffmpeg_path, filepath)
+            vcodec = vcodec if vcodec is not None else (probed_video or 'none')
+            acodec = acodec if acodec is not None else (probed_audio or 'none')
+        if video_codec is None and vcodec != 'none':
+            video_codec = vcodec
+        if audio_codec is None and acodec != 'none':
+            audio_codec = acodec
+    return video_codec, audio_codec
+
+def output_base_name(filepath, info):
+    """Strip the '.f<format_id>.<ext>' suffix the fetch stage adds to stream files"""
+    suffix = f".f{info.get('format_id')}.{info.get('ext')}"
+    if filepath.endswith(suffix):
+        return filepath[:-len(suffix)]
+    return os.path.splitext(filepath)[0]
+
+def postprocess_media(fetched, log_queue=None, on_progress=None, cancel_event=None):
+    """Stage 2: merge/convert the fetched streams into the final files of the job's preset"""
+    from yt_dlp.utils import DownloadCancelled
+    prefix = job_log_prefix(fetched.job_id)
+    
+    def put(message):
+        if log_queue:
+            log_queue.put(f"{prefix}{message}")
+    
+    def emit(phase, status, filename=None):
+        if on_progress:
+            on_progress(ProgressEvent(fetched.job_id, phase, status, filename=filename))
+    
+    preset = get_preset(fetched.format_type)
+    try:
+        for video in fetched.videos.values():
+            if cancel_event is not None and cancel_event.is_set():
+                raise DownloadCancelled("Download cancelled by user")
+            
+            # Video stream first, then audio
+            files = sorted(video['files'], key=lambda item: item[1].get('vcodec') in (None, 'none'))
+            sources = [path for path, _ in files]
+            base = output_base_name(*files[0])
+            
+            if preset.audio_only:
+                source = sources[-1]
+                ext = preset.output_ext(source)
+                target = f"{base}.{ext}"
+                audio_codec = media_codecs(fetched.ffmpeg_path, files[-1:])[1]
+                if preset.keeps_audio(audio_codec, source):
+                    if source.lower().endswith('.' + ext):
+                        put(f"[CONVERT] Audio is already {ext.upper()}, no re-encode needed: {os.path.basename(target)}")
+                        os.replace(source, target)
+                        fetched.output_files.append(target)
+                        continue
+                    # Same audio, different container
+                    phase = PHASE_MERGE
+                    put(f"[REMUX] Stream copy ({audio_codec}) into \"{os.path.basename(target)}\"")
+                    args = ['-i', source, '-vn', '-c:a', 'copy']
+                else:
+                    phase = PHASE_CONVERT
+                    put(f"[CONVERT] Extracting audio to {ext.upper()} ({preset.bitrate}k): {os.path.basename(target)}")
+                    args = ['-i', source, '-vn', '-c:a', preset.encoder, '-b:a', f'{preset.bitrate}k']
+            else:
+                target = base + '.mp4'
+                video_codec, audio_codec = media_codecs(fetched.ffmpeg_path, files)
+                copy_video = fits_mp4(video_codec, MP4_VIDEO_CODECS)
+                copy_audio = fits_mp4(audio_codec, MP4_AUDIO_CODECS)
+                codec_names = ' + '.join(codec for codec in (video_codec, audio_codec) if codec)
+                
+                if len(sources) == 1 and sources[0].lower().endswith('.mp4') and copy_video and copy_audio:
+                    # Already a single MP4 file; only the stream suffix has to go
+                    put(f"[REMUX] Already MP4 ({codec_names}), no processing needed: {os.path.basename(target)}")
+                    os.replace(sources[0], target)
+                    fetched.output_files.append(target)
+                    continue
+                
+                args = []
+                for source in sources:
+                    args += ['-i', source]
+                if len(sources) > 1:
+                    args += ['-map', '0:v:0', '-map', '1:a:0']
+                args += ['-c:v', 'copy'] if copy_video else ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '20']
+                args += ['-c:a', 'copy'] if copy_audio else ['-c:a', 'aac', '-b:a', '192k']
+                
+                if copy_video and copy_audio:
+                    phase = PHASE_MERGE
+                    put(f"[REMUX] Stream copy ({codec_names}) into \"{os.path.basename(target)}\"")
+                else:
+                    # Only the streams MP4 can't hold are re-encoded; the others are still copied
+                    phase = PHASE_CONVERT
+                    reencoded = [f"{kind} {codec}" for kind, codec, copied in
+                                 (('video', video_codec, copy_video), ('audio', audio_codec, copy_audio)) if not copied]
+                    put(f"[TRANSCODE] Re-encoding {', '.join(reencoded)} for MP4: {os.path.basename(target)}")
+            
+            emit(phase, 'started', target)
+            # Write to a temp name so an interrupted run never leaves a truncated final file
+            temp_target = base + '.temp' + os.path.splitext(target)[1]
+            try:
+                run_ffmpeg(fetched.ffmpeg_path, args + [temp_target])
+                os.replace(temp_target, target)
+            finally:
+                if os.path.exists(temp_target):
+                    os.remove(temp_target)
+            emit(phase, 'finished', target)
+            fetched.output_files.append(target)
+            
+            for source in sources:
+                put(f"[CLEANUP] Deleting original file {os.path.basename(source)}")
+                try:
+                    os.remove(source)
+                except OSError:
+                    pass
+    except DownloadCancelled as e:
+        put(f"[CANCELLED] {str(e)}")
+        raise e
+    except Exception as e:
+        put(f"[ERROR] Post-processing failed: {str(e)}")
+        raise e
+    return fetched.output_files
+
+def complete_media(fetched, archive=None, log_queue=None):
+    """Record a finished download and report success"""
+    if archive and not fetched.skipped:
+        finished_videos = {video_id: video['info'] for video_id, video in fetched.videos.items()}
+        record_in_archive(archive, fetched.url_key, finished_videos, fetched.format_type, fetched.output_path)
+    
+    # Add final success message
+    if log_queue:
+        format_name = get_preset(fetched.format_type).label
+        log_queue.put(f"{job_log_prefix(fetched.job_id)}[SUCCESS] {format_name} download and processing completed successfully!")
+
+def download_highest_resolution(url, output_path='.', ffmpeg_path=None, log_queue=None, format_type=DEFAULT_PRESET,
+                                job_id=None, cancel_event=None, on_progress=None, archive=None,
+                                progress_interval=DEFAULT_PROGRESS_INTERVAL, info_cache=None, session_pool=None,
+                                segment_connections=1, connection_limiter=None, bandwidth=None):
+    """Download and post-process a URL in the calling thread (both pipeline stages back to back)"""
+    fetched = fetch_media(url, output_path, ffmpeg_path, log_queue, format_type, job_id, cancel_event,
+                          on_progress, archive, progress_interval, info_cache, session_pool,
+                          segment_connections, connection_limiter, bandwidth)
+    if not fetched.skipped:
+        postprocess_media(fetched, log_queue, on_progress, cancel_event)
+    complete_media(fetched, archive, log_queue)
+    return True
+
+def record_in_archive(archive, url_key, finished_videos, format_type, output_path):
+    """Add the downloaded video(s) to the archive, falling back to the URL's key"""
+    keys = {}
+    for info in finished_videos.values():
+        info_key = archive.key_for_info(info)
+        if info_key:
+            keys[info_key] = info.get('title')
+    if not keys and url_key:
+        keys[url_key] = None
+    for key, title in keys.items():
+        archive.add(key, format_type, output_path, title)
+
+_extractor_classes = None
+_extractor_lock = threading.Lock()
+
+def video_key_from_url(url):
+    """Work out the "<extractor> <id>" key for a URL from its pattern alone (no network), or None"""
+    global _extractor_classes
+    with _extractor_lock:
+        if _extractor_classes is None:
+            from yt_dlp.extractor import gen_extractor_classes
+            _extractor_classes = [ie for ie in gen_extractor_classes() if ie.ie_key() != 'Generic']
+    for ie in _extractor_classes:
+        try:
+            if ie.suitable(url):
+                video_id = ie.get_temp_id(url)
+                return make_video_key(ie.ie_key(), video_id) if video_id else None
+        except Exception:
+            continue
+    return None
+
+def preload_yt_dlp():
+    """Load yt-dlp and compile its URL patterns ahead of the first job, e.g. from a background thread.
+
+    Returns (seconds importing yt-dlp, seconds building the extractor list); later calls are cheap.
+    """
+    started = time.perf_counter()
+    import segmented  # noqa: F401 - yt-dlp itself plus the downloader built on it
+    imported = time.perf_counter()
+    # Matching a URL compiles every extractor's pattern once; do that now rather than on the first add
+    video_key_from_url('')
+    return imported - started, time.perf_counter() - imported
+
+def make_video_key(extractor_key, video_id):
+    return f"{extractor_key.lower()} {video_id}"
+
+def read_url_list(text):
+    """Split pasted or imported text into URLs, skipping blank lines and # comments"""
+    urls = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            urls.append(line)
+    return urls
+
+# Upper bound on segment connections open at once across every job in a queue
+DEFAULT_MAX_CONNECTIONS = 16
+
+class ConnectionLimiter:
+    """Global cap on the number of segment connections open across all downloads"""
+    def __init__(self, max_connections=None):
+        self.max_connections = max_connections
+        self.semaphore = threading.BoundedSemaphore(max_connections) if max_connections else None
+
+    def __enter__(self):
+        if self.semaphore:
+            self.semaphore.acquire()
+        return self
+
+    def __exit__(self, *args):
+        if self.semaphore:
+            self.semaphore.release()
+
+class DownloadJob:
+    """A single URL waiting in, or being processed by, a DownloadQueue"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    
+    def __init__(self, job_id, url, output_path, ffmpeg_path, format_type, on_done=None, preset_choice=None):
+        self.job_id = job_id
+        self.url = url
+        self.output_path = output_path
+        self.ffmpeg_path = ffmpeg_path
+        self.format_type = format_type
+        # presets.PresetChoice when the preset is picked once the formats are known; format_type is then
+        # the fallback until the choice is made
+        self.preset_choice = preset_choice
+        self.state = DownloadJob.QUEUED
+        self.error = None
+        self.attempts = 0
+        self.cancel_event = threading.Event()
+        # Optional callable run with the job after a successful download (e.g. to update a manifest)
+        self.on_done = on_done
+        # Row in the JobJournal, and the partial files recorded there so far
+        self.journal_id = None
+        self.partial_files = []
+        # One of the retry.ERROR_* classes once the job has failed
+        self.error_class = None
+        # Folder the job downloads and post-processes in before its files are moved to output_path
+        self.staging_path = None
+        # Failed attempts since the job was last queued by hand
+        self.failures = 0
+        # Once done: the files written to output_path, and video id -> info of what was downloaded
+        self.output_files = []
+        self.videos = {}
+    
+    def is_finished(self):
+        return self.state in (DownloadJob.DONE, DownloadJob.FAILED, DownloadJob.CANCELLED)
+
+class DownloadQueue:
+    """Drain download jobs with a bounded pool of worker threads.
+    
+    Jobs run as a two-stage pipeline: network workers fetch the raw streams and hand
+    them to a separate post-processing pool (one worker per CPU core by default) that
+    runs FFmpeg, so downloads and transcodes of different jobs overlap.
+    """
+    def __init__(self, log_queue=None, max_workers=3, on_job_update=None, on_progress=None, archive=None,
+                 progress_interval=DEFAULT_PROGRESS_INTERVAL, metrics=None, postprocess_workers=None,
+                 info_cache=None, session_pool=None, segment_connections=1,
+                 max_connections=DEFAULT_MAX_CONNECTIONS, journal=None, bandwidth=None, retry_controller=None,
+                 storage=None):
+        self.log_queue = log_queue
+        self.max_workers = max(1, int(max_workers))
+        # Called from worker threads with the job whenever its state changes
+        self.on_job_update = on_job_update
+        self.on_progress = on_progress
+        # Optional DownloadArchive used to skip and record finished videos
+        self.archive = archive
+        self.progress_interval = progress_interval
+        # Optional MetricsAggregator fed with job lifecycle and progress events
+        self.metrics = metrics
+        # Optional ExtractionCache so retries and format switches skip info extraction
+        self.info_cache = info_cache
+        # YoutubeDL instances are reused across jobs with the same format and FFmpeg location
+        self.session_pool = session_pool if session_pool is not None else SessionPool(max(4, self.max_workers))
+        # Connections per file in segmented mode (1 = off), capped across all jobs
+        self.segment_connections = segment_connections
+        self.connection_limiter = ConnectionLimiter(max_connections)
+        # Optional JobJournal so unfinished jobs survive a crash and can be resumed
+        self.journal = journal
+        # Optional BandwidthScheduler shared by all downloads of this queue
+        self.bandwidth = bandwidth
+        # Classifies failures and decides on backoff, host cooldowns or failing fast
+        self.retry_controller = retry_controller if retry_controller is not None else RetryController()
+        # Stages every job in its own folder and reserves disk space for it
+        self.storage = storage if storage is not None else OutputManager()
+        self.jobs = {}
+        self._pending = queue.Queue()
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._workers = []
+        self.postprocess_workers = max(1, int(postprocess_workers or os.cpu_count() or 2))
+        self._postprocess_pool = ThreadPoolExecutor(max_workers=self.postprocess_workers,
+                                                    thread_name_prefix='postprocess')
+        # Jobs handed to the post-processing pool that have not finished yet
+        self._postprocessing = 0
+        self._postprocess_done = threading.Condition(self._lock)
+        # Timers of jobs waiting out a retry backoff or host cooldown, by job id
+        self._delayed = {}
+    
+    def add(self, url, output_path='.', ffmpeg_path=None, format_type=DEFAULT_PRESET, on_done=None,
+            preset_choice=None):
+        """Queue a URL for download and return its job.
+        
+        With a presets.PresetChoice the job picks its preset after extraction, with
+        format_type as the fallback.
+        """
+        job = self._new_job(url, output_path, ffmpeg_path, format_type, on_done, preset_choice)
+        job.journal_id = self._journal('add', url, format_type, output_path, ffmpeg_path)
+        self._set_staging_path(job)
+        self._notify(job)
+        self._pending.put(job)
+        self._ensure_workers()
+        return job
+    
+    def resume_journal(self):
+        """Re-queue the jobs left unfinished in the journal by an earlier run and return them.
+        
+        Partial downloads continue from their byte offset, and jobs whose streams were
+        already downloaded go straight to post-processing.
+        """
+        if self.journal is None:
+            return []
+        from segmented import partial_bytes
+        jobs = []
+        for entry in self.journal.pending():
+            job = self._new_job(entry['url'], entry['output_path'], entry['ffmpeg_path'], entry['format'])
+            job.journal_id = entry['journal_id']
+            job.partial_files = entry['partial_files']
+            # Where the earlier run staged it, which may be a scratch folder that is no longer configured
+            job.staging_path = entry['staging_path'] or self._staging_path(job)
+            jobs.append(job)
+            prefix = job_log_prefix(job.job_id)
+            
+            if entry['fetched']:
+                fetched = FetchedMedia.from_dict(entry['fetched'], job.url, job.output_path, job.ffmpeg_path,
+                                                 job.format_type, job.job_id)
+                if fetched.prune_finished():
+                    self._log(f"{prefix}[RESUME] Streams already downloaded, post-processing {job.url}")
+                    with self._lock:
+                        job.state = DownloadJob.RUNNING
+                        job.attempts += 1
+                    if self.metrics:
+                        self.metrics.job_started(job.job_id, job.url)
+                    self._notify(job)
+                    self._submit_postprocess(job, fetched)
+                    continue
+                self._journal('mark_queued', job.journal_id)
+            
+            resumed_bytes = sum(partial_bytes(path) for path in job.partial_files)
+            if resumed_bytes:
+                self._log(f"{prefix}[RESUME] Continuing {job.url} from {resumed_bytes / 1024 / 1024:.1f} MB")
+            else:
+                self._log(f"{prefix}[RESUME] Re-queued {job.url}")
+            self._notify(job)
+            self._pending.put(job)
+        self._ensure_workers()
+        return jobs
+    
+    def discard_journal(self):
+        """Forget the unfinished jobs of an earlier run and delete their partial files"""
+        if self.journal is None:
+            return 0
+        from segmented import SEGMENT_STATE_SUFFIX
+        entries = self.journal.pending()
+        for entry in entries:
+            for path in entry['partial_files']:
+                for leftover in (path, path + SEGMENT_STATE_SUFFIX):
+                    try:
+                        os.remove(leftover)
+                    except OSError:
+                        pass
+            staging_path = entry['staging_path'] or self.storage.staging_path(
+                entry['output_path'], self._staging_key(entry['journal_id']))
+            self.storage.discard(staging_path)
+            self.journal.remove(entry['journal_id'])
+        return len(entries)
+    
+    def cancel(self, job_id):
+        """Cancel a queued job, or abort a running one at its next progress tick"""
+        job = self.jobs.get(job_id)
+        if job is None or job.is_finished():
+            return False
+        job.cancel_event.set()
+        with self._lock:
+            if job.state == DownloadJob.QUEUED:
+                job.state = DownloadJob.CANCELLED
+                cancelled_now = True
+            else:
+                cancelled_now = False
+            # Don't keep wait() blocked on the backoff of a job that will never run
+            timer = self._delayed.pop(job_id, None)
+            if timer is not None:
+                timer.cancel()
+                self._postprocess_done.notify_all()
+        if cancelled_now:
+            self._journal('remove', job.journal_id)
+            # Partial files of an earlier attempt that was waiting to be retried
+            self.storage.discard(job.staging_path)
+            self._notify(job)
+        return True
+    
+    def retry(self, job_id):
+        """Put a failed or cancelled job back on the queue"""
+        job = self.jobs.get(job_id)
+        if job is None or job.state not in (DownloadJob.FAILED, DownloadJob.CANCELLED):
+            return False
+        with self._lock:
+            job.state = DownloadJob.QUEUED
+            job.error = None
+            job.error_class = None
+            job.failures = 0
+            job.cancel_event = threading.Event()
+        job.journal_id = self._journal('add', job.url, job.format_type, job.output_path, job.ffmpeg_path)
+        self._set_staging_path(job)
+        self._notify(job)
+        self._pending.put(job)
+        self._ensure_workers()
+        return True
+    
+    def set_max_workers(self, max_workers):
+        """Resize the pool; surplus workers exit once their current job is done"""
+        with self._lock:
+            self.max_workers = max(1, int(max_workers))
+        self._ensure_workers()
+    
+    def counts(self):
+        """Return the number of jobs in each state"""
+        counts = dict.fromkeys((DownloadJob.QUEUED, DownloadJob.RUNNING, DownloadJob.DONE,
+                                DownloadJob.FAILED, DownloadJob.CANCELLED), 0)
+        for job in list(self.jobs.values()):
+            counts[job.state] += 1
+        return counts
+    
+    def measured_throughput(self):
+        """Current aggregate download speed in bytes per second (the average if idle), or None"""
+        if self.metrics is None:
+            return None
+        stats = self.metrics.snapshot()['global']
+        speed = stats['current_mb_per_s'] or stats['average_mb_per_s']
+        return speed * 1024 * 1024 if speed else None
+    
+    def wait(self):
+        """Block until every job added so far has finished, including post-processing"""
+        while True:
+            self._pending.join()
+            with self._postprocess_done:
+                while self._postprocessing or self._delayed:
+                    self._postprocess_done.wait()
+                # A retry may have queued more work while we were waiting
+                if not self._pending.unfinished_tasks:
+                    return
+    
+    def _ensure_workers(self):
+        with self._lock:
+            self._workers = [w for w in self._workers if w.is_alive()]
+            while len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._worker, daemon=True)
+                self._workers.append(worker)
+                worker.start()
+    
+    def _worker(self):
+        while True:
+            with self._lock:
+                if len(self._workers) > self.max_workers:
+                    self._workers.remove(threading.current_thread())
+                    return
+            try:
+                job = self._pending.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self._run_job(job)
+            finally:
+                self._pending.task_done()
+    
+    def _run_job(self, job):
+        # A host that answered with throttling gets no new requests until its cooldown ends
+        cooldown = self.retry_controller.cooldown_remaining(job.url)
+        with self._lock:
+            # Skip jobs cancelled while they were still waiting
+            if job.state != DownloadJob.QUEUED:
+                return
+            if cooldown <= 0:
+                job.state = DownloadJob.RUNNING
+                job.attempts += 1
+        if cooldown > 0:
+            self._log(f"{job_log_prefix(job.job_id)}[RETRY] {host_of(job.url)} is cooling down, "
+                      f"starting in {cooldown:.0f}s")
+            self._schedule(job, cooldown)
+            return
+        if self.metrics:
+            self.metrics.job_started(job.job_id, job.url)
+        self._journal('mark_downloading', job.journal_id)
+        self._notify(job)
+        
+        try:
+            fetched = fetch_media(job.url, job.output_path, job.ffmpeg_path, self.log_queue, job.format_type,
+                                  job_id=job.job_id, cancel_event=job.cancel_event,
+                                  on_progress=self._on_progress, archive=self.archive,
+                                  progress_interval=self.progress_interval, info_cache=self.info_cache,
+                                  session_pool=self.session_pool, segment_connections=self.segment_connections,
+                                  connection_limiter=self.connection_limiter, bandwidth=self.bandwidth,
+                                  storage=self.storage, staging_path=job.staging_path,
+                                  throughput=self.measured_throughput(), preset_choice=job.preset_choice,
+                                  on_preset=lambda format_type: self._preset_chosen(job, format_type))
+        except Exception as e:
+            self._fail_or_retry(job, e)
+            return
+        finally:
+            if self.bandwidth is not None:
+                self.bandwidth.release(job.job_id)
+        
+        if fetched.skipped:
+            self._complete_job(job, fetched)
+            return
+        
+        # From here on a restart only has to redo post-processing
+        self._journal('set_fetched', job.journal_id, fetched.to_dict())
+        # Hand the raw streams to the post-processing pool and free this worker for the next download
+        self._submit_postprocess(job, fetched)
+    
+    def _preset_chosen(self, job, format_type):
+        """Record the preset a job picked, so a retry or resume downloads the same streams"""
+        job.format_type = format_type
+        job.preset_choice = None
+        self._journal('set_format', job.journal_id, format_type)
+        self._notify(job)
+    
+    def _submit_postprocess(self, job, fetched):
+        self._on_progress(ProgressEvent(job.job_id, PHASE_POSTPROCESS_QUEUE, 'started'))
+        with self._lock:
+            self._postprocessing += 1
+        self._postprocess_pool.submit(self._postprocess_job, job, fetched)
+    
+    def _postprocess_job(self, job, fetched):
+        try:
+            postprocess_media(fetched, self.log_queue, self._on_progress, job.cancel_event)
+            finalize_media(fetched, self.storage, self.log_queue)
+        except Exception as e:
+            # Downloading again won't fix an FFmpeg failure, so these are never retried
+            self._finish_job(job, e, ERROR_CANCELLED if job.cancel_event.is_set() else ERROR_POSTPROCESS)
+        else:
+            self._complete_job(job, fetched)
+        finally:
+            with self._postprocess_done:
+                self._postprocessing -= 1
+                self._postprocess_done.notify_all()
+    
+    def _complete_job(self, job, fetched):
+        job.output_files = list(fetched.output_files)
+        job.videos = {video_id: video['info'] for video_id, video in fetched.videos.items()}
+        try:
+            complete_media(fetched, self.archive, self.log_queue)
+            if job.on_done:
+                job.on_done(job)
+        except Exception as e:
+            self._finish_job(job, e)
+        else:
+            self._finish_job(job)
+    
+    def _fail_or_retry(self, job, error):
+        """Requeue a failed download after the backoff its error class calls for, or fail it"""
+        if job.cancel_event.is_set():
+            self._finish_job(job, error, ERROR_CANCELLED)
+            return
+        job.failures += 1
+        error_class, delay = self.retry_controller.plan(job.url, error, job.failures)
+        if delay is None:
+            self._finish_job(job, error, error_class)
+            return
+        
+        with self._lock:
+            job.state = DownloadJob.QUEUED
+            job.error = f"{error_class} error, retrying in {delay:.0f}s: {error}"
+            job.error_class = error_class
+        if self.metrics:
+            self.metrics.job_finished(job.job_id, job.state)
+        self._journal('mark_queued', job.journal_id)
+        # Keep the partial files for the next attempt but let other jobs use the space meanwhile
+        self.storage.release(job.staging_path)
+        policy = self.retry_controller.policies[error_class]
+        self._log(f"{job_log_prefix(job.job_id)}[RETRY] {error_class.capitalize()} error on attempt "
+                  f"{job.failures}/{policy.max_attempts}, retrying in {delay:.0f}s"
+                  + (f" (pausing all jobs for {host_of(job.url)})" if policy.host_cooldown else ""))
+        self._notify(job)
+        self._schedule(job, delay)
+    
+    def _schedule(self, job, delay):
+        """Put a job back on the queue after delay seconds without holding a worker"""
+        def requeue():
+            # Queue first, then stop counting it as delayed, so wait() never sees neither
+            self._pending.put(job)
+            with self._postprocess_done:
+                self._delayed.pop(job.job_id, None)
+                self._postprocess_done.notify_all()
+            self._ensure_workers()
+        
+        timer = threading.Timer(delay, requeue)
+        timer.daemon = True
+        with self._lock:
+            self._delayed[job.job_id] = timer
+        timer.start()
+    
+    def _finish_job(self, job, error=None, error_class=None):
+        if error is None:
+            job.state = DownloadJob.DONE
+            job.error = None
+            job.error_class = None
+        else:
+            job.error = str(error)
+            job.state = DownloadJob.CANCELLED if job.cancel_event.is_set() else DownloadJob.FAILED
+            job.error_class = error_class or classify_error(error)
+        if self.metrics:
+            self.metrics.job_finished(job.job_id, job.state)
+        # Failed jobs are not resumed automatically; Retry journals them again
+        self._journal('remove', job.journal_id)
+        # Finished files were moved out already; anything left is a leftover or partial file
+        self.storage.discard(job.staging_path)
+        self._notify(job)
+    
+    def _new_job(self, url, output_path, ffmpeg_path, format_type, on_done=None, preset_choice=None):
+        with self._lock:
+            job = DownloadJob(self._next_id, url, output_path, ffmpeg_path, format_type, on_done, preset_choice)
+            self._next_id += 1
+            self.jobs[job.job_id] = job
+        return job
+    
+    def _staging_key(self, journal_id):
+        # Journaled jobs keep their folder across restarts, so partial downloads can be resumed
+        journal_name = os.path.splitext(os.path.basename(self.journal.path))[0]
+        return f"{journal_name}-{journal_id}"
+    
+    def _staging_path(self, job):
+        key = self._staging_key(job.journal_id) if job.journal_id is not None else f"{os.getpid()}-{job.job_id}"
+        return self.storage.staging_path(job.output_path, key)
+    
+    def _set_staging_path(self, job):
+        job.staging_path = self._staging_path(job)
+        self._journal('set_staging_path', job.journal_id, job.staging_path)
+    
+    def _journal(self, method, *args):
+        """Call a JobJournal method, never letting a journal problem fail the download itself"""
+        if self.journal is None or (method != 'add' and args[0] is None):
+            return None
+        try:
+            return getattr(self.journal, method)(*args)
+        except Exception as e:
+            self._log(f"[JOURNAL] Could not update the job journal: {e}")
+            return None
+    
+    def _log(self, message):
+        if self.log_queue is not None:
+            self.log_queue.put(message)
+    
+    def _on_progress(self, event):
+        if self.journal is not None and event.phase == PHASE_DOWNLOAD and event.filename:
+            job = self.jobs.get(event.job_id)
+            # yt-dlp downloads to '<name>.part' and renames it when the file is complete
+            partial_file = event.filename + '.part'
+            if job is not None and partial_file not in job.partial_files:
+                job.partial_files.append(partial_file)
+                self._journal('add_partial_file', job.journal_id, partial_file)
+        if self.metrics:
+            self.metrics.handle(event)
+        if self.on_progress:
+            self.on_progress(event)
+    
+    def _notify(self, job):
+        if self.on_job_update:
+            try:
+                self.on_job_update(job)
+            except Exception as e:
+                # Never on stdout, which is the CLI's JSON event stream
+                if self.log_queue is not None:
+                    self._log(f"[ERROR] Job update callback failed: {e}")
+                else:
+                    print(f"Job update callback error: {e}", file=sys.stderr)
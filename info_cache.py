@@ -0,0 +1,82 @@
+"""In-memory cache of yt-dlp extraction results so retries and format switches skip re-extraction.
+
+Entries are keyed by canonical video ID ("<extractor> <id>", the same key the download
+archive uses) and hold the unprocessed info dict including the full format list.
+They expire after a TTL because the stream URLs inside them stop working after a while,
+and the least recently used entries are dropped once the cache is full.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+from engine import video_key_from_url, make_video_key
+
+DEFAULT_CACHE_ENTRIES = 256
+# Signed stream URLs usually stay valid for several hours; stay well inside that
+DEFAULT_CACHE_TTL = 30 * 60
+
+class ExtractionCache:
+    """Thread-safe LRU of extraction results with a time-to-live"""
+    def __init__(self, max_entries=DEFAULT_CACHE_ENTRIES, ttl=DEFAULT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for_url(url):
+        # Fall back to the URL itself for sites whose IDs can't be read from the URL
+        return video_key_from_url(url) or url
+
+    @staticmethod
+    def key_for_info(info):
+        extractor_key = info.get('extractor_key') or info.get('ie_key')
+        if not extractor_key or not info.get('id'):
+            return None
+        return make_video_key(extractor_key, info['id'])
+
+    def get(self, url):
+        """Return a private copy of the cached info for a URL, or None"""
+        key = self.key_for_url(url)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            info = entry[1]
+        # Processing a result mutates it, so every caller gets its own copy
+        return copy.deepcopy(info)
+
+    def put(self, url, info):
+        """Store an extraction result under the URL's key and the video's own key"""
+        keys = {self.key_for_url(url), self.key_for_info(info)}
+        keys.discard(None)
+        info = copy.deepcopy(info)
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            for key in keys:
+                self.entries[key] = (expires_at, info)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, url, info=None):
+        keys = {self.key_for_url(url), self.key_for_info(info) if info else None}
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,130 @@
+"""Crash-safe journal of unfinished download jobs.
+
+Every job is written to a SQLite database when it is queued and updated as it moves
+through the pipeline: its staging folder, which partial files it has on disk and, once the streams are
+downloaded, everything post-processing needs. Finished jobs are removed, so whatever
+is left after a crash or power cut is exactly the work that still has to be done.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from engine import get_app_data_dir
+
+# Journal phases; a job in PHASE_POSTPROCESS only needs its FFmpeg step rerun
+PHASE_QUEUED = 'queued'
+PHASE_DOWNLOAD = 'download'
+PHASE_POSTPROCESS = 'postprocess'
+
+class JobJournal:
+    """SQLite-backed record of the jobs that have not finished yet"""
+    def __init__(self, path=None, name='journal.sqlite3'):
+        self.path = path or os.path.join(get_app_data_dir(), name)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.conn:
+            # WAL keeps frequent small updates cheap and survives crashes mid-write
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " journal_id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " url TEXT NOT NULL,"
+                " format TEXT NOT NULL,"
+                " output_path TEXT NOT NULL,"
+                " ffmpeg_path TEXT,"
+                " phase TEXT NOT NULL,"
+                " partial_files TEXT NOT NULL DEFAULT '[]',"
+                " fetched TEXT,"
+                " staging_path TEXT,"
+                " created_at REAL,"
+                " updated_at REAL)")
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")]
+            if 'staging_path' not in columns:
+                # Journal written before jobs had staging folders
+                self.conn.execute("ALTER TABLE jobs ADD COLUMN staging_path TEXT")
+
+    def add(self, url, format_type, output_path, ffmpeg_path=None):
+        """Record a newly queued job and return its journal id"""
+        now = time.time()
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO jobs (url, format, output_path, ffmpeg_path, phase, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, format_type, output_path, ffmpeg_path, PHASE_QUEUED, now, now))
+            return cursor.lastrowid
+
+    def set_phase(self, journal_id, phase):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE jobs SET phase = ?, updated_at = ? WHERE journal_id = ?",
+                              (phase, time.time(), journal_id))
+
+    def mark_downloading(self, journal_id):
+        self.set_phase(journal_id, PHASE_DOWNLOAD)
+
+    def mark_queued(self, journal_id):
+        """Send a job back to the download stage, e.g. when its fetched files went missing"""
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE jobs SET phase = ?, fetched = NULL, updated_at = ? WHERE journal_id = ?",
+                              (PHASE_QUEUED, time.time(), journal_id))
+
+    def set_staging_path(self, journal_id, path):
+        """Record where a job stages its files, so a restart finds them even if the scratch folder changed"""
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE jobs SET staging_path = ?, updated_at = ? WHERE journal_id = ?",
+                              (path, time.time(), journal_id))
+
+    def add_partial_file(self, journal_id, path):
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT partial_files FROM jobs WHERE journal_id = ?",
+                                    (journal_id,)).fetchone()
+            if row is None:
+                return
+            partial_files = json.loads(row[0])
+            if path not in partial_files:
+                partial_files.append(path)
+                self.conn.execute("UPDATE jobs SET partial_files = ?, updated_at = ? WHERE journal_id = ?",
+                                  (json.dumps(partial_files), time.time(), journal_id))
+
+    def set_fetched(self, journal_id, fetched_data):
+        """Record that the streams are downloaded and only post-processing is left"""
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE jobs SET phase = ?, fetched = ?, updated_at = ? WHERE journal_id = ?",
+                              (PHASE_POSTPROCESS, json.dumps(fetched_data), time.time(), journal_id))
+
+    def set_format(self, journal_id, format_type):
+        """Replace a job's preset, e.g. once it has picked the cheapest of several"""
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE jobs SET format = ?, updated_at = ? WHERE journal_id = ?",
+                              (format_type, time.time(), journal_id))
+
+    def remove(self, journal_id):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM jobs WHERE journal_id = ?", (journal_id,))
+
+    def pending(self):
+        """Return the unfinished jobs as dicts, oldest first"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT journal_id, url, format, output_path, ffmpeg_path, phase, partial_files, fetched, "
+                "staging_path FROM jobs ORDER BY journal_id").fetchall()
+        return [{
+            'journal_id': journal_id,
+            'url': url,
+            'format': format_type,
+            'output_path': output_path,
+            'ffmpeg_path': ffmpeg_path,
+            'phase': phase,
+            'partial_files': json.loads(partial_files or '[]'),
+            'fetched': json.loads(fetched) if fetched else None,
+            'staging_path': staging_path,
+        } for journal_id, url, format_type, output_path, ffmpeg_path, phase, partial_files, fetched, staging_path
+            in rows]
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
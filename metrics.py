@@ -0,0 +1,294 @@
+"""Typed progress events and the aggregator that turns them into throughput statistics.
+
+The engine emits ProgressEvent objects for every job phase change and (throttled)
+download tick. A MetricsAggregator keeps per-job and global numbers which the GUI
+shows, the CLI prints as JSON and serve_metrics exposes in Prometheus text format.
+"""
+import json
+import math
+import threading
+import time
+
+# Job phases, in the order a job normally goes through them
+PHASE_EXTRACT = 'extract'
+PHASE_DOWNLOAD = 'download'
+# Streams are downloaded and waiting for a free post-processing worker
+PHASE_POSTPROCESS_QUEUE = 'postprocess_queue'
+PHASE_MERGE = 'merge'
+PHASE_CONVERT = 'convert'
+PHASES = (PHASE_EXTRACT, PHASE_DOWNLOAD, PHASE_POSTPROCESS_QUEUE, PHASE_MERGE, PHASE_CONVERT)
+POSTPROCESS_PHASES = (PHASE_MERGE, PHASE_CONVERT)
+
+def phase_for_postprocessor(name):
+    """Map a yt-dlp postprocessor name to a job phase, or None for bookkeeping steps"""
+    if not name or name == 'MoveFiles':
+        return None
+    if 'Merger' in name:
+        return PHASE_MERGE
+    return PHASE_CONVERT
+
+class ProgressEvent:
+    """One observation about a job: a phase change, a download tick or a log message"""
+    def __init__(self, job_id, phase, status, filename=None, downloaded_bytes=None, total_bytes=None,
+                 speed=None, eta=None, message=None, level=None):
+        self.job_id = job_id
+        self.phase = phase
+        # 'started', 'downloading', 'finished', 'error' or 'message'
+        self.status = status
+        self.filename = filename
+        self.downloaded_bytes = downloaded_bytes
+        self.total_bytes = total_bytes
+        self.speed = speed
+        self.eta = eta
+        self.message = message
+        self.level = level
+        self.timestamp = time.time()
+
+    def to_dict(self):
+        data = {
+            'job_id': self.job_id,
+            'phase': self.phase,
+            'status': self.status,
+            'filename': self.filename,
+            'downloaded_bytes': self.downloaded_bytes,
+            'total_bytes': self.total_bytes,
+            'speed': self.speed,
+            'eta': self.eta,
+        }
+        if self.message is not None:
+            data['message'] = self.message
+            data['level'] = self.level
+        return data
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None for an empty list)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+class JobStats:
+    def __init__(self, job_id, url=None):
+        self.job_id = job_id
+        self.url = url
+        self.state = 'queued'
+        self.started_at = None
+        self.finished_at = None
+        self.phase = None
+        self.phase_started_at = None
+        self.phase_seconds = dict.fromkeys(PHASES, 0.0)
+        self.file_bytes = {}
+        self.speed = 0.0
+        self.warnings = 0
+        self.errors = 0
+
+    def enter_phase(self, phase, now):
+        if phase == self.phase:
+            return
+        self.close_phase(now)
+        self.phase = phase
+        self.phase_started_at = now
+
+    def close_phase(self, now):
+        if self.phase is not None and self.phase_started_at is not None:
+            self.phase_seconds[self.phase] += now - self.phase_started_at
+        self.phase = None
+        self.phase_started_at = None
+
+    def bytes_downloaded(self):
+        return sum(self.file_bytes.values())
+
+    def duration(self, now=None):
+        if self.started_at is None:
+            return None
+        return (self.finished_at or now or time.time()) - self.started_at
+
+    def to_dict(self, now):
+        phase_seconds = dict(self.phase_seconds)
+        # Include the time spent so far in the current phase
+        if self.phase is not None and self.phase_started_at is not None:
+            phase_seconds[self.phase] += now - self.phase_started_at
+        return {
+            'job_id': self.job_id,
+            'url': self.url,
+            'state': self.state,
+            'phase': self.phase,
+            'duration': self.duration(now),
+            'bytes': self.bytes_downloaded(),
+            'speed': self.speed,
+            'phase_seconds': phase_seconds,
+            'warnings': self.warnings,
+            'errors': self.errors,
+        }
+
+class MetricsAggregator:
+    """Thread-safe collector of per-job and global download statistics"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.first_started_at = None
+
+    def _job(self, job_id, url=None):
+        stats = self.jobs.get(job_id)
+        if stats is None:
+            stats = self.jobs[job_id] = JobStats(job_id, url)
+        elif url:
+            stats.url = url
+        return stats
+
+    def job_started(self, job_id, url=None):
+        now = time.time()
+        with self.lock:
+            stats = self._job(job_id, url)
+            stats.state = 'running'
+            stats.started_at = now
+            stats.finished_at = None
+            stats.file_bytes = {}
+            stats.speed = 0.0
+            stats.enter_phase(PHASE_EXTRACT, now)
+            if self.first_started_at is None:
+                self.first_started_at = now
+
+    def job_finished(self, job_id, state):
+        now = time.time()
+        with self.lock:
+            stats = self._job(job_id)
+            stats.state = state
+            stats.finished_at = now
+            stats.speed = 0.0
+            stats.close_phase(now)
+
+    def handle(self, event):
+        """Fold a ProgressEvent into the statistics"""
+        with self.lock:
+            stats = self._job(event.job_id)
+            if event.status == 'message':
+                if event.level == 'warning':
+                    stats.warnings += 1
+                elif event.level == 'error':
+                    stats.errors += 1
+                return
+            if event.phase:
+                stats.enter_phase(event.phase, event.timestamp)
+            if event.phase == PHASE_DOWNLOAD and event.filename:
+                if event.status == 'finished':
+                    stats.file_bytes[event.filename] = event.total_bytes or event.downloaded_bytes or \
+                        stats.file_bytes.get(event.filename, 0)
+                    stats.speed = 0.0
+                elif event.downloaded_bytes is not None:
+                    stats.file_bytes[event.filename] = event.downloaded_bytes
+                    stats.speed = event.speed or 0.0
+
+    def snapshot(self):
+        """Return per-job and global statistics as plain JSON-serialisable data"""
+        now = time.time()
+        with self.lock:
+            jobs = [stats.to_dict(now) for stats in self.jobs.values()]
+
+        states = {}
+        phase_totals = dict.fromkeys(PHASES, 0.0)
+        total_bytes = 0
+        current_speed = 0.0
+        durations = []
+        for job in jobs:
+            states[job['state']] = states.get(job['state'], 0) + 1
+            total_bytes += job['bytes']
+            if job['state'] == 'running':
+                current_speed += job['speed'] or 0.0
+            for phase, seconds in job['phase_seconds'].items():
+                phase_totals[phase] += seconds
+            if job['state'] == 'done' and job['duration'] is not None:
+                durations.append(job['duration'])
+
+        elapsed = now - self.first_started_at if self.first_started_at else 0.0
+        postprocess_seconds = sum(phase_totals[phase] for phase in POSTPROCESS_PHASES)
+        busy_seconds = phase_totals[PHASE_DOWNLOAD] + postprocess_seconds
+        return {
+            'jobs': jobs,
+            'global': {
+                'jobs_by_state': states,
+                'bytes_downloaded': total_bytes,
+                'current_mb_per_s': current_speed / 1024 / 1024,
+                'average_mb_per_s': (total_bytes / elapsed / 1024 / 1024) if elapsed > 0 else 0.0,
+                'elapsed_seconds': elapsed,
+                'phase_seconds': phase_totals,
+                'download_share': (phase_totals[PHASE_DOWNLOAD] / busy_seconds) if busy_seconds else None,
+                'postprocess_share': (postprocess_seconds / busy_seconds) if busy_seconds else None,
+                'job_duration_p50': percentile(durations, 50),
+                'job_duration_p95': percentile(durations, 95),
+            },
+        }
+
+def format_summary(snapshot):
+    """One-line human readable summary of a snapshot for the GUI"""
+    stats = snapshot['global']
+    text = (f"Throughput: {stats['current_mb_per_s']:.2f} MB/s "
+            f"(avg {stats['average_mb_per_s']:.2f}) | "
+            f"Downloaded: {stats['bytes_downloaded'] / 1024 / 1024:.1f} MB")
+    if stats['download_share'] is not None:
+        text += (f" | Download/Post-processing: {stats['download_share'] * 100:.0f}%/"
+                 f"{stats['postprocess_share'] * 100:.0f}%")
+    if stats['job_duration_p50'] is not None:
+        text += f" | Job p50/p95: {stats['job_duration_p50']:.1f}s/{stats['job_duration_p95']:.1f}s"
+    return text
+
+def format_prometheus(snapshot):
+    """Render a snapshot in the Prometheus text exposition format"""
+    stats = snapshot['global']
+    lines = [
+        '# HELP ytdl_bytes_downloaded_total Bytes downloaded by all jobs.',
+        '# TYPE ytdl_bytes_downloaded_total counter',
+        f"ytdl_bytes_downloaded_total {stats['bytes_downloaded']}",
+        '# HELP ytdl_throughput_bytes_per_second Current aggregate download speed.',
+        '# TYPE ytdl_throughput_bytes_per_second gauge',
+        f"ytdl_throughput_bytes_per_second {stats['current_mb_per_s'] * 1024 * 1024:.0f}",
+        '# HELP ytdl_jobs Jobs by state.',
+        '# TYPE ytdl_jobs gauge',
+    ]
+    for state, count in sorted(stats['jobs_by_state'].items()):
+        lines.append(f'ytdl_jobs{{state="{state}"}} {count}')
+    lines += [
+        '# HELP ytdl_phase_seconds_total Wall-clock seconds jobs spent in each phase.',
+        '# TYPE ytdl_phase_seconds_total counter',
+    ]
+    for phase, seconds in stats['phase_seconds'].items():
+        lines.append(f'ytdl_phase_seconds_total{{phase="{phase}"}} {seconds:.3f}')
+    lines += [
+        '# HELP ytdl_job_duration_seconds Durations of finished jobs.',
+        '# TYPE ytdl_job_duration_seconds summary',
+    ]
+    for quantile, key in (('0.5', 'job_duration_p50'), ('0.95', 'job_duration_p95')):
+        if stats[key] is not None:
+            lines.append(f'ytdl_job_duration_seconds{{quantile="{quantile}"}} {stats[key]:.3f}')
+    return '\n'.join(lines) + '\n'
+
+def serve_metrics(aggregator, port, host='127.0.0.1'):
+    """Serve /metrics (Prometheus text) and /metrics.json from a background thread"""
+    # Only the CLI serves metrics, so the GUI doesn't pay for importing the HTTP server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            snapshot = aggregator.snapshot()
+            if self.path.startswith('/metrics.json'):
+                body = json.dumps(snapshot).encode('utf-8')
+                content_type = 'application/json'
+            elif self.path.startswith('/metrics'):
+                body = format_prometheus(snapshot).encode('utf-8')
+                content_type = 'text/plain; version=0.0.4'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Keep scrapes out of stderr
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,139 @@
+"""Playlist and channel support: expand a URL into its entries and queue each one as its own job.
+
+Finished entries are recorded in a manifest file next to the downloads so that
+re-running the same playlist skips everything that already completed.
+"""
+import os
+import re
+import threading
+import json
+from urllib.parse import urlparse, parse_qs
+from engine import write_json_atomic
+
+# Path patterns of YouTube pages that list many videos
+PLAYLIST_PATH_PATTERN = re.compile(r'^/(playlist|channel/|c/|user/|@)')
+
+def is_playlist_url(url):
+    """Check whether a URL points at a playlist or channel rather than a single video"""
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        return False
+    if 'list' in parse_qs(parsed.query):
+        return True
+    return bool(PLAYLIST_PATH_PATTERN.match(parsed.path))
+
+def expand_playlist(url, log_queue=None, max_depth=2):
+    """Do a flat extraction of a playlist/channel and return (info, entries).
+
+    Each entry is a dict with 'id', 'url' and 'title'. Channel pages list their
+    tabs (Videos, Shorts, ...) as nested playlists, which are expanded up to max_depth.
+    """
+    ydl_opts = {
+        'extract_flat': 'in_playlist',
+        'quiet': True,
+        'no_warnings': True,
+        'skip_download': True,
+    }
+    entries = []
+    seen_ids = set()
+
+    from yt_dlp import YoutubeDL
+    with YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+
+        def collect(playlist_info, depth):
+            for entry in playlist_info.get('entries') or []:
+                if not entry:
+                    continue
+                entry_url = entry.get('url') or entry.get('webpage_url')
+                is_nested = entry.get('_type') == 'playlist' or entry.get('ie_key') == 'YoutubeTab'
+                if is_nested:
+                    if depth >= max_depth or not entry_url:
+                        continue
+                    if log_queue:
+                        log_queue.put(f"[PLAYLIST] Expanding {entry.get('title') or entry_url}")
+                    collect(ydl.extract_info(entry_url, download=False), depth + 1)
+                    continue
+
+                video_id = entry.get('id')
+                if not entry_url or not video_id or video_id in seen_ids:
+                    continue
+                seen_ids.add(video_id)
+                entries.append({'id': video_id, 'url': entry_url, 'title': entry.get('title') or video_id})
+
+        if info.get('_type') == 'playlist' or 'entries' in info:
+            collect(info, 0)
+        else:
+            # A single video; nothing to expand
+            entries.append({'id': info.get('id'), 'url': info.get('webpage_url') or url,
+                            'title': info.get('title') or url})
+
+    return info, entries
+
+class PlaylistManifest:
+    """Per-playlist record of which entries finished, stored as JSON in the output folder"""
+    def __init__(self, path, playlist_id=None, url=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = {'playlist_id': playlist_id, 'url': url, 'completed': {}}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                loaded = json.load(f)
+            if isinstance(loaded.get('completed'), dict):
+                self.data['completed'] = loaded['completed']
+        except (OSError, ValueError, AttributeError):
+            pass  # Start a fresh manifest
+
+    @classmethod
+    def for_playlist(cls, output_path, playlist_id, url):
+        safe_id = re.sub(r'[^A-Za-z0-9_-]', '_', str(playlist_id or 'playlist'))
+        return cls(os.path.join(output_path, f'.playlist-{safe_id}.json'), playlist_id, url)
+
+    def is_done(self, video_id, format_type):
+        with self.lock:
+            return video_id in self.data['completed'].get(format_type, [])
+
+    def mark_done(self, video_id, format_type):
+        with self.lock:
+            completed = self.data['completed'].setdefault(format_type, [])
+            if video_id not in completed:
+                completed.append(video_id)
+            try:
+                write_json_atomic(self.path, self.data)
+            except OSError:
+                pass  # Losing the record only means the entry is downloaded again next time
+
+def queue_playlist(download_queue, url, output_path='.', ffmpeg_path=None, format_type='mp4', preset_choice=None):
+    """Expand a playlist URL and add one job per entry not already in its manifest.
+
+    With a presets.PresetChoice every job picks its own preset, and entries finished
+    in any of the candidate presets are skipped. Returns (jobs, skipped_count).
+    Extraction hits the network, so call this from a background thread in the GUI.
+    """
+    log_queue = download_queue.log_queue
+    if log_queue:
+        log_queue.put(f"[PLAYLIST] Fetching entries for {url}")
+
+    info, entries = expand_playlist(url, log_queue)
+    os.makedirs(output_path, exist_ok=True)
+    manifest = PlaylistManifest.for_playlist(output_path, info.get('id'), url)
+
+    def record_done(video_id):
+        return lambda job: manifest.mark_done(video_id, job.format_type)
+
+    jobs = []
+    skipped = 0
+    done_formats = preset_choice.candidates if preset_choice else [format_type]
+    for entry in entries:
+        if any(manifest.is_done(entry['id'], name) for name in done_formats):
+            skipped += 1
+            continue
+        jobs.append(download_queue.add(entry['url'], output_path, ffmpeg_path, format_type,
+                                       on_done=record_done(entry['id']), preset_choice=preset_choice))
+
+    if log_queue:
+        title = info.get('title') or url
+        log_queue.put(f"[PLAYLIST] {title}: {len(entries)} entries, {len(jobs)} queued, "
+                      f"{skipped} already downloaded")
+    return jobs, skipped
@@ -0,0 +1,308 @@
+"""Named quality/format presets, and what a job will cost with each before it starts.
+
+A preset decides which streams the fetch stage picks (resolution cap, codec and bitrate
+preferences) and what post-processing turns them into: a stream-copied MP4, audio kept
+in its own container, or a re-encode at a target bitrate. From a video's extracted
+formats, estimate_job predicts the bytes to download, the download time at a given
+throughput and the post-processing step with its rough cost, so bulk jobs can pick the
+cheapest preset that still meets a quality bar.
+
+The post-processing costs are rough figures for a typical desktop CPU; they only need
+to be good enough to rank the presets against each other.
+"""
+# Codec name prefixes (as reported by yt-dlp or FFmpeg) that MP4 can hold as-is
+MP4_VIDEO_CODECS = ('avc1', 'avc3', 'h264', 'hev1', 'hvc1', 'h265', 'hevc', 'av01', 'av1', 'vp09', 'vp9', 'mp4v')
+MP4_AUDIO_CODECS = ('mp4a', 'aac', 'mp3', 'opus', 'ac-3', 'ac3', 'ec-3', 'eac3', 'alac')
+
+# Names used in format_sort / presets and the codec name prefixes they match
+CODEC_ALIASES = {
+    'h264': ('avc1', 'avc3', 'h264'),
+    'vp9': ('vp09', 'vp9'),
+    'av1': ('av01', 'av1'),
+    'aac': ('mp4a', 'aac'),
+    'opus': ('opus',),
+    'mp3': ('mp3',),
+}
+
+# Post-processing steps, cheapest first
+STEP_RENAME = 'rename'
+STEP_REMUX = 'remux'
+STEP_AUDIO_TRANSCODE = 'audio_transcode'
+STEP_VIDEO_TRANSCODE = 'video_transcode'
+
+# Stream copies are limited by the disk
+REMUX_BYTES_PER_SECOND = 150 * 1024 * 1024
+# Seconds of audio encoded per second (LAME, FFmpeg's AAC and libopus are all far faster than realtime)
+AUDIO_TRANSCODE_SPEED = 60.0
+# Seconds of 1080p video libx264 -preset veryfast encodes per second; scales with the pixel count
+VIDEO_TRANSCODE_SPEED_1080P = 1.5
+# Download speed assumed for ranking presets before any throughput has been measured
+ASSUMED_THROUGHPUT = 5 * 1024 * 1024
+
+def codec_matches(codec, names):
+    """Check a codec (e.g. 'avc1.640028') against preset codec names (e.g. 'h264')"""
+    if not codec or codec == 'none':
+        return False
+    prefixes = tuple(prefix for name in names for prefix in CODEC_ALIASES.get(name, (name,)))
+    return codec.lower().startswith(prefixes)
+
+def fits_mp4(codec, compatible_codecs):
+    """Check whether a codec can be stream-copied into MP4 (missing streams always fit)"""
+    return codec is None or codec.lower().startswith(compatible_codecs)
+
+class Preset:
+    """One named choice of streams and output format"""
+    def __init__(self, name, label, audio_only=False, ext=None, max_height=None, video_codecs=(), audio_codecs=(),
+                 source_abr=None, keep_audio=None, encoder=None, bitrate=None):
+        self.name = name
+        self.label = label
+        self.audio_only = audio_only
+        # Output extension, or None to keep the downloaded audio's own container
+        self.ext = ext
+        self.max_height = max_height
+        # Preferred codecs among streams of the best allowed resolution / audio quality
+        self.video_codecs = video_codecs
+        self.audio_codecs = audio_codecs
+        # Prefer the best audio stream at or below this bitrate (kbps) over better ones
+        self.source_abr = source_abr
+        # Audio codecs kept without re-encoding (audio presets), None for any
+        self.keep_audio = keep_audio
+        # FFmpeg audio encoder and bitrate (kbps) for audio that can't be kept
+        self.encoder = encoder
+        self.bitrate = bitrate
+
+    def format_selector(self):
+        if self.audio_only:
+            return 'bestaudio/best'
+        # Video and audio as separate downloads (','), so merging is left to the post-processing pool
+        return f'(bestvideo[height<={self.max_height}],bestaudio)/best[height<={self.max_height}]'
+
+    def format_sort(self):
+        """yt-dlp format_sort fields that make it pick what estimate_job expects, or None"""
+        fields = []
+        if not self.audio_only:
+            fields.append(f'res:{self.max_height}')
+            fields += [f'vcodec:{codec}' for codec in self.video_codecs[:1]]
+        fields += [f'acodec:{codec}' for codec in self.audio_codecs[:1]]
+        if self.source_abr:
+            fields.append(f'abr:{self.source_abr}')
+        if not self.audio_only:
+            fields.append('ext:mp4:m4a')
+        return fields or None
+
+    def keeps_audio(self, codec, source_path=None):
+        """Whether an audio-only preset can keep a stream without re-encoding it"""
+        if self.keep_audio is None:
+            return True
+        if codec and codec != 'none':
+            return codec_matches(codec, self.keep_audio)
+        # Unknown codec; trust the extension
+        return bool(self.ext and source_path and source_path.lower().endswith('.' + self.ext))
+
+    def output_ext(self, source_path):
+        if self.ext:
+            return self.ext
+        return source_path.rsplit('.', 1)[-1].lower() if '.' in source_path else 'audio'
+
+PRESETS = {preset.name: preset for preset in (
+    Preset('mp4', 'MP4 1080p (H.264/AAC)', ext='mp4', max_height=1080, video_codecs=('h264',), audio_codecs=('aac',)),
+    Preset('mp4-2160', 'MP4 up to 4K', ext='mp4', max_height=2160, video_codecs=('h264',), audio_codecs=('aac',)),
+    Preset('mp4-720', 'MP4 720p (H.264/AAC)', ext='mp4', max_height=720, video_codecs=('h264',), audio_codecs=('aac',)),
+    Preset('mp4-480', 'MP4 480p (H.264/AAC)', ext='mp4', max_height=480, video_codecs=('h264',), audio_codecs=('aac',)),
+    Preset('mp3', 'MP3 320k', audio_only=True, ext='mp3', keep_audio=('mp3',), encoder='libmp3lame', bitrate=320),
+    Preset('mp3-128', 'MP3 128k (smaller)', audio_only=True, ext='mp3', source_abr=160, keep_audio=('mp3',),
+           encoder='libmp3lame', bitrate=128),
+    Preset('m4a', 'M4A (AAC, no re-encode)', audio_only=True, ext='m4a', audio_codecs=('aac',), keep_audio=('aac',),
+           encoder='aac', bitrate=192),
+    Preset('opus', 'Opus (no re-encode)', audio_only=True, ext='opus', audio_codecs=('opus',), keep_audio=('opus',),
+           encoder='libopus', bitrate=128),
+    Preset('audio', 'Best audio as-is', audio_only=True),
+)}
+
+DEFAULT_PRESET = 'mp4'
+
+def get_preset(name):
+    preset = PRESETS.get(name)
+    if preset is None:
+        raise ValueError(f"Unknown preset '{name}', expected one of: {', '.join(PRESETS)}")
+    return preset
+
+def stream_size(fmt, duration):
+    """Size of one format from its reported size, or its bitrate times the duration; None if unknown"""
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if not size and fmt.get('tbr') and duration:
+        size = fmt['tbr'] * 1000 / 8 * duration
+    return int(size) if size else None
+
+def codec_rank(codec, names):
+    """Higher for codecs earlier in names, 0 for codecs not in it"""
+    for index, name in enumerate(names):
+        if codec_matches(codec, (name,)):
+            return len(names) - index
+    return 0
+
+def choose_streams(info, preset):
+    """Approximate the streams yt-dlp picks for a preset from the extracted formats (empty if none fit)"""
+    formats = info.get('formats') or [info]
+    audio_formats = [f for f in formats if f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none')]
+
+    def audio_key(f):
+        abr = f.get('abr') or f.get('tbr') or 0
+        if preset.source_abr:
+            # Closest at or below the target first, then the smallest above it
+            within = abr <= preset.source_abr
+            return codec_rank(f.get('acodec'), preset.audio_codecs), within, abr if within else -abr
+        return codec_rank(f.get('acodec'), preset.audio_codecs), abr
+
+    best_audio = max(audio_formats, key=audio_key) if audio_formats else None
+    if preset.audio_only:
+        chosen = best_audio or max(formats, key=lambda f: (f.get('tbr') or 0), default=None)
+        return [chosen] if chosen else []
+
+    video_formats = [f for f in formats if f.get('vcodec') != 'none'
+                     and (f.get('height') or 0) <= preset.max_height]
+    if not video_formats:
+        return []
+    best_video = max(video_formats, key=lambda f: ((f.get('height') or 0), codec_rank(f.get('vcodec'),
+                                                                                      preset.video_codecs),
+                                                   (f.get('tbr') or 0)))
+    if best_video.get('acodec') == 'none' and best_audio is not None:
+        return [best_video, best_audio]
+    return [best_video]
+
+class JobEstimate:
+    """Predicted cost of downloading and post-processing one video with a preset"""
+    def __init__(self, preset, download_bytes, output_bytes, step, postprocess_seconds, throughput=None,
+                 height=None, vcodec=None, acodec=None, abr=None):
+        self.preset = preset
+        self.download_bytes = download_bytes
+        self.output_bytes = output_bytes
+        # One of the STEP_* constants
+        self.step = step
+        self.postprocess_seconds = postprocess_seconds
+        # Measured bytes per second the download time is based on, or None if nothing was measured yet
+        self.throughput = throughput
+        # What the output will hold, for quality bars
+        self.height = height
+        self.vcodec = vcodec
+        self.acodec = acodec
+        self.abr = abr
+
+    @property
+    def download_seconds(self):
+        return self.download_bytes / self.throughput if self.throughput else None
+
+    def cost(self):
+        """Seconds the job keeps the pipeline busy, assuming a typical speed if none was measured"""
+        return self.download_bytes / (self.throughput or ASSUMED_THROUGHPUT) + self.postprocess_seconds
+
+    def meets(self, min_height=None, min_abr=None):
+        if min_height and (self.preset.audio_only or (self.height or 0) < min_height):
+            return False
+        if min_abr and (self.abr or 0) < min_abr:
+            return False
+        return True
+
+    def describe(self):
+        text = f"{self.preset.label}: ~{self.download_bytes / 1024 / 1024:.1f} MB"
+        if self.download_seconds is not None:
+            text += f", ~{self.download_seconds:.0f}s at {self.throughput / 1024 / 1024:.1f} MB/s"
+        text += f", {self.step.replace('_', ' ')}"
+        if self.postprocess_seconds >= 1:
+            text += f" ~{self.postprocess_seconds:.0f}s"
+        return text
+
+    def to_dict(self):
+        return {
+            'preset': self.preset.name,
+            'download_bytes': self.download_bytes,
+            'output_bytes': self.output_bytes,
+            'download_seconds': self.download_seconds,
+            'postprocess': self.step,
+            'postprocess_seconds': self.postprocess_seconds,
+            'height': self.height,
+            'vcodec': self.vcodec,
+            'acodec': self.acodec,
+            'abr': self.abr,
+        }
+
+def estimate_job(info, preset, throughput=None):
+    """Estimate a video's cost with a preset from its extracted formats.
+
+    Returns None when the sizes aren't known, e.g. for a playlist or a format without
+    size or bitrate.
+    """
+    if info.get('_type', 'video') != 'video':
+        return None
+    duration = info.get('duration')
+    streams = choose_streams(info, preset)
+    if not streams:
+        return None
+    sizes = [stream_size(f, duration) for f in streams]
+    if None in sizes:
+        return None
+    download = sum(sizes)
+    video = next((f for f in streams if f.get('vcodec') not in (None, 'none')), None)
+    audio = streams[-1]
+    acodec = audio.get('acodec') if audio.get('acodec') not in (None, 'none') else None
+    abr = audio.get('abr') or (audio.get('tbr') if audio is not video else None)
+
+    if preset.audio_only:
+        source_ext = audio.get('ext') or ''
+        if preset.keeps_audio(acodec, f".{source_ext}"):
+            step = STEP_RENAME if preset.output_ext(f".{source_ext}") == source_ext else STEP_REMUX
+            output = download
+            seconds = download / REMUX_BYTES_PER_SECOND if step == STEP_REMUX else 0.0
+        else:
+            step = STEP_AUDIO_TRANSCODE
+            output = int(preset.bitrate * 1000 / 8 * duration) if duration else download
+            seconds = (duration or 0) / AUDIO_TRANSCODE_SPEED
+            abr = preset.bitrate
+        return JobEstimate(preset, download, output, step, seconds, throughput, acodec=acodec, abr=abr)
+
+    vcodec = video.get('vcodec') if video else None
+    copy_video = fits_mp4(vcodec, MP4_VIDEO_CODECS)
+    copy_audio = fits_mp4(acodec, MP4_AUDIO_CODECS)
+    if copy_video and copy_audio:
+        single_mp4 = len(streams) == 1 and streams[0].get('ext') == 'mp4'
+        step = STEP_RENAME if single_mp4 else STEP_REMUX
+        seconds = 0.0 if single_mp4 else download / REMUX_BYTES_PER_SECOND
+    elif not copy_video:
+        step = STEP_VIDEO_TRANSCODE
+        pixels = ((video.get('height') or 1080) / 1080) ** 2
+        seconds = (duration or 0) * pixels / VIDEO_TRANSCODE_SPEED_1080P
+    else:
+        step = STEP_AUDIO_TRANSCODE
+        seconds = download / REMUX_BYTES_PER_SECOND + (duration or 0) / AUDIO_TRANSCODE_SPEED
+    # Merging or remuxing writes roughly the same number of bytes again
+    return JobEstimate(preset, download, download, step, seconds, throughput,
+                       height=video.get('height') if video else None, vcodec=vcodec, acodec=acodec, abr=abr)
+
+def cheapest_preset(info, names, min_height=None, min_abr=None, throughput=None):
+    """Return (preset name, {name: JobEstimate}) for the cheapest preset that meets the quality bar.
+
+    The preset name is None if no preset has a known size that meets the bar.
+    """
+    estimates = {}
+    for name in names:
+        estimate = estimate_job(info, get_preset(name), throughput)
+        if estimate is not None:
+            estimates[name] = estimate
+    fitting = [name for name, estimate in estimates.items() if estimate.meets(min_height, min_abr)]
+    if not fitting:
+        return None, estimates
+    return min(fitting, key=lambda name: estimates[name].cost()), estimates
+
+class PresetChoice:
+    """Candidate presets for a job that takes the cheapest one meeting a quality bar once its formats are known"""
+    def __init__(self, candidates, min_height=None, min_abr=None, fallback=DEFAULT_PRESET):
+        self.candidates = [get_preset(name).name for name in candidates]
+        self.min_height = min_height
+        self.min_abr = min_abr
+        # Used when no candidate has a known size that meets the bar
+        self.fallback = get_preset(fallback).name
+
+    def choose(self, info, throughput=None):
+        """Return (preset name, {name: JobEstimate}); the fallback if no candidate qualifies"""
+        chosen, estimates = cheapest_preset(info, self.candidates, self.min_height, self.min_abr, throughput)
+        return chosen or self.fallback, estimates
@@ -0,0 +1,186 @@
+"""Error classification and retry policies for download jobs.
+
+A failed job is sorted into one of a few error classes, and each class has a policy:
+transient network errors are retried with exponential backoff and jitter, throttling
+(HTTP 429, bot checks) puts the whole host on a cooldown shared by every worker, an
+HTTP 403 (on YouTube nearly always an expired stream URL) is retried once with a fresh
+extraction, and errors that won't go away by retrying (private or removed videos, FFmpeg failures, a
+full disk) fail immediately.
+"""
+import errno
+import random
+import re
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+ERROR_TRANSIENT = 'transient'
+ERROR_THROTTLED = 'throttled'
+ERROR_EXPIRED = 'expired'
+ERROR_UNAVAILABLE = 'unavailable'
+ERROR_POSTPROCESS = 'postprocess'
+ERROR_DISK_FULL = 'disk_full'
+ERROR_CANCELLED = 'cancelled'
+ERROR_UNKNOWN = 'unknown'
+
+THROTTLED_PATTERN = re.compile(
+    r"HTTP Error 429|Too Many Requests|rate.?limit|Sign in to confirm you.re not a bot", re.IGNORECASE)
+UNAVAILABLE_PATTERN = re.compile(
+    r"Private video|Video unavailable|This video is (not available|unavailable|private)|"
+    r"has been removed|members.only|Join this channel|Sign in to confirm your age|"
+    r"copyright|account .* terminated|Unsupported URL|Requested format is not available|"
+    r"HTTP Error (401|404|410)", re.IGNORECASE)
+# Signed stream URLs that ran out; the job's next attempt extracts new ones
+EXPIRED_PATTERN = re.compile(r"HTTP Error 403", re.IGNORECASE)
+DISK_FULL_PATTERN = re.compile(r"No space left on device|There is not enough space on the disk", re.IGNORECASE)
+TRANSIENT_PATTERN = re.compile(
+    r"HTTP Error (408|5\d\d)|timed out|Connection (reset|refused|aborted)|"
+    r"Temporary failure|Remote end closed|IncompleteRead|Read timed out|EOF occurred", re.IGNORECASE)
+
+IP_ADDRESS_PATTERN = re.compile(r'^[\d.]+$|:')
+
+class RetryPolicy:
+    """How often and how long to wait before retrying one class of error"""
+    def __init__(self, max_attempts, base_delay=0.0, max_delay=0.0, host_cooldown=False):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Also stop every other job for the same host for the length of the delay
+        self.host_cooldown = host_cooldown
+
+    def delay(self, attempt):
+        """Exponential backoff with equal jitter for the given (1-based) failed attempt.
+
+        The delay is random between half the ceiling and the ceiling, so parallel jobs
+        spread out but never retry right away.
+        """
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(ceiling / 2, ceiling)
+
+DEFAULT_POLICIES = {
+    ERROR_TRANSIENT: RetryPolicy(max_attempts=4, base_delay=2, max_delay=60),
+    ERROR_THROTTLED: RetryPolicy(max_attempts=5, base_delay=30, max_delay=600, host_cooldown=True),
+    ERROR_EXPIRED: RetryPolicy(max_attempts=2, base_delay=2, max_delay=2),
+    ERROR_UNKNOWN: RetryPolicy(max_attempts=2, base_delay=5, max_delay=5),
+    ERROR_UNAVAILABLE: RetryPolicy(max_attempts=1),
+    ERROR_POSTPROCESS: RetryPolicy(max_attempts=1),
+    ERROR_DISK_FULL: RetryPolicy(max_attempts=1),
+    ERROR_CANCELLED: RetryPolicy(max_attempts=1),
+}
+
+def error_chain(error):
+    """Yield an exception and everything it wraps (yt-dlp keeps causes in exc_info/cause)"""
+    seen = set()
+    pending = [error]
+    while pending:
+        current = pending.pop(0)
+        if current is None or id(current) in seen:
+            continue
+        seen.add(id(current))
+        yield current
+        exc_info = getattr(current, 'exc_info', None)
+        if isinstance(exc_info, tuple) and len(exc_info) > 1:
+            pending.append(exc_info[1])
+        pending += [getattr(current, 'cause', None), current.__cause__, current.__context__]
+
+def classify_error(error):
+    """Sort an exception from fetching or post-processing into one of the ERROR_* classes"""
+    from yt_dlp.networking.exceptions import HTTPError, TransportError
+    from yt_dlp.utils import (ContentTooShortError, DownloadCancelled, ExtractorError, GeoRestrictedError,
+                              PostProcessingError, UnavailableVideoError, UnsupportedError)
+    chain = list(error_chain(error))
+    message = ' '.join(str(current) for current in chain)
+    # Checked before anything else: a full disk stays full however often the job is retried
+    if (any(isinstance(current, OSError) and current.errno == errno.ENOSPC for current in chain)
+            or DISK_FULL_PATTERN.search(message)):
+        return ERROR_DISK_FULL
+    for current in chain:
+        if isinstance(current, DownloadCancelled):
+            return ERROR_CANCELLED
+        if isinstance(current, PostProcessingError):
+            return ERROR_POSTPROCESS
+        if isinstance(current, HTTPError):
+            if current.status == 429:
+                return ERROR_THROTTLED
+            if current.status in (408,) or current.status >= 500:
+                return ERROR_TRANSIENT
+            if current.status == 403:
+                return ERROR_EXPIRED
+            if current.status in (401, 404, 410):
+                return ERROR_UNAVAILABLE
+        if isinstance(current, (GeoRestrictedError, UnsupportedError, UnavailableVideoError)):
+            return ERROR_UNAVAILABLE
+
+    if THROTTLED_PATTERN.search(message):
+        return ERROR_THROTTLED
+    if EXPIRED_PATTERN.search(message):
+        return ERROR_EXPIRED
+    if UNAVAILABLE_PATTERN.search(message):
+        return ERROR_UNAVAILABLE
+
+    for current in chain:
+        if isinstance(current, (TransportError, ContentTooShortError, socket.timeout, ConnectionError)):
+            return ERROR_TRANSIENT
+    if TRANSIENT_PATTERN.search(message):
+        return ERROR_TRANSIENT
+    # Errors the extractor flags as expected are about the video, not the network
+    if any(isinstance(current, ExtractorError) and current.expected for current in chain):
+        return ERROR_UNAVAILABLE
+    if any(isinstance(current, OSError) for current in chain):
+        return ERROR_TRANSIENT
+    return ERROR_UNKNOWN
+
+def host_of(url):
+    try:
+        host = (urlparse(url).hostname or '').lower()
+    except ValueError:
+        return ''
+    if IP_ADDRESS_PATTERN.match(host):
+        return host
+    # youtu.be, m.youtube.com and www.youtube.com all share one rate limit
+    parts = host.split('.')
+    if parts[-2:] == ['youtu', 'be']:
+        return 'youtube.com'
+    return '.'.join(parts[-2:]) if len(parts) > 2 else host
+
+class HostCooldowns:
+    """Per-host 'don't start anything before' times, shared by all workers"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.until = {}
+
+    def start(self, host, seconds):
+        with self.lock:
+            self.until[host] = max(self.until.get(host, 0), time.time() + seconds)
+
+    def remaining(self, host):
+        with self.lock:
+            until = self.until.get(host)
+            if until is None:
+                return 0.0
+            if until <= time.time():
+                del self.until[host]
+                return 0.0
+            return until - time.time()
+
+class RetryController:
+    """Decide whether and when a failed job runs again"""
+    def __init__(self, policies=None):
+        self.policies = dict(DEFAULT_POLICIES)
+        self.policies.update(policies or {})
+        self.cooldowns = HostCooldowns()
+
+    def plan(self, url, error, attempts):
+        """Return (error_class, delay) for a retry, or (error_class, None) to give up"""
+        error_class = classify_error(error)
+        policy = self.policies.get(error_class, self.policies[ERROR_UNKNOWN])
+        if attempts >= policy.max_attempts:
+            return error_class, None
+        delay = policy.delay(attempts)
+        if policy.host_cooldown:
+            self.cooldowns.start(host_of(url), delay)
+        return error_class, delay
+
+    def cooldown_remaining(self, url):
+        return self.cooldowns.remaining(host_of(url))
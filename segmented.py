@@ -0,0 +1,306 @@
+"""Opt-in segmented downloading: fetch one HTTP stream over several connections at once.
+
+A single connection on a high-bandwidth, high-latency link rarely fills the pipe. In
+segmented mode a stream is split into byte ranges that are fetched concurrently and
+written straight into a preallocated file at their offsets. The file is only renamed
+into place once every range is complete, so the merge step never sees a partial stream.
+
+The progress of each range is saved next to the partial file, so an interrupted
+segmented download continues where every range stopped. A failed range is retried
+after a short backoff; a server that answers a range with the whole file gets the
+download restarted over one connection.
+
+Fragmented formats (DASH/HLS) use yt-dlp's own concurrent fragment downloads instead.
+"""
+import json
+import os
+from contextlib import nullcontext
+import re
+import threading
+import time
+from yt_dlp import YoutubeDL
+from yt_dlp.downloader import get_suitable_downloader
+from yt_dlp.downloader.http import HttpFD
+from yt_dlp.networking import Request
+from yt_dlp.networking.exceptions import RequestError, TransportError
+from yt_dlp.utils import ContentTooShortError, DownloadError
+from yt_dlp.utils.networking import HTTPHeaderDict
+
+# Streams smaller than two segments of this size are downloaded over one connection
+MIN_SEGMENT_SIZE = 1024 * 1024
+READ_BLOCK_SIZE = 64 * 1024
+SEGMENT_RETRIES = 3
+# Seconds before the first retry of a segment, doubled for every further retry
+SEGMENT_RETRY_DELAY = 0.5
+# Seconds between progress reports while segments are downloading
+SEGMENT_PROGRESS_INTERVAL = 0.25
+# Seconds between saves of the per-range progress used to resume
+SEGMENT_STATE_INTERVAL = 2.0
+# Appended to the partial file's name for the saved range progress
+SEGMENT_STATE_SUFFIX = '.segments'
+
+CONTENT_RANGE_PATTERN = re.compile(r'bytes\s+\d+-\d+/(\d+)')
+
+class Segment:
+    def __init__(self, start, end):
+        # Inclusive byte range, as in an HTTP Range header
+        self.start = start
+        self.end = end
+        self.done = 0
+        self.error = None
+
+    @property
+    def length(self):
+        return self.end - self.start + 1
+
+    def is_complete(self):
+        return self.done == self.length
+
+class RangeIgnoredError(DownloadError):
+    """The server answered a range request with the whole file; retrying the range won't help"""
+
+def split_segments(total, connections):
+    """Split total bytes into at most `connections` ranges of at least MIN_SEGMENT_SIZE"""
+    count = max(1, min(connections, total // MIN_SEGMENT_SIZE))
+    size = -(-total // count)
+    return [Segment(start, min(start + size, total) - 1) for start in range(0, total, size)]
+
+def partial_bytes(tmpfilename):
+    """Bytes already downloaded into a partial file, whether segmented or not"""
+    try:
+        with open(tmpfilename + SEGMENT_STATE_SUFFIX, 'r', encoding='utf-8') as f:
+            return sum(done for _, _, done in json.load(f)['segments'])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    try:
+        return os.path.getsize(tmpfilename)
+    except OSError:
+        return 0
+
+class SegmentedHttpFD(HttpFD):
+    """HttpFD that fetches byte ranges in parallel when the server supports them"""
+    FD_NAME = 'segmented'
+
+    def real_download(self, filename, info_dict):
+        connections = self.params.get('segment_connections') or 1
+        tmpfilename = self.temp_name(filename)
+        state_file = tmpfilename + SEGMENT_STATE_SUFFIX
+        # An interrupted segmented download is resumed segmented, whatever the current setting
+        resuming = os.path.exists(state_file) and self.params.get('continuedl', True)
+        if ((connections <= 1 and not resuming) or filename == '-' or self.params.get('test')
+                or info_dict.get('request_data') or self._get_impersonate_target(info_dict) is not None):
+            # A preallocated partial file would look complete to a single-connection resume
+            self.discard_partial(tmpfilename, state_file)
+            return super().real_download(filename, info_dict)
+
+        url = info_dict['url']
+        headers = HTTPHeaderDict({'Accept-Encoding': 'identity'}, info_dict.get('http_headers'))
+        total = None if 'Range' in headers else self.probe_size(url, headers)
+        if not total or total < 2 * MIN_SEGMENT_SIZE:
+            self.discard_partial(tmpfilename, state_file)
+            return super().real_download(filename, info_dict)
+        if os.path.exists(tmpfilename) and not os.path.exists(state_file):
+            # Left by a single-connection download; let it resume the usual way
+            return super().real_download(filename, info_dict)
+
+        self.report_destination(filename)
+        segments = self.load_state(state_file, tmpfilename, total)
+        if segments:
+            resumed = sum(segment.done for segment in segments)
+            self.to_screen(f'[download] Resuming at {resumed} of {total} bytes over {len(segments)} connections')
+        else:
+            segments = split_segments(total, connections)
+            self.to_screen(f'[download] Fetching {total} bytes over {len(segments)} connections')
+            # Preallocate so every segment can write at its own offset
+            with open(tmpfilename, 'wb') as f:
+                f.truncate(total)
+            self.save_state(state_file, tmpfilename, total, segments)
+
+        lock = threading.Lock()
+        stop = threading.Event()
+        # engine.ConnectionLimiter caps connections across jobs; without one there is no cap
+        limiter = self.params.get('connection_limiter') or nullcontext()
+        threads = [threading.Thread(target=self.fetch_segment, daemon=True,
+                                    args=(url, headers, tmpfilename, segment, lock, stop, limiter))
+                   for segment in segments]
+        start_time = time.time()
+        start_bytes = sum(segment.done for segment in segments)
+        last_save = start_time
+        for thread in threads:
+            thread.start()
+
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(SEGMENT_PROGRESS_INTERVAL / len(threads))
+                with lock:
+                    downloaded = sum(segment.done for segment in segments)
+                now = time.time()
+                if now - last_save >= SEGMENT_STATE_INTERVAL:
+                    self.save_state(state_file, tmpfilename, total, segments, lock)
+                    last_save = now
+                speed = self.calc_speed(start_time, now, downloaded - start_bytes)
+                # Hooks run on this thread, so a cancel raised by a hook stops the segments below
+                self._hook_progress({
+                    'status': 'downloading',
+                    'downloaded_bytes': downloaded,
+                    'total_bytes': total,
+                    'tmpfilename': tmpfilename,
+                    'filename': filename,
+                    'eta': self.calc_eta(start_time, now, total - start_bytes, downloaded - start_bytes),
+                    'speed': speed,
+                    'elapsed': now - start_time,
+                    'ctx_id': info_dict.get('ctx_id'),
+                    # Each connection is paced by the throttle below, not by the progress hooks
+                    'rate_limited': True,
+                }, info_dict)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            self.save_state(state_file, tmpfilename, total, segments, lock)
+
+        ignored = [segment.error for segment in segments if isinstance(segment.error, RangeIgnoredError)]
+        if ignored:
+            self.report_warning(f'{ignored[0]}, downloading over one connection')
+            self.discard_partial(tmpfilename, state_file)
+            return super().real_download(filename, info_dict)
+
+        # Verify every range arrived in full before anything downstream touches the file
+        for segment in segments:
+            if not segment.is_complete():
+                raise DownloadError(f'Segment {segment.start}-{segment.end} incomplete: '
+                                    f'{segment.error or ContentTooShortError(segment.done, segment.length)}')
+        if os.path.getsize(tmpfilename) != total:
+            raise ContentTooShortError(os.path.getsize(tmpfilename), total)
+
+        self.try_rename(tmpfilename, filename)
+        self.discard_partial(None, state_file)
+        self._hook_progress({
+            'downloaded_bytes': total,
+            'total_bytes': total,
+            'filename': filename,
+            'status': 'finished',
+            'elapsed': time.time() - start_time,
+            'ctx_id': info_dict.get('ctx_id'),
+        }, info_dict)
+        return True
+
+    def probe_size(self, url, headers):
+        """Return the stream size if the server honours byte ranges, otherwise None"""
+        try:
+            response = self.ydl.urlopen(Request(url, headers={**headers, 'Range': 'bytes=0-0'}))
+        except (TransportError, OSError):
+            return None
+        try:
+            if response.status != 206:
+                return None
+            match = CONTENT_RANGE_PATTERN.match(response.headers.get('Content-Range') or '')
+            return int(match.group(1)) if match else None
+        finally:
+            response.close()
+
+    def load_state(self, state_file, tmpfilename, total):
+        """Return the saved segments of an interrupted download of this size, or None"""
+        if not self.params.get('continuedl', True):
+            return None
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get('total') != total or os.path.getsize(tmpfilename) != total:
+                return None
+            segments = []
+            for start, end, done in state['segments']:
+                segment = Segment(start, end)
+                segment.done = min(max(0, done), segment.length)
+                segments.append(segment)
+            return segments
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save_state(self, state_file, tmpfilename, total, segments, lock=None):
+        if lock:
+            with lock:
+                done = [segment.done for segment in segments]
+        else:
+            done = [segment.done for segment in segments]
+        try:
+            # Make the counted bytes durable before claiming them in the state file
+            with open(tmpfilename, 'r+b') as f:
+                os.fsync(f.fileno())
+            temp_state = state_file + '.tmp'
+            with open(temp_state, 'w', encoding='utf-8') as f:
+                json.dump({'total': total, 'segments': [[segment.start, segment.end, count]
+                                                        for segment, count in zip(segments, done)]}, f)
+            os.replace(temp_state, state_file)
+        except OSError:
+            pass  # Without the state a later run downloads the file again
+
+    @staticmethod
+    def discard_partial(tmpfilename, state_file):
+        """Remove a segmented partial file (if state_file says it is one) and its state"""
+        if not os.path.exists(state_file):
+            return
+        for path in (tmpfilename, state_file):
+            try:
+                if path:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def fetch_segment(self, url, headers, tmpfilename, segment, lock, stop, limiter):
+        throttle = self.params.get('throttle')
+        for attempt in range(SEGMENT_RETRIES + 1):
+            offset = segment.start + segment.done
+            if attempt and offset <= segment.end:
+                # Back off before retrying; a cancel or another segment's fallback ends the wait
+                stop.wait(SEGMENT_RETRY_DELAY * 2 ** (attempt - 1))
+            if stop.is_set() or offset > segment.end:
+                return
+            try:
+                with limiter:
+                    response = self.ydl.urlopen(Request(
+                        url, headers={**headers, 'Range': f'bytes={offset}-{segment.end}'}))
+                    try:
+                        if response.status != 206:
+                            raise RangeIgnoredError(f'Server ignored the byte range (HTTP {response.status})')
+                        # Unbuffered, so counted bytes have reached the OS before the state is saved
+                        with open(tmpfilename, 'r+b', buffering=0) as f:
+                            f.seek(offset)
+                            while not stop.is_set() and offset <= segment.end:
+                                block = response.read(min(READ_BLOCK_SIZE, segment.end + 1 - offset))
+                                if not block:
+                                    break
+                                f.write(block)
+                                offset += len(block)
+                                with lock:
+                                    segment.done += len(block)
+                                if throttle:
+                                    throttle(len(block))
+                    finally:
+                        response.close()
+                segment.error = None
+            except RangeIgnoredError as e:
+                # Every other range would get the whole file too, so stop them all
+                segment.error = e
+                stop.set()
+                return
+            except (RequestError, OSError, DownloadError) as e:
+                # Retry from where this segment stopped, including after an HTTP error status
+                segment.error = e
+
+class SegmentedYoutubeDL(YoutubeDL):
+    """YoutubeDL that downloads plain HTTP streams with SegmentedHttpFD"""
+    def dl(self, name, info, subtitle=False, test=False):
+        # Also used with one connection, so partial files of segmented runs are handled correctly
+        if (test or subtitle or name == '-' or not info.get('url')
+                or get_suitable_downloader(info, self.params) is not HttpFD):
+            return super().dl(name, info, subtitle, test)
+
+        fd = SegmentedHttpFD(self, self.params)
+        for ph in self._progress_hooks:
+            fd.add_progress_hook(ph)
+        new_info = self._copy_infodict(info)
+        if new_info.get('http_headers') is None:
+            new_info['http_headers'] = self._calc_headers(new_info)
+        return fd.download(name, new_info, subtitle)
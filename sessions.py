@@ -0,0 +1,140 @@
+"""Pool of reusable YoutubeDL instances, one set per option profile.
+
+Building a YoutubeDL loads and instantiates extractors, sets up the HTTP request
+handlers and reads cookies. Reusing instances across jobs skips that work and, when
+the `requests` package is installed, keeps HTTP connections to the site alive.
+
+A YoutubeDL is not thread-safe, so each instance is lent to one job at a time. The
+hooks and logger installed in an instance forward to whatever the borrowing job
+attached, and are detached again on release so nothing leaks between jobs.
+"""
+import threading
+from contextlib import contextmanager
+
+# Idle instances kept per profile; more can be lent out, extras are closed on release
+DEFAULT_IDLE_PER_PROFILE = 4
+
+class YoutubeDLSession:
+    """A YoutubeDL plus the per-job hooks, logger and output folder currently attached to it"""
+    def __init__(self, profile, options):
+        self.profile = profile
+        self.progress_hook = None
+        self.postprocessor_hook = None
+        self.logger = None
+        # Imported here so loading this module doesn't load yt-dlp
+        from segmented import SegmentedYoutubeDL
+        options = dict(options)
+        options.update({
+            'progress_hooks': [self._on_progress],
+            'postprocessor_hooks': [self._on_postprocess],
+            'logger': self,
+        })
+        self.ydl = SegmentedYoutubeDL(options)
+
+    def attach(self, output_path='.', progress_hook=None, postprocessor_hook=None, logger=None, throttle=None):
+        self.progress_hook = progress_hook
+        self.postprocessor_hook = postprocessor_hook
+        self.logger = logger
+        # The output template is relative, so the folder can change per job
+        self.ydl.params['paths'] = {'home': output_path or '.'}
+        # Called with each block's size by downloaders that pace themselves (segmented mode)
+        self.ydl.params['throttle'] = throttle
+
+    def detach(self):
+        self.progress_hook = None
+        self.postprocessor_hook = None
+        self.logger = None
+        self.ydl.params['paths'] = {}
+        self.ydl.params['throttle'] = None
+
+    def close(self):
+        try:
+            self.ydl.close()
+        except Exception:
+            pass
+
+    def _on_progress(self, d):
+        if self.progress_hook:
+            self.progress_hook(d)
+
+    def _on_postprocess(self, d):
+        if self.postprocessor_hook:
+            self.postprocessor_hook(d)
+
+    # yt-dlp logger interface; messages without an attached job are dropped
+    def debug(self, msg):
+        if self.logger:
+            self.logger.debug(msg)
+
+    def info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def warning(self, msg):
+        if self.logger:
+            self.logger.warning(msg)
+
+    def error(self, msg):
+        if self.logger:
+            self.logger.error(msg)
+
+class SessionPool:
+    """Lend out YoutubeDL sessions per profile, creating them on demand"""
+    def __init__(self, max_idle_per_profile=DEFAULT_IDLE_PER_PROFILE):
+        self.max_idle_per_profile = max_idle_per_profile
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.created = 0
+        self.reused = 0
+        self.closed = False
+
+    def acquire(self, profile, options):
+        """Take an idle session for the profile, or build one from options"""
+        with self.lock:
+            sessions = self.idle.get(profile)
+            if sessions:
+                self.reused += 1
+                return sessions.pop()
+            self.created += 1
+        return YoutubeDLSession(profile, options)
+
+    def release(self, session, discard=False):
+        """Return a session to the pool; discarded sessions (e.g. after an error) are closed"""
+        session.detach()
+        with self.lock:
+            sessions = self.idle.setdefault(session.profile, [])
+            if not discard and not self.closed and len(sessions) < self.max_idle_per_profile:
+                sessions.append(session)
+                return
+        session.close()
+
+    @contextmanager
+    def session(self, profile, options):
+        session = self.acquire(profile, options)
+        discard = True
+        try:
+            yield session
+            discard = False
+        finally:
+            self.release(session, discard)
+
+    def warm(self, profile, options, count=1):
+        """Build idle sessions ahead of the first job that needs them"""
+        with self.lock:
+            missing = min(count, self.max_idle_per_profile) - len(self.idle.get(profile, []))
+            self.created += max(0, missing)
+        for _ in range(missing):
+            self.release(YoutubeDLSession(profile, options))
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            sessions = [session for idle in self.idle.values() for session in idle]
+            self.idle = {}
+        for session in sessions:
+            session.close()
+
+    def stats(self):
+        with self.lock:
+            return {'created': self.created, 'reused': self.reused,
+                    'idle': sum(len(idle) for idle in self.idle.values())}
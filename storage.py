@@ -0,0 +1,174 @@
+"""Disk space reservations, per-job staging folders and atomic moves into the output folder.
+
+Every job downloads and post-processes inside its own staging folder: a subfolder of
+the scratch directory if one is set (e.g. a fast local SSD), otherwise a hidden folder
+inside the output folder. Once the extracted format info is known, the job's size is
+estimated (presets.estimate_job) and reserved against the free space of every disk it
+will write to. Parallel jobs therefore can't overcommit a disk, and a full disk fails a
+job before it downloads anything instead of near the end. Finished files are moved into
+the output folder with a single rename, under a new name if another file already has
+theirs, and failed or cancelled jobs have their staging folder removed.
+"""
+import errno
+import os
+import shutil
+import threading
+
+# Hidden folder inside the output folder used when there is no scratch directory
+STAGING_DIR_NAME = '.ytdl-staging'
+# Free space that is always left alone, on top of all reservations
+DEFAULT_MIN_FREE = 200 * 1024 * 1024
+# Added to every estimate for container overhead and estimates that come out low
+ESTIMATE_MARGIN = 0.1
+
+def format_megabytes(nbytes):
+    return f"{nbytes / 1024 / 1024:.1f} MB"
+
+class InsufficientSpaceError(OSError):
+    """A disk doesn't have room for a job even if every other job finished (needed includes min_free)"""
+    def __init__(self, path, needed, available):
+        super().__init__(errno.ENOSPC, f"Not enough disk space in {path}: the job needs about "
+                                       f"{format_megabytes(needed)}, {format_megabytes(max(0, available))} is free")
+        self.path = path
+        self.needed = needed
+        self.available = available
+
+def disk_usage_of(path):
+    """Bytes a folder's files actually occupy (preallocated sparse files count as what is written)"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            blocks = getattr(st, 'st_blocks', None)
+            total += min(st.st_size, blocks * 512) if blocks is not None else st.st_size
+    return total
+
+def unique_path(path):
+    """path, or 'name (2).ext', 'name (3).ext', ... if it is taken"""
+    if not os.path.exists(path):
+        return path
+    stem, ext = os.path.splitext(path)
+    counter = 2
+    while os.path.exists(f"{stem} ({counter}){ext}"):
+        counter += 1
+    return f"{stem} ({counter}){ext}"
+
+class Reservation:
+    def __init__(self, device, path, nbytes, grows_in):
+        self.device = device
+        self.path = path
+        self.nbytes = nbytes
+        # Staging folder whose contents use up this reservation as they are written, or None
+        self.grows_in = grows_in
+
+    def outstanding(self):
+        if self.grows_in is None:
+            return self.nbytes
+        return max(0, self.nbytes - disk_usage_of(self.grows_in))
+
+class OutputManager:
+    """Staging folders and disk space reservations shared by all jobs of a queue"""
+    def __init__(self, scratch_dir=None, min_free=DEFAULT_MIN_FREE):
+        self.scratch_dir = scratch_dir or None
+        self.min_free = min_free
+        self.condition = threading.Condition()
+        # staging path -> [Reservation, ...]
+        self.reservations = {}
+
+    def staging_path(self, output_path, key):
+        """Staging folder of a job; key must be unique and stable across restarts of the job"""
+        root = self.scratch_dir or os.path.join(output_path or '.', STAGING_DIR_NAME)
+        return os.path.join(root, f"job-{key}")
+
+    def reserve(self, staging_path, output_path, estimate, cancel_event=None, on_wait=None):
+        """Reserve room for a job's (download, output) estimate, waiting for other jobs if needed.
+
+        Raises InsufficientSpaceError if a disk is too full even without other jobs. An
+        unknown estimate (None) only checks that the minimum free space is left.
+        """
+        download, output = estimate or (0, 0)
+        download = int(download * (1 + ESTIMATE_MARGIN))
+        output = int(output * (1 + ESTIMATE_MARGIN))
+        os.makedirs(staging_path, exist_ok=True)
+        os.makedirs(output_path or '.', exist_ok=True)
+        staging_device = os.stat(staging_path).st_dev
+        output_device = os.stat(output_path or '.').st_dev
+        # The streams and the merged file sit side by side in staging until the streams are deleted
+        needs = [Reservation(staging_device, staging_path, download + output, staging_path)]
+        if output_device != staging_device:
+            # Moving across disks copies the output; on the same disk it is only a rename
+            needs.append(Reservation(output_device, output_path or '.', output, None))
+
+        with self.condition:
+            # A retry replaces the reservation of its earlier attempt
+            self.reservations.pop(staging_path, None)
+            waited = False
+            while True:
+                blocked_by = 0
+                for need in needs:
+                    disk_free = shutil.disk_usage(need.path).free
+                    free = disk_free - self.min_free
+                    # Bytes already in this job's staging folder are part of its estimate
+                    pending = need.outstanding()
+                    if pending > free:
+                        raise InsufficientSpaceError(need.path, pending + self.min_free, disk_free)
+                    reserved = sum(other.outstanding() for others in self.reservations.values()
+                                   for other in others if other.device == need.device)
+                    if pending > free - reserved:
+                        blocked_by = max(blocked_by, reserved)
+                if not blocked_by or (cancel_event is not None and cancel_event.is_set()):
+                    break
+                if on_wait and not waited:
+                    on_wait(blocked_by)
+                waited = True
+                self.condition.wait(1.0)
+            self.reservations[staging_path] = needs
+        return download + output
+
+    def release(self, staging_path):
+        """Give back a job's reservation, e.g. while it waits to be retried"""
+        if not staging_path:
+            return
+        with self.condition:
+            if self.reservations.pop(staging_path, None) is not None:
+                self.condition.notify_all()
+
+    def move_to_output(self, path, output_path):
+        """Move a finished file from staging into the output folder, never overwriting another file"""
+        output_path = output_path or '.'
+        os.makedirs(output_path, exist_ok=True)
+        target = os.path.join(output_path, os.path.basename(path))
+        if os.stat(path).st_dev != os.stat(output_path).st_dev:
+            # Copy next to the target first so the file appears in the output folder in one rename
+            temp_target = os.path.join(output_path, f".{os.path.basename(path)}.{threading.get_ident()}.tmp")
+            try:
+                shutil.copyfile(path, temp_target)
+                with self.condition:
+                    target = unique_path(target)
+                    os.replace(temp_target, target)
+            finally:
+                if os.path.exists(temp_target):
+                    os.remove(temp_target)
+            os.remove(path)
+            return target
+        with self.condition:
+            target = unique_path(target)
+            os.replace(path, target)
+        return target
+
+    def discard(self, staging_path):
+        """Release a job's reservation and delete its staging folder with any partial files"""
+        if not staging_path:
+            return
+        self.release(staging_path)
+        shutil.rmtree(staging_path, ignore_errors=True)
+        parent = os.path.dirname(staging_path)
+        if os.path.basename(parent) == STAGING_DIR_NAME:
+            try:
+                # Only succeeds once the last job using this output folder is done
+                os.rmdir(parent)
+            except OSError:
+                pass
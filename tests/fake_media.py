@@ -0,0 +1,21 @@
+"""Shared helpers for tests that download from benchmark.FakeMediaServer"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import get_default_ffmpeg_path, check_ffmpeg_installation
+
+def find_ffmpeg():
+    """An FFmpeg binary to encode and merge with, or skip the test"""
+    path = get_default_ffmpeg_path()
+    if not path:
+        try:
+            import imageio_ffmpeg
+            path = imageio_ffmpeg.get_ffmpeg_exe()
+        except Exception:
+            path = None
+    if not path or not check_ffmpeg_installation(path):
+        raise unittest.SkipTest("FFmpeg not available")
+    return path
@@ -0,0 +1,45 @@
+import io
+import json
+import os
+import sys
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cli
+
+PLAYLIST_URL = 'https://www.youtube.com/playlist?list=PLtest'
+
+def fake_info(url):
+    return {'id': url[-1], 'title': f'Video {url[-1]}', 'duration': 100, 'formats': [
+        {'format_id': '22', 'ext': 'mp4', 'vcodec': 'avc1.64001f', 'acodec': 'none', 'height': 720, 'tbr': 2000},
+        {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 128, 'tbr': 128},
+    ]}
+
+class EstimateTest(unittest.TestCase):
+    def run_cli(self, argv):
+        out = io.StringIO()
+        with mock.patch.object(cli, 'check_ffmpeg_installation', return_value=True), \
+                mock.patch.object(cli, 'expand_playlist', return_value=({'id': 'PLtest'}, [
+                    {'id': 'a', 'url': 'https://youtu.be/a', 'title': 'A'},
+                    {'id': 'b', 'url': 'https://youtu.be/b', 'title': 'B'},
+                ])), \
+                mock.patch.object(cli, 'probe_url', side_effect=lambda url, *args: fake_info(url)), \
+                redirect_stdout(out):
+            code = cli.main(argv)
+        return code, [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def test_estimate_expands_playlists(self):
+        code, events = self.run_cli(['--estimate', '--no-archive', '--no-journal', '--ffmpeg', 'ffmpeg',
+                                     '-f', 'mp4-720', PLAYLIST_URL])
+        self.assertEqual(code, 0)
+        self.assertFalse([event for event in events if event['event'] == 'playlist'])
+        estimates = [event for event in events if event['event'] == 'estimate']
+        self.assertEqual([event['url'] for event in estimates], ['https://youtu.be/a', 'https://youtu.be/b'])
+        self.assertEqual(estimates[0]['estimates'][0]['preset'], 'mp4-720')
+        self.assertGreater(estimates[0]['estimates'][0]['download_bytes'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
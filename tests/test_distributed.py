@@ -0,0 +1,111 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import distributed
+import engine
+from distributed import Coordinator, CoordinatorClient, JobBoard, Worker, serve_coordinator, MAX_LEASES
+from engine import DownloadJob, DownloadQueue, FetchedMedia
+from storage import OutputManager
+
+def fake_fetch_media(url, output_path='.', ffmpeg_path=None, log_queue=None, format_type='mp4', job_id=None,
+                     **kwargs):
+    """Write a small 'download' named after the URL's last path segment instead of using the network"""
+    fetched = FetchedMedia(url, output_path, ffmpeg_path, format_type, job_id)
+    os.makedirs(output_path, exist_ok=True)
+    path = os.path.join(output_path, url.rstrip('/').rsplit('/', 1)[-1] + '.m4a')
+    with open(path, 'wb') as f:
+        f.write(url.encode('utf-8') * 100)
+    # Long enough for the other worker to claim jobs in between
+    time.sleep(0.05)
+    fetched.output_files = [path]
+    return fetched
+
+def fake_postprocess_media(fetched, log_queue=None, on_progress=None, cancel_event=None):
+    pass
+
+class DistributedTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.output = os.path.join(self.tmp, 'output')
+        self.board = JobBoard(os.path.join(self.tmp, 'board.sqlite3'))
+        self.addCleanup(self.board.close)
+
+    def coordinator(self, lease_seconds=60):
+        return Coordinator(self.board, self.output, storage=OutputManager(min_free=0), lease_seconds=lease_seconds)
+
+    def test_workers_claim_each_job_once_and_upload_into_output(self):
+        coordinator = self.coordinator()
+        urls = [f'https://example.com/v/{name}' for name in ('a', 'b', 'c', 'd', 'e')]
+        # Different URLs, same file name
+        urls += ['https://example.com/other/a']
+        for url in urls:
+            coordinator.submit(url, 'm4a')
+        server = serve_coordinator(coordinator, port=0)
+        self.addCleanup(server.shutdown)
+        client = CoordinatorClient(f'http://127.0.0.1:{server.server_address[1]}')
+
+        claims = []
+        claims_lock = threading.Lock()
+
+        def on_event(event, **fields):
+            if event == 'claim':
+                with claims_lock:
+                    claims.append(fields['board_job_id'])
+
+        results = {}
+        with mock.patch.object(engine, 'fetch_media', fake_fetch_media), \
+                mock.patch.object(engine, 'postprocess_media', fake_postprocess_media), \
+                mock.patch.object(distributed, 'CLAIM_POLL_INTERVAL', 0.05):
+            threads = []
+            for name in ('w1', 'w2', 'w3'):
+                queue = DownloadQueue(None, max_workers=2, storage=OutputManager(min_free=0))
+                worker = Worker(client, queue, os.path.join(self.tmp, name), worker_id=name, on_event=on_event)
+                thread = threading.Thread(target=lambda w=worker, n=name: results.__setitem__(n, w.run()))
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join(timeout=30)
+
+        self.assertEqual(results, {'w1': True, 'w2': True, 'w3': True})
+        self.assertEqual(sorted(claims), sorted(job['job_id'] for job in self.board.jobs()))
+        self.assertEqual(self.board.counts()[DownloadJob.DONE], len(urls))
+        self.assertTrue(all(job['leases'] == 1 for job in self.board.jobs()))
+        self.assertEqual(sorted(os.listdir(self.output)),
+                         ['a (2).m4a', 'a.m4a', 'b.m4a', 'c.m4a', 'd.m4a', 'e.m4a'])
+
+    def test_expired_lease_requeues_then_fails(self):
+        coordinator = self.coordinator(lease_seconds=0.05)
+        job, _ = coordinator.submit('https://example.com/v/a', 'mp4')
+
+        for lease in range(1, MAX_LEASES + 1):
+            claimed = coordinator.claim(f'worker-{lease}')
+            self.assertEqual(claimed['job_id'], job['job_id'])
+            self.assertEqual(claimed['leases'], lease)
+            time.sleep(0.1)
+            self.assertEqual(coordinator.expire_leases(), [job['job_id']])
+            state = self.board.get(job['job_id'])['state']
+            self.assertEqual(state, DownloadJob.FAILED if lease == MAX_LEASES else DownloadJob.QUEUED)
+
+        self.assertIsNone(coordinator.claim('worker-late'))
+        self.assertIn('lease expired', self.board.get(job['job_id'])['error'])
+
+    def test_upload_after_lost_lease_is_rejected(self):
+        coordinator = self.coordinator(lease_seconds=0.05)
+        job, _ = coordinator.submit('https://example.com/v/a', 'mp4')
+        coordinator.claim('w1')
+        time.sleep(0.1)
+        coordinator.expire_leases()
+        with self.assertRaises(distributed.LeaseLost):
+            coordinator.receive_file(job['job_id'], 'w1', 'a.mp4', None, 10)
+
+if __name__ == '__main__':
+    unittest.main()
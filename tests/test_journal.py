@@ -0,0 +1,131 @@
+import glob
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_media import find_ffmpeg
+import engine
+from benchmark import FakeMediaServer, generate_media
+from engine import DownloadJob, DownloadQueue, fetch_media
+from journal import JobJournal, PHASE_DOWNLOAD
+from storage import OutputManager, STAGING_DIR_NAME
+
+CLI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cli.py')
+DURATION = 6
+
+def drain(log_queue):
+    messages = []
+    while not log_queue.empty():
+        messages.append(str(log_queue.get()))
+    return messages
+
+class CrashRecoveryTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.ffmpeg = find_ffmpeg()
+        cls.media = tempfile.mkdtemp()
+        video_bitrate = generate_media(cls.ffmpeg, cls.media, 8 * 1024 * 1024, DURATION)
+        cls.media_bytes = sum(os.path.getsize(os.path.join(cls.media, name)) for name in os.listdir(cls.media))
+        # Slow enough to kill the CLI half way through the video stream
+        cls.server = FakeMediaServer(cls.media, DURATION, video_bitrate, bandwidth=2 * 1024 * 1024).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        shutil.rmtree(cls.media, ignore_errors=True)
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.output = os.path.join(self.tmp, 'output')
+        self.journal_path = os.path.join(self.tmp, 'journal.sqlite3')
+
+    def kill_mid_download(self, url):
+        """Run the CLI on url and kill it once part of the video stream is on disk"""
+        process = subprocess.Popen([sys.executable, CLI, '--no-archive', '--journal', self.journal_path,
+                                    '--ffmpeg', self.ffmpeg, '-o', self.output, url],
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = time.time() + 60
+            while time.time() < deadline:
+                parts = glob.glob(os.path.join(self.output, STAGING_DIR_NAME, '*', '*.part'))
+                if parts and os.path.getsize(parts[0]) > 1024 * 1024:
+                    break
+                time.sleep(0.05)
+            else:
+                self.fail("The download never got going")
+        finally:
+            process.kill()
+            process.wait()
+        # The server counts a connection's bytes when it notices the connection is gone
+        sent = None
+        while sent != self.server.bytes_sent:
+            sent = self.server.bytes_sent
+            time.sleep(0.5)
+        journal = JobJournal(self.journal_path)
+        self.addCleanup(journal.close)
+        entries = journal.pending()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['phase'], PHASE_DOWNLOAD)
+        self.assertTrue(entries[0]['partial_files'])
+        self.assertTrue(os.path.isdir(entries[0]['staging_path']))
+        return journal, entries[0]
+
+    def test_download_resumes_from_its_byte_offset(self):
+        journal, entry = self.kill_mid_download(self.server.video_url('resume'))
+        log_queue = queue.Queue()
+        download_queue = DownloadQueue(log_queue, journal=journal, storage=OutputManager(min_free=0))
+        sent_before = self.server.bytes_sent
+        jobs = download_queue.resume_journal()
+        download_queue.wait()
+        download_queue.session_pool.close()
+        messages = drain(log_queue)
+
+        self.assertEqual([job.state for job in jobs], [DownloadJob.DONE], messages)
+        self.assertTrue(any('Resuming download at byte' in message for message in messages), messages)
+        self.assertLess(self.server.bytes_sent - sent_before, self.media_bytes)
+        self.assertEqual(os.listdir(self.output), ['resume.mp4'])
+        self.assertFalse(os.path.exists(entry['staging_path']))
+        self.assertEqual(journal.count(), 0)
+
+    def test_discard_deletes_the_staging_folder(self):
+        journal, entry = self.kill_mid_download(self.server.video_url('discard'))
+        download_queue = DownloadQueue(None, journal=journal, storage=OutputManager(min_free=0))
+        self.assertEqual(download_queue.discard_journal(), 1)
+        self.assertFalse(os.path.exists(entry['staging_path']))
+        self.assertEqual(journal.count(), 0)
+
+    def test_fetched_job_only_reruns_postprocessing(self):
+        journal = JobJournal(self.journal_path)
+        self.addCleanup(journal.close)
+        url = self.server.video_url('fetched')
+        storage = OutputManager(min_free=0)
+        staging_path = storage.staging_path(self.output, 'test-fetched')
+        # What a run killed between the two pipeline stages leaves behind
+        journal_id = journal.add(url, 'mp4', self.output, self.ffmpeg)
+        journal.set_staging_path(journal_id, staging_path)
+        fetched = fetch_media(url, self.output, self.ffmpeg, storage=storage, staging_path=staging_path)
+        journal.set_fetched(journal_id, fetched.to_dict())
+
+        log_queue = queue.Queue()
+        download_queue = DownloadQueue(log_queue, journal=journal, storage=storage)
+        with mock.patch.object(engine, 'fetch_media', side_effect=AssertionError("downloaded again")):
+            jobs = download_queue.resume_journal()
+            download_queue.wait()
+        messages = drain(log_queue)
+
+        self.assertEqual([job.state for job in jobs], [DownloadJob.DONE], messages)
+        self.assertTrue(any('Streams already downloaded' in message for message in messages), messages)
+        self.assertEqual(os.listdir(self.output), ['fetched.mp4'])
+        self.assertEqual(journal.count(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import io
+import os
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yt_dlp.networking import Response
+from yt_dlp.networking.exceptions import HTTPError
+from yt_dlp.utils import DownloadError, PostProcessingError
+
+from retry import (classify_error, host_of, RetryController, RetryPolicy, DEFAULT_POLICIES, ERROR_DISK_FULL,
+                   ERROR_EXPIRED, ERROR_POSTPROCESS, ERROR_THROTTLED, ERROR_TRANSIENT, ERROR_UNAVAILABLE)
+
+def download_error(status):
+    """A DownloadError wrapping an HTTPError, the way yt-dlp reports failed requests"""
+    error = HTTPError(Response(io.BytesIO(b''), 'https://example.com/video', {}, status=status))
+    return DownloadError(f'ERROR: unable to download video data: {error}', (None, error, None))
+
+class ClassifyErrorTest(unittest.TestCase):
+    def test_http_statuses(self):
+        self.assertEqual(classify_error(download_error(503)), ERROR_TRANSIENT)
+        self.assertEqual(classify_error(download_error(429)), ERROR_THROTTLED)
+        self.assertEqual(classify_error(download_error(403)), ERROR_EXPIRED)
+        self.assertEqual(classify_error(download_error(404)), ERROR_UNAVAILABLE)
+
+    def test_messages_without_an_http_error(self):
+        self.assertEqual(classify_error(Exception('HTTP Error 503: Service Unavailable')), ERROR_TRANSIENT)
+        self.assertEqual(classify_error(Exception("Sign in to confirm you're not a bot")), ERROR_THROTTLED)
+        self.assertEqual(classify_error(Exception('Private video')), ERROR_UNAVAILABLE)
+        self.assertEqual(classify_error(socket.timeout('timed out')), ERROR_TRANSIENT)
+
+    def test_disk_full_and_postprocess(self):
+        self.assertEqual(classify_error(OSError(28, 'No space left on device')), ERROR_DISK_FULL)
+        self.assertEqual(classify_error(PostProcessingError('FFmpeg failed')), ERROR_POSTPROCESS)
+
+class RetryPolicyTest(unittest.TestCase):
+    def test_delay_stays_within_the_ceiling(self):
+        policy = RetryPolicy(max_attempts=10, base_delay=2, max_delay=60)
+        for attempt in range(1, 10):
+            ceiling = min(60, 2 * 2 ** (attempt - 1))
+            for _ in range(50):
+                delay = policy.delay(attempt)
+                self.assertGreaterEqual(delay, ceiling / 2)
+                self.assertLessEqual(delay, ceiling)
+
+    def test_plan(self):
+        controller = RetryController()
+        # Retried until the class's attempts are used up
+        attempts = DEFAULT_POLICIES[ERROR_TRANSIENT].max_attempts
+        self.assertIsNotNone(controller.plan('https://example.com/a', download_error(503), 1)[1])
+        self.assertIsNone(controller.plan('https://example.com/a', download_error(503), attempts)[1])
+        self.assertIsNone(controller.plan('https://example.com/a', download_error(404), 1)[1])
+        self.assertIsNotNone(controller.plan('https://example.com/a', download_error(403), 1)[1])
+        self.assertIsNone(controller.plan('https://example.com/a', download_error(403), 2)[1])
+
+    def test_throttling_cools_down_the_whole_host(self):
+        controller = RetryController()
+        error_class, delay = controller.plan('https://www.youtube.com/watch?v=a', download_error(429), 1)
+        self.assertEqual(error_class, ERROR_THROTTLED)
+        self.assertGreater(controller.cooldown_remaining('https://youtu.be/b'), 0)
+        self.assertEqual(controller.cooldown_remaining('https://example.com/c'), 0)
+
+    def test_host_of(self):
+        self.assertEqual(host_of('https://m.youtube.com/watch?v=a'), 'youtube.com')
+        self.assertEqual(host_of('https://youtu.be/a'), 'youtube.com')
+        self.assertEqual(host_of('http://127.0.0.1:8000/v'), '127.0.0.1')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import segmented
+from benchmark import FakeMediaServer
+from segmented import SegmentedHttpFD, SegmentedYoutubeDL, SEGMENT_STATE_SUFFIX, split_segments
+
+CONNECTIONS = 3
+SIZE = 3 * 1024 * 1024 + 123
+
+class RangeIgnoringServer(FakeMediaServer):
+    """Answers the size probe with a range but every other request with the whole file"""
+    def handler_class(self):
+        class Handler(super().handler_class()):
+            def send_media(self, path):
+                if self.headers.get('Range') != 'bytes=0-0':
+                    del self.headers['Range']
+                super().send_media(path)
+        return Handler
+
+class FlakyServer(FakeMediaServer):
+    """Fails the first request for every byte range after the size probe with a 503"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.failed = set()
+
+    def handler_class(self):
+        server = self
+
+        class Handler(super().handler_class()):
+            def send_media(self, path):
+                byte_range = self.headers.get('Range')
+                if byte_range != 'bytes=0-0' and byte_range not in server.failed:
+                    server.failed.add(byte_range)
+                    self.send_error(503)
+                    return
+                super().send_media(path)
+        return Handler
+
+class SegmentedDownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.data = os.urandom(SIZE)
+        media = os.path.join(self.tmp, 'media')
+        os.makedirs(media)
+        with open(os.path.join(media, 'video.mp4'), 'wb') as f:
+            f.write(self.data)
+        self.media = media
+        self.filename = os.path.join(self.tmp, 'video.mp4')
+        ydl = SegmentedYoutubeDL({'quiet': True, 'noprogress': True, 'segment_connections': CONNECTIONS})
+        self.addCleanup(ydl.close)
+        self.fd = SegmentedHttpFD(ydl, ydl.params)
+
+    def start_server(self, server_class=FakeMediaServer):
+        server = server_class(self.media, 1, 0).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def download(self, server):
+        self.assertTrue(self.fd.real_download(self.filename, {'url': f'{server.base_url}/media/video.mp4',
+                                                              'http_headers': {}}))
+        with open(self.filename, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        tmpfilename = self.fd.temp_name(self.filename)
+        self.assertFalse(os.path.exists(tmpfilename))
+        self.assertFalse(os.path.exists(tmpfilename + SEGMENT_STATE_SUFFIX))
+
+    def bytes_sent(self, server, expected):
+        # The server counts a response once it has been written, just after the client has read it
+        deadline = time.time() + 5
+        while server.bytes_sent != expected and time.time() < deadline:
+            time.sleep(0.05)
+        return server.bytes_sent
+
+    def test_downloads_byte_ranges_in_parallel(self):
+        server = self.start_server()
+        self.download(server)
+        # The one-byte size probe, then one request per range
+        self.assertEqual(server.requests, 1 + CONNECTIONS)
+        self.assertEqual(self.bytes_sent(server, SIZE + 1), SIZE + 1)
+
+    def test_resumes_every_range_from_the_state_file(self):
+        tmpfilename = self.fd.temp_name(self.filename)
+        segments = split_segments(SIZE, CONNECTIONS)
+        # What an interrupted run leaves behind: every range half done
+        with open(tmpfilename, 'wb') as f:
+            f.truncate(SIZE)
+            for segment in segments:
+                segment.done = segment.length // 2
+                f.seek(segment.start)
+                f.write(self.data[segment.start:segment.start + segment.done])
+        self.fd.save_state(tmpfilename + SEGMENT_STATE_SUFFIX, tmpfilename, SIZE, segments)
+        resumed = sum(segment.done for segment in segments)
+
+        server = self.start_server()
+        self.download(server)
+        self.assertEqual(self.bytes_sent(server, SIZE - resumed + 1), SIZE - resumed + 1)
+
+    def test_falls_back_to_one_connection_when_ranges_are_ignored(self):
+        server = self.start_server(RangeIgnoringServer)
+        started = time.time()
+        self.download(server)
+        # Without retrying the ranges first
+        self.assertLess(time.time() - started, segmented.SEGMENT_RETRY_DELAY)
+
+    def test_retries_a_failed_range_after_a_backoff(self):
+        server = self.start_server(FlakyServer)
+        with mock.patch.object(segmented, 'SEGMENT_RETRY_DELAY', 0.2):
+            started = time.time()
+            self.download(server)
+            self.assertGreaterEqual(time.time() - started, 0.2)
+        self.assertEqual(len(server.failed), CONNECTIONS)
+        self.assertEqual(server.requests, 1 + 2 * CONNECTIONS)
+
+if __name__ == '__main__':
+    unittest.main()
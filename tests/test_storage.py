@@ -0,0 +1,132 @@
+import collections
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from yt_dlp.utils import DownloadCancelled
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import engine
+import storage
+from engine import DownloadJob, DownloadQueue
+from retry import ERROR_DISK_FULL, classify_error, RetryController
+from storage import InsufficientSpaceError, OutputManager, STAGING_DIR_NAME
+
+DiskUsage = collections.namedtuple('DiskUsage', 'total used free')
+
+def fake_disk(free):
+    """Pretend every disk has free bytes left"""
+    return mock.patch.object(storage.shutil, 'disk_usage', return_value=DiskUsage(free, 0, free))
+
+class OutputManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.output = os.path.join(self.tmp, 'output')
+        self.storage = OutputManager(min_free=0)
+
+    def test_reserve_waits_for_release(self):
+        first = self.storage.staging_path(self.output, 'first')
+        second = self.storage.staging_path(self.output, 'second')
+        waiting = threading.Event()
+        reserved = threading.Event()
+
+        def reserve_second():
+            self.storage.reserve(second, self.output, (600, 0), on_wait=lambda blocked_by: waiting.set())
+            reserved.set()
+
+        with fake_disk(1000):
+            self.storage.reserve(first, self.output, (600, 0))
+            thread = threading.Thread(target=reserve_second)
+            thread.start()
+            self.assertTrue(waiting.wait(5))
+            self.assertFalse(reserved.is_set())
+            self.storage.release(first)
+            # Woken by release, well before the 1 s polling interval
+            self.assertTrue(reserved.wait(0.5))
+            thread.join()
+        self.assertEqual(list(self.storage.reservations), [second])
+
+    def test_reserve_fails_when_the_job_can_never_fit(self):
+        staging = self.storage.staging_path(self.output, 'huge')
+        with fake_disk(1000), self.assertRaises(InsufficientSpaceError) as raised:
+            self.storage.reserve(staging, self.output, (5000, 0))
+        self.assertEqual(classify_error(raised.exception), ERROR_DISK_FULL)
+        self.assertEqual(RetryController().plan('https://example.com/v', raised.exception, 1),
+                         (ERROR_DISK_FULL, None))
+        self.assertEqual(self.storage.reservations, {})
+
+    def test_move_to_output_never_overwrites(self):
+        os.makedirs(self.output)
+        with open(os.path.join(self.output, 'video.mp4'), 'w') as f:
+            f.write('existing')
+        staging = self.storage.staging_path(self.output, 'move')
+        os.makedirs(staging)
+        path = os.path.join(staging, 'video.mp4')
+        with open(path, 'w') as f:
+            f.write('new')
+
+        target = self.storage.move_to_output(path, self.output)
+
+        self.assertEqual(target, os.path.join(self.output, 'video (2).mp4'))
+        self.assertFalse(os.path.exists(path))
+        with open(os.path.join(self.output, 'video.mp4')) as f:
+            self.assertEqual(f.read(), 'existing')
+        with open(target) as f:
+            self.assertEqual(f.read(), 'new')
+
+class QueueStagingTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.output = os.path.join(self.tmp, 'output')
+        self.queue = DownloadQueue(None, max_workers=1, storage=OutputManager(min_free=0))
+        self.calls = 0
+
+    def write_partial(self, staging_path):
+        self.calls += 1
+        os.makedirs(staging_path, exist_ok=True)
+        with open(os.path.join(staging_path, 'video.f137.mp4.part'), 'wb') as f:
+            f.write(b'\0' * 100)
+
+    def test_job_that_can_never_fit_fails_without_retry(self):
+        def fetch_media(url, output_path='.', *args, storage=None, staging_path=None, **kwargs):
+            self.write_partial(staging_path)
+            storage.reserve(staging_path, output_path, (5000, 0))
+
+        with fake_disk(1000), mock.patch.object(engine, 'fetch_media', fetch_media):
+            job = self.queue.add('https://example.com/v/huge', self.output)
+            self.queue.wait()
+
+        self.assertEqual(job.state, DownloadJob.FAILED)
+        self.assertEqual(job.error_class, ERROR_DISK_FULL)
+        self.assertEqual(self.calls, 1)
+        self.assertFalse(os.path.exists(job.staging_path))
+        self.assertFalse(os.path.exists(os.path.join(self.output, STAGING_DIR_NAME)))
+
+    def test_cancelled_job_removes_its_staging_folder(self):
+        started = threading.Event()
+
+        def fetch_media(url, output_path='.', *args, staging_path=None, cancel_event=None, **kwargs):
+            self.write_partial(staging_path)
+            started.set()
+            cancel_event.wait(5)
+            raise DownloadCancelled("Download cancelled by user")
+
+        with mock.patch.object(engine, 'fetch_media', fetch_media):
+            job = self.queue.add('https://example.com/v/cancel', self.output)
+            self.assertTrue(started.wait(5))
+            self.assertTrue(os.listdir(job.staging_path))
+            self.queue.cancel(job.job_id)
+            self.queue.wait()
+
+        self.assertEqual(job.state, DownloadJob.CANCELLED)
+        self.assertFalse(os.path.exists(job.staging_path))
+
+if __name__ == '__main__':
+    unittest.main()